@@ -0,0 +1,173 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import os
+import signal
+from multiprocessing import Process, Queue
+from Queue import Empty
+
+import numpy as np
+
+
+class BackgroundValidator(object):
+    """
+    Computes val_loss and WER of snapshots of the model weights in a background worker process,
+    so training continues while the validation data is evaluated
+
+    Every epoch a random subset of subset_batches validation batches (the same subset each epoch) is evaluated,
+    and every full_every epochs all validation batches. The worker builds its own copy of the model from the
+    architecture of the first snapshot, and only receives the weights after that.
+
+    Args:
+        validation_gen (DataGenerator): data generator for validation data
+        subset_batches (int, default=0): number of batches evaluated every epoch, 0 evaluates no subset
+        full_every (int, default=1): evaluate all batches every this many epochs, 0 never evaluates all batches
+        seed (int, default=0): seed of the random subset
+        use_gpu (boolean, default=False): whether the worker may use the GPUs, by default it runs on the CPU
+            so it does not take GPU memory from training
+
+    Note:
+        The worker process is started when the validator is created. Create it before the model (see
+        worker_utils.start_workers). Call close() to stop the worker.
+
+    """
+
+    def __init__(self, validation_gen, subset_batches=0, full_every=1, seed=0, use_gpu=False):
+        self.validation_gen = validation_gen
+        self.full_every = full_every
+        self.use_gpu = use_gpu
+
+        n_batches = len(validation_gen)
+        subset_batches = min(subset_batches, n_batches)
+        self.subset = np.sort(np.random.RandomState(seed).choice(n_batches, subset_batches, replace=False))
+
+        self.pending = 0
+        self._sent_architecture = False
+        self._tasks = Queue()
+        self._results = Queue()
+        self.process = Process(target=_validate_snapshots,
+                               args=(validation_gen, self._tasks, self._results, use_gpu))
+        self.process.daemon = True
+        self.process.start()
+
+    def batches_for_epoch(self, epoch):
+        """
+        Indexes of the validation batches evaluated after an epoch
+
+        :param epoch: epoch number, starting at 0
+        :return: np.ndarray with batch indexes, empty if nothing is evaluated after this epoch
+        """
+        if self.full_every and (epoch + 1) % self.full_every == 0:
+            return np.arange(len(self.validation_gen))
+        return self.subset
+
+    def submit(self, epoch, model):
+        """
+        Evaluates a snapshot of the current weights of model in the background
+
+        :param epoch: epoch number, starting at 0
+        :param model: Keras Model with the CTC loss as output (see models.py), the model being trained
+        :return: True if the snapshot is evaluated, False if nothing is evaluated after this epoch
+        """
+        batches = self.batches_for_epoch(epoch)
+        if len(batches) == 0:
+            return False
+
+        # Copy of the weights, training may continue while they are sent to the worker
+        weights = model.get_weights()
+        architecture = None
+        if not self._sent_architecture:
+            architecture = model.to_json()
+            self._sent_architecture = True
+
+        self._tasks.put((epoch, architecture, weights, batches))
+        self.pending += 1
+        return True
+
+    def poll(self):
+        """
+        Results of the evaluations finished so far, without waiting
+
+        :return: list of result dictionaries with epoch, val_loss, wer, n_files and full (all batches evaluated)
+        """
+        results = []
+        while self.pending:
+            try:
+                results.append(self._get(block=False))
+            except Empty:
+                break
+        return results
+
+    def wait(self):
+        """
+        Waits for all submitted evaluations
+
+        :return: list of result dictionaries, see poll
+        """
+        results = []
+        while self.pending:
+            results.append(self._get(block=True))
+        return results
+
+    def close(self):
+        """Stops the worker process"""
+        if self.process is not None:
+            self._tasks.put(None)
+            self.process.join(10)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+
+    def _get(self, block):
+        result = self._results.get(block)
+        self.pending -= 1
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def _validate_snapshots(validation_gen, tasks, results, use_gpu):
+    # Interrupts are handled by the main process, which stops the worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if not use_gpu:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+    # Keras is set up in the worker, after the process has been forked
+    from keras.models import model_from_json
+
+    import models
+    from utils.train_utils import calc_loss_and_wer, get_eval_func
+
+    model = None
+    eval_func = None
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        epoch, architecture, weights, batches = task
+        try:
+            if model is None:
+                model = model_from_json(architecture, custom_objects={'clipped_relu': models.clipped_relu})
+                eval_func = get_eval_func(model)
+            model.set_weights(weights)
+
+            val_loss, wer = calc_loss_and_wer(eval_func, (validation_gen[i] for i in batches))
+            results.put({'epoch': epoch,
+                         'val_loss': val_loss,
+                         'wer': wer[1],
+                         'n_files': len(wer[0]),
+                         'full': len(batches) == len(validation_gen)})
+        except Exception as e:
+            results.put(e)
@@ -0,0 +1,246 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import json
+import os
+import re
+import shutil
+from Queue import Queue
+from threading import Thread
+
+import h5py
+import keras
+import keras.backend as K
+import numpy as np
+# Private helper of keras.models.save_model, the file format written here is that of Keras 2.1.5
+# (pinned in requirements.txt). Check _write_hdf5 against save_model when upgrading Keras
+from keras.engine.topology import _save_attributes_to_hdf5_group
+
+
+class CheckpointWriter(object):
+    """
+    Saves Keras models to HDF5 files from a background thread, so training only waits for a copy of the weights
+
+    save() copies the weights (and optionally the optimizer state) to memory, a background thread writes them
+    in the format of keras.models.save_model, so checkpoints are loaded with load_model as before. Each file is
+    written to a temporary file first and renamed, so a checkpoint is never left partly written.
+
+    Args:
+        keep (int, default=1): number of checkpoints kept of each path. With more than one, each checkpoint is
+            written to the path with the epoch added to the file name (e.g. model_epoch10.h5), and the path
+            itself links to the latest checkpoint. The checkpoint files of the path already on disk, e.g. of an
+            earlier run, count as well: only the keep latest written are kept
+        max_pending (int, default=2): maximum number of checkpoints waiting to be written, save() waits when
+            more checkpoints are pending
+
+    Note:
+        Call close() at the end of training to wait for the last checkpoints to be written.
+
+    """
+
+    def __init__(self, keep=1, max_pending=2):
+        self.keep = max(1, keep)
+        self.error = None
+
+        # id(model) -> configuration and weight names of model, which do not change during training
+        self._configs = {}
+
+        self._queue = Queue(maxsize=max_pending)
+        self._thread = Thread(target=self._write_checkpoints)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def save(self, model, path, epoch=None, include_optimizer=False):
+        """
+        Copies the weights of model to memory, they are written to path in the background
+
+        :param model: Keras Model
+        :param path: path of the .h5 file
+        :param epoch: epoch number (starting at 0), added to the file name when keeping more than one checkpoint
+        :param include_optimizer: whether to save the state of the optimizer (of a compiled model) as well
+        """
+        self._raise_error()
+
+        include_optimizer = include_optimizer and getattr(model, 'optimizer', None) is not None
+        config = self._get_config(model, include_optimizer)
+        weights = model.get_weights()
+        optimizer_weights = model.optimizer.get_weights() if include_optimizer else None
+
+        self._queue.put((path, epoch, config, weights, optimizer_weights))
+
+    def wait(self):
+        """Waits until all checkpoints saved so far are written"""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Waits for the pending checkpoints and stops the background thread"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _get_config(self, model, include_optimizer):
+        key = (id(model), include_optimizer)
+        if key not in self._configs:
+            config = {'model_config': json.dumps({'class_name': model.__class__.__name__,
+                                                  'config': model.get_config()}, default=_get_json_type),
+                      'layers': [(layer.name, _weight_names(layer.weights)) for layer in model.layers],
+                      'training_config': None,
+                      'optimizer_weights': None}
+            if include_optimizer:
+                config['training_config'] = json.dumps({
+                    'optimizer_config': {'class_name': model.optimizer.__class__.__name__,
+                                         'config': model.optimizer.get_config()},
+                    'loss': model.loss,
+                    'metrics': model.metrics,
+                    'sample_weight_mode': model.sample_weight_mode,
+                    'loss_weights': model.loss_weights}, default=_get_json_type)
+                config['optimizer_weights'] = _weight_names(model.optimizer.weights)
+            self._configs[key] = config
+        return self._configs[key]
+
+    def _write_checkpoints(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                self._write_checkpoint(*task)
+            except Exception as e:
+                print "Could not write checkpoint: ", e
+                self.error = e
+            finally:
+                self._queue.task_done()
+
+    def _write_checkpoint(self, path, epoch, config, weights, optimizer_weights):
+        if self.keep > 1 and epoch is not None:
+            root, ext = os.path.splitext(path)
+            target = '%s_epoch%d%s' % (root, epoch + 1, ext)
+        else:
+            target = path
+
+        tmp_path = '%s.%d.tmp' % (target, os.getpid())
+        _write_hdf5(tmp_path, config, weights, optimizer_weights)
+        os.rename(tmp_path, target)
+
+        if target == path:
+            return
+
+        # path links to the latest checkpoint, replaced in one rename
+        link_path = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            os.link(target, link_path)
+        except OSError:
+            shutil.copyfile(target, link_path)
+        os.rename(link_path, path)
+
+        for old in _checkpoint_files(path)[:-self.keep]:
+            os.remove(old)
+
+
+def _checkpoint_files(path):
+    """
+    Checkpoint files of path written with the epoch in the file name (see CheckpointWriter), found on disk
+
+    :param path: path of the .h5 file
+    :return: list of paths, oldest first by modification time (then epoch)
+    """
+    root, ext = os.path.splitext(os.path.abspath(path))
+    directory, name = os.path.split(root)
+    pattern = re.compile(re.escape(name) + r'_epoch(\d+)' + re.escape(ext) + '$')
+
+    files = []
+    for filename in os.listdir(directory):
+        match = pattern.match(filename)
+        if match:
+            file_path = os.path.join(directory, filename)
+            files.append((os.path.getmtime(file_path), int(match.group(1)), file_path))
+
+    return [file_path for _, _, file_path in sorted(files)]
+
+
+def _weight_names(symbolic_weights):
+    """Names of weights as stored by Keras"""
+    names = []
+    for i, w in enumerate(symbolic_weights):
+        name = str(w.name) if getattr(w, 'name', None) else 'param_' + str(i)
+        names.append(name.encode('utf8'))
+    return names
+
+
+def _write_hdf5(path, config, weights, optimizer_weights):
+    """Writes a model file like keras.models.save_model, from weights already copied to memory"""
+    with h5py.File(path, mode='w') as f:
+        f.attrs['keras_version'] = str(keras.__version__).encode('utf8')
+        f.attrs['backend'] = K.backend().encode('utf8')
+        f.attrs['model_config'] = config['model_config'].encode('utf8')
+
+        model_weights_group = f.create_group('model_weights')
+        _save_attributes_to_hdf5_group(model_weights_group, 'layer_names',
+                                       [name.encode('utf8') for name, _ in config['layers']])
+        model_weights_group.attrs['backend'] = K.backend().encode('utf8')
+        model_weights_group.attrs['keras_version'] = str(keras.__version__).encode('utf8')
+
+        # The weights of the model are the weights of its layers after each other
+        start = 0
+        for layer_name, weight_names in config['layers']:
+            layer_group = model_weights_group.create_group(layer_name)
+            _save_attributes_to_hdf5_group(layer_group, 'weight_names', weight_names)
+            _write_datasets(layer_group, weight_names, weights[start:start + len(weight_names)])
+            start += len(weight_names)
+
+        if optimizer_weights is not None:
+            f.attrs['training_config'] = config['training_config'].encode('utf8')
+            if optimizer_weights:
+                optimizer_weights_group = f.create_group('optimizer_weights')
+                optimizer_weights_group.attrs['weight_names'] = config['optimizer_weights']
+                _write_datasets(optimizer_weights_group, config['optimizer_weights'], optimizer_weights)
+
+        f.flush()
+
+
+def _write_datasets(group, names, values):
+    for name, value in zip(names, values):
+        dataset = group.create_dataset(name, value.shape, dtype=value.dtype)
+        if not value.shape:
+            dataset[()] = value
+        else:
+            dataset[:] = value
+
+
+def _get_json_type(obj):
+    """Serializes objects in model and training configurations to JSON, as keras.models.save_model"""
+    if hasattr(obj, 'get_config'):
+        return {'class_name': obj.__class__.__name__, 'config': obj.get_config()}
+
+    if type(obj).__module__ == np.__name__:
+        if isinstance(obj, np.ndarray):
+            return {'type': type(obj), 'value': obj.tolist()}
+        return obj.item()
+
+    # Functions, e.g. the loss function
+    if callable(obj):
+        return obj.__name__
+
+    if type(obj).__name__ == type.__name__:
+        return obj.__name__
+
+    raise TypeError('Not JSON Serializable: ', obj)
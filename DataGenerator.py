@@ -15,14 +15,14 @@ If not, see http://www.gnu.org/licenses/.
 # Based on tutorial: https://stanford.edu/~shervine/blog/keras-how-to-generate-data-on-the-fly.html
 # and modified to fit data
 
-from random import shuffle as shuf
-
 import numpy as np
 from keras.utils import Sequence
-from librosa.feature import mfcc, melspectrogram
 
-from utils.feature_utils import load_audio, convert_and_pad_transcripts, extract_mfcc_and_pad, \
-    extract_mel_spectrogram_and_pad
+from utils.audio_store import AudioStore
+from utils.feature_store import FeatureStore
+from utils.feature_utils import load_audio, extract_features_batch, get_num_frames
+from utils.sampler import BucketSampler, FrameBudgetSampler, padding_ratio
+from utils.text_utils import encode_transcripts, gather_and_pad_labels
 
 
 class DataGenerator(Sequence):
@@ -30,13 +30,24 @@ class DataGenerator(Sequence):
     Thread safe data generator for the fit_generator
 
     Args:
-        df (Pandas.Dataframe): dataframes containing (filename, filesize, transcript)
+        df (Pandas.Dataframe): dataframes containing (filename, filesize, transcript), optionally num_samples
+            or n_frames used as length of each file for batching
         batch_size (int): size of each batch
         frame_length (int): size of each frame (samples per frame)
         hop_length (int): how far to move center of each frame when splitting audio time series
         mfcc_features (int, default=26): how many mfcc-features to extract for each frame
         epoch_length (int, default=0): the number of batches in each epoch, if set to zero it uses all available data
         shuffle (boolean, default=True): whether to shuffle the indexes in each batch
+        seed (int, default=0): seed for shuffling the indexes in each batch, batch i of epoch n is shuffled
+            with (seed + n, i)
+        feature_store_dir (str, default=None): directory of persistent FeatureStore, features are only extracted
+            once per audio file and read from the store in later epochs. If None features are extracted every time
+        audio_store_dir (str, default=None): directory of an AudioStore filled with build_audio_store.py, audio is
+            read from the store instead of being decoded. Files not in the store are decoded as usual
+        sampler (str, default=None): how to group audio files into batches. 'bucket' groups files of similar length
+            (see BucketSampler), reshuffled at each epoch end. If None batches are consecutive files in df
+        max_frames_per_batch (int, default=0): if set, batches hold a varying number of files up to this many padded
+            frames instead of batch_size files (see FrameBudgetSampler). Needs an n_frames column in df
 
     Note:
         If hop_length is shorter than frame_length it creates overlapping frames
@@ -46,7 +57,8 @@ class DataGenerator(Sequence):
     """
 
     def __init__(self, df, feature_type='mfcc', batch_size=32, frame_length=320, hop_length=160, n_mels=40,
-                 mfcc_features=26, epoch_length=0, shuffle=True):
+                 mfcc_features=26, epoch_length=0, shuffle=True, feature_store_dir=None, sampler=None,
+                 max_frames_per_batch=0, audio_store_dir=None, seed=0):
         self.df = df.copy()
         self.type = feature_type
         self.batch_size = batch_size
@@ -56,16 +68,83 @@ class DataGenerator(Sequence):
         self.n_mels = n_mels
         self.epoch_length = epoch_length
         self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+        if feature_store_dir:
+            self.feature_store = FeatureStore(feature_store_dir, feature_type=feature_type, frame_length=frame_length,
+                                              hop_length=hop_length, mfcc_features=mfcc_features, n_mels=n_mels)
+        else:
+            self.feature_store = None
+
+        if audio_store_dir:
+            self.audio_store = AudioStore(audio_store_dir)
+        else:
+            self.audio_store = None
 
         # Initializing indexes
         self.indexes = np.arange(len(self.df))
 
+        # All transcripts as integer sequences, converted once
+        self.labels, self.label_offsets = encode_transcripts(self.df['transcript'].values)
+
+        if max_frames_per_batch:
+            if sampler is not None:
+                raise ValueError('A sampler can not be combined with max_frames_per_batch: ', sampler)
+            if 'n_frames' not in self.df:
+                raise ValueError('max_frames_per_batch needs the number of frames (n_frames) of each file in df')
+            self.sampler = FrameBudgetSampler(self.get_lengths(), max_frames_per_batch)
+        elif sampler == 'bucket':
+            self.sampler = BucketSampler(self.get_lengths(), batch_size)
+        elif sampler is None:
+            self.sampler = None
+        else:
+            raise ValueError('Not a valid sampler: ', sampler)
+
     def __len__(self):
         """Denotes the number of batches per epoch"""
-        if (self.epoch_length == 0) | (self.epoch_length > int(np.floor(self.df.shape[0]/self.batch_size))):
-            self.epoch_length = int(np.floor(self.df.shape[0] / self.batch_size))
+        if self.sampler is not None:
+            n_batches = len(self.sampler)
+        else:
+            n_batches = int(np.floor(self.df.shape[0] / self.batch_size))
+
+        if (self.epoch_length == 0) | (self.epoch_length > n_batches):
+            self.epoch_length = n_batches
         return self.epoch_length
 
+    def on_epoch_end(self):
+        """Makes new batches for the next epoch when using a sampler"""
+        self.epoch += 1
+        if self.sampler is not None:
+            self.sampler.on_epoch_end()
+
+    def get_lengths(self):
+        """
+        Length of each audio file in df, in number of frames or samples if known or else as file size
+
+        :return: np.ndarray with lengths
+        """
+        if 'n_frames' in self.df:
+            return self.df['n_frames'].values
+        if 'num_samples' in self.df:
+            return self.df['num_samples'].values
+        return self.df['filesize'].values
+
+    def padding_ratio(self, epoch=None):
+        """
+        Share of the features in the batches of an epoch that is zero-padding
+
+        :param epoch: epoch number, if None the current epoch
+        :return: padded frames / all frames
+        """
+        if self.sampler is not None:
+            if epoch is None:
+                epoch = self.sampler.epoch
+            return self.sampler.padding_ratios[epoch]
+
+        batches = [self.indexes[i * self.batch_size:(i + 1) * self.batch_size] for i in range(len(self))]
+        return padding_ratio(self.get_lengths(), batches)
+
     def __getitem__(self, batch_index):
         """
         Generates a batch of correctly shaped X and Y data
@@ -81,19 +160,44 @@ class DataGenerator(Sequence):
 
         """
 
+        return self.generate_batch(self.get_indexes_in_batch(batch_index))
+
+    def get_indexes_in_batch(self, batch_index):
+        """
+        Indexes (rows in df) of the audio files in a batch
+
+        :param batch_index: index of the batch
+        :return: np.ndarray with indexes of the audio files in the batch
+        """
         # Generate indexes of current batch
-        indexes_in_batch = self.indexes[batch_index * self.batch_size:(batch_index + 1) * self.batch_size]
+        if self.sampler is not None:
+            indexes_in_batch = self.sampler.batches[batch_index]
+        else:
+            indexes_in_batch = self.indexes[batch_index * self.batch_size:(batch_index + 1) * self.batch_size]
 
-        # Shuffle indexes within current batch if shuffle=true
+        # Shuffle indexes within current batch if shuffle=true, without changing the batches themselves
         if self.shuffle:
-            shuf(indexes_in_batch)
+            rng = np.random.RandomState([self.seed + self.epoch, batch_index])
+            indexes_in_batch = rng.permutation(indexes_in_batch)
+
+        return indexes_in_batch
 
-        # Load audio and transcripts
-        x_data_raw, y_data_raw, sr = load_audio(self.df, indexes_in_batch)
+    def generate_batch(self, indexes_in_batch):
+        """
+        Generates a batch of correctly shaped X and Y data from the audio files at indexes_in_batch
+
+        :param indexes_in_batch: indexes (rows in df) of the audio files in the batch
+        :return: input and output dictionaries, see __getitem__
+        """
+
+        # Load audio, transcripts are converted once in __init__
+        x_data_raw, _, sr = load_audio(self.df, indexes_in_batch, feature_store=self.feature_store,
+                                       audio_store=self.audio_store)
+        paths = self.df['filename'].values[indexes_in_batch]
 
         # Preprocess and pad data
-        x_data, input_length = self.extract_features_and_pad(x_data_raw, sr)
-        y_data, label_length = convert_and_pad_transcripts(y_data_raw)
+        x_data, input_length = self.extract_features_and_pad(x_data_raw, sr, paths)
+        y_data, label_length = gather_and_pad_labels(self.labels, self.label_offsets, indexes_in_batch)
 
         # print "\nx_data shape: ", x_data.shape
         # print "y_data shape: ", y_data.shape
@@ -107,76 +211,75 @@ class DataGenerator(Sequence):
                   'input_length': input_length,
                   'label_length': label_length}
 
-        outputs = {'ctc': np.zeros([self.batch_size])} # dummy data for dummy loss function
+        outputs = {'ctc': np.zeros([len(indexes_in_batch)])} # dummy data for dummy loss function
 
         return inputs, outputs
 
-    def extract_features_and_pad(self, x_data_raw, sr):
+    def extract_features_and_pad(self, x_data_raw, sr, paths=None):
         """
         Converts list of audio time series to MFCC or melspectrogram
         Zero-pads each sequence to be equal length to the longest sequence.
         Stores the length of each feature-sequence before padding for the CTC
 
-        :param x_data_raw: list with audio time series
+        Features are extracted for the whole batch at once (see extract_features_batch).
+        If a feature store is enabled, features are read from the store and only extracted for files not in the store.
+
+        :param x_data_raw: list with audio time series (None for files already in the feature store)
         :param sr: sampling rate of frames
+        :param paths: paths of the audio files, used as keys when a feature store is enabled
         :return: x_data: numpy array with padded feature-sequence (MFCC or melspectrogram)
                  input_length: numpy array containing unpadded length of each feature-sequence
         """
 
-        # Finds longest frame in batch for padding
-        max_x_length = self.get_seq_size(max(x_data_raw, key=len), sr)
-
         if self.type == 'mfcc':
-            x_data = np.empty([0, max_x_length, self.mfcc_features])
-            len_x_seq = []
+            n_features = self.mfcc_features
+        elif self.type == 'spectrogram':
+            n_features = self.n_mels
+        else:
+            raise ValueError('Not a valid feature type: ', self.type)
 
-            # Extract mfcc features and pad so every frame-sequence is equal max_x_length
-            for i in range(0, len(x_data_raw)):
-                x, x_len = extract_mfcc_and_pad(x_data_raw[i], sr, max_x_length, self.frame_length, self.hop_length,
-                                                self.mfcc_features, self.n_mels)
-                x_data = np.insert(x_data, i, x, axis=0)
-                len_x_seq.append(x_len - 2)  # -2 because ctc discards the first two outputs of the rnn network
+        if self.feature_store is None or paths is None:
+            # Extract features for the whole batch at once
+            x_data, x_length = extract_features_batch(x_data_raw, sr, self.type, self.frame_length,
+                                                      self.hop_length, self.mfcc_features, self.n_mels)
+            return x_data, x_length - 2  # -2 because ctc discards the first two outputs of the rnn network
 
-            # Convert input length list to numpy array
-            input_length = np.array(len_x_seq)
-            return x_data, input_length
+        stored = [self.feature_store.get(path) for path in paths]
+        missing = [i for i, x in enumerate(stored) if x is None]
 
-        elif self.type == 'spectrogram':
-            x_data = np.empty([0, max_x_length, self.n_mels])
-            len_x_seq = []
+        # Length of each feature-sequence, known before extracting any features
+        x_length = np.array([self.get_seq_size(frames, sr) if x is None else x.shape[0]
+                             for frames, x in zip(x_data_raw, stored)])
 
-            # Extract mel spectrogram features and pad so every frame-sequence is equal max_x_length
-            for i in range(0, len(x_data_raw)):
-                x, x_len = extract_mel_spectrogram_and_pad(x_data_raw[i], sr, max_x_length, self.frame_length,
-                                                           self.hop_length, self.n_mels)
-                x_data = np.insert(x_data, i, x, axis=0)
-                len_x_seq.append(x_len - 2)  # -2 because ctc discards the first two outputs of the rnn network
+        x_data = np.zeros([len(x_data_raw), x_length.max(), n_features], dtype=np.float32)
 
-            # Convert input length list to numpy array
-            input_length = np.array(len_x_seq)
-            return x_data, input_length
+        for i in range(0, len(x_data_raw)):
+            if stored[i] is not None:
+                x_data[i, :x_length[i]] = stored[i]
 
-        else:
-            raise ValueError('Not a valid feature type: ', self.type)
+        # Extract features of the files not in the store at once, and add them to the store
+        if missing:
+            x_missing, _ = extract_features_batch([x_data_raw[i] for i in missing], sr, self.type, self.frame_length,
+                                                  self.hop_length, self.mfcc_features, self.n_mels)
+            for j, i in enumerate(missing):
+                x_data[i, :x_length[i]] = x_missing[j, :x_length[i]]
+                self.feature_store.put(paths[i], x_missing[j, :x_length[i]])
+
+        # -2 because ctc discards the first two outputs of the rnn network
+        input_length = x_length - 2
+        return x_data, input_length
 
     def get_seq_size(self, frames, sr):
         """
-        Get audio sequence size of audio time series when converted to mfcc-features or mel spectrogram
+        Get audio sequence size of audio time series when converted to mfcc-features or mel spectrogram.
+        Computed from the number of samples, without extracting the features.
 
         :param frames: audio time series
         :param sr: sampling rate of frames
         :return: sequence size of mfcc-converted audio
         """
 
-        if self.type == 'mfcc':
-            mfcc_frames = mfcc(frames, sr, n_fft=self.frame_length, hop_length=self.hop_length,
-                               n_mfcc=self.mfcc_features, n_mels=self.n_mels)
-            return mfcc_frames.shape[1]
-
-        elif self.type == 'spectrogram':
-            spectrogram = melspectrogram(frames, sr, n_fft=self.frame_length, hop_length=self.hop_length,
-                                         n_mels=self.n_mels)
-            return spectrogram.shape[1]
+        if self.type not in ('mfcc', 'spectrogram'):
+            raise ValueError('Not a valid feature type: ', self.type)
 
-        else:
-            raise ValueError('Not a valid feature type: ', self.type)
\ No newline at end of file
+        return get_num_frames(len(frames), self.frame_length, self.hop_length)
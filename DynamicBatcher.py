@@ -0,0 +1,214 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import time
+from collections import deque
+from threading import Condition, Event, Thread
+
+import numpy as np
+
+from utils.feature_utils import extract_features_batch
+from utils.text_utils import int_sequences_to_text
+from utils.train_utils import greedy_decode
+
+
+class DynamicBatcher(object):
+    """
+    Transcribes audio of concurrent requests in batches, for serving a model
+
+    Requests wait in a queue until max_batch_size requests are waiting, or the oldest request has waited
+    max_wait seconds. A background thread then transcribes the oldest request together with the waiting
+    requests closest to it in length, so little of the batch is padding.
+
+    Args:
+        test_func: function that takes preprocessed audio input and outputs network predictions
+        decoder: function decoding network output, see max_decode. Default is greedy_decode
+        feature_type (string, default='mfcc'): mfcc or spectrogram
+        frame_length (int, default=320): length of the frames to be extracted
+        hop_length (int, default=160): length of hops (for overlap)
+        mfcc_features (int, default=26): number of mfcc features to extract
+        n_mels (int, default=40): number of mels
+        sr (int, default=16000): sampling rate of the audio the model is trained on
+        max_batch_size (int, default=16): maximum number of requests in a batch
+        max_wait (float, default=0.02): seconds the oldest request waits for more requests before its batch runs
+        latency_window (int, default=1000): number of latest requests in the latency percentiles of metrics()
+
+    Note:
+        Call close() to stop the background thread.
+
+    """
+
+    def __init__(self, test_func, decoder=None, feature_type='mfcc', frame_length=320, hop_length=160,
+                 mfcc_features=26, n_mels=40, sr=16000, max_batch_size=16, max_wait=0.02, latency_window=1000):
+        self.test_func = test_func
+        self.decoder = decoder if decoder is not None else greedy_decode
+        self.feature_params = {'feature_type': feature_type,
+                               'frame_length': frame_length,
+                               'hop_length': hop_length,
+                               'mfcc_features': mfcc_features,
+                               'n_mels': n_mels}
+        self.sr = sr
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        # Requests waiting to be batched, oldest first
+        self.pending = []
+        self.closed = False
+        self._condition = Condition()
+
+        # Metrics
+        self.n_requests = 0
+        self.n_batches = 0
+        self.batch_fill = 0.0
+        self.latencies = deque(maxlen=latency_window)
+
+        self._thread = Thread(target=self._run_batches)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def transcribe(self, frames, sr):
+        """
+        Transcribes an audio time series, waits until its batch has run
+
+        :param frames: audio time series
+        :param sr: sampling rate of audio time series
+        :return: dictionary with transcript, latency (seconds from the request to the transcript),
+                 queue_time (seconds waiting for the batch) and batch_size
+        """
+        if sr != self.sr:
+            raise ValueError('Not a valid sampling rate: ', sr)
+        if len(frames.shape) != 1:
+            raise ValueError('Not a valid mono audio time series of shape: ', frames.shape)
+        if len(frames) < self.feature_params['frame_length']:
+            raise ValueError('Not a valid audio length (samples): ', len(frames))
+
+        request = _Request(frames)
+        with self._condition:
+            if self.closed:
+                raise RuntimeError('Batcher is closed')
+            self.pending.append(request)
+            self._condition.notify()
+
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def metrics(self):
+        """
+        :return: dictionary with queue_depth (requests waiting), requests and batches run so far,
+                 batch_fill (average share of max_batch_size used), p50_latency and p99_latency (seconds)
+        """
+        with self._condition:
+            latencies = list(self.latencies)
+            metrics = {'queue_depth': len(self.pending),
+                       'requests': self.n_requests,
+                       'batches': self.n_batches,
+                       'batch_fill': self.batch_fill / self.n_batches if self.n_batches else 0.0}
+
+        metrics['p50_latency'] = float(np.percentile(latencies, 50)) if latencies else 0.0
+        metrics['p99_latency'] = float(np.percentile(latencies, 99)) if latencies else 0.0
+        return metrics
+
+    def close(self):
+        """Transcribes the waiting requests and stops the background thread"""
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run_batches(self):
+        while True:
+            with self._condition:
+                while not self.pending and not self.closed:
+                    self._condition.wait()
+                if not self.pending:
+                    return
+
+                # Waits for more requests, until the batch is full or the oldest request has waited max_wait
+                deadline = self.pending[0].arrival + self.max_wait
+                while len(self.pending) < self.max_batch_size and not self.closed:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                batch = self._take_batch()
+
+            try:
+                self._transcribe_batch(batch)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+                    request.latency = time.time() - request.arrival
+
+            with self._condition:
+                self.n_requests += len(batch)
+                self.n_batches += 1
+                self.batch_fill += len(batch) / float(self.max_batch_size)
+                self.latencies.extend(request.latency for request in batch)
+
+            for request in batch:
+                request.done.set()
+
+    def _take_batch(self):
+        """Removes the oldest request and the waiting requests closest to it in length from pending"""
+        if len(self.pending) <= self.max_batch_size:
+            batch, self.pending = self.pending, []
+            return batch
+
+        lengths = np.array([len(request.frames) for request in self.pending])
+        order = np.argsort(lengths, kind='mergesort')
+        oldest = int(np.flatnonzero(order == 0)[0])
+
+        # Window of max_batch_size requests in length order including the oldest, with the smallest length range
+        starts = np.arange(max(0, oldest - self.max_batch_size + 1),
+                           min(oldest, len(order) - self.max_batch_size) + 1)
+        spread = lengths[order[starts + self.max_batch_size - 1]] - lengths[order[starts]]
+        start = starts[np.argmin(spread)]
+
+        taken = set(order[start:start + self.max_batch_size].tolist())
+        batch = [request for i, request in enumerate(self.pending) if i in taken]
+        self.pending = [request for i, request in enumerate(self.pending) if i not in taken]
+        return batch
+
+    def _transcribe_batch(self, batch):
+        started = time.time()
+        x_data, x_length = extract_features_batch([request.frames for request in batch], self.sr,
+                                                  **self.feature_params)
+        y_pred = self.test_func([x_data])[0]
+
+        # -2 because ctc discards the first two outputs of the rnn network
+        decoded, decoded_length = self.decoder(y_pred[:, 2:], x_length - 2)
+        transcripts = int_sequences_to_text(decoded, decoded_length)
+
+        finished = time.time()
+        for request, transcript in zip(batch, transcripts):
+            request.latency = finished - request.arrival
+            request.result = {'transcript': transcript,
+                              'latency': request.latency,
+                              'queue_time': started - request.arrival,
+                              'batch_size': len(batch)}
+
+
+class _Request(object):
+    """Audio of a request waiting to be transcribed, and its result when done"""
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.arrival = time.time()
+        self.done = Event()
+        self.result = None
+        self.error = None
+        self.latency = 0.0
@@ -18,7 +18,7 @@ import pandas
 from keras import Model
 from keras.callbacks import Callback
 
-from utils.train_utils import calc_wer, predict_on_batch
+from utils.train_utils import calc_loss_and_wer, calc_wer, predict_on_batch
 
 
 class LossCallback(Callback):
@@ -33,9 +33,24 @@ class LossCallback(Callback):
         checkpoint: how often (epochs) to save model
         path_to_save: path to save the model
         log_file_path: path to save logs during training
+        training_gen: DataGenerator for training data, with a sampler the padding ratio of each epoch is printed
+        eval_func: function giving the CTC loss and network predictions of a batch (see get_eval_func in
+            utils.train_utils). If given, val_loss and WER are computed in one pass over the validation data and
+            val_loss is added to the logs, so fit_generator should get no validation_data
+        validation_loader: optional ParallelLoader of validation_gen, generates the validation batches with eval_func
+        validator: optional BackgroundValidator of validation_gen. If given, a snapshot of the weights of model is
+            validated in the background after each epoch and training continues right away. Results are added to
+            the log when they are ready, val_loss is not added to the logs of fit_generator
+        writer: optional CheckpointWriter, checkpoints are written in the background instead of with model.save
+        path_to_save_best: optional path to save the model (with optimizer state) each time val_loss improves
+
+    Note:
+        With eval_func, add the callback before other callbacks using val_loss (e.g. ReduceLROnPlateau).
 
     """
-    def __init__(self, test_func, validation_gen, test_gen, model, checkpoint, path_to_save, log_file_path):
+    def __init__(self, test_func, validation_gen, test_gen, model, checkpoint, path_to_save, log_file_path,
+                 training_gen=None, eval_func=None, validation_loader=None, validator=None, writer=None,
+                 path_to_save_best=None):
         self.test_func = test_func
         self.validation_gen = validation_gen
         self.test_gen = test_gen
@@ -43,6 +58,17 @@ class LossCallback(Callback):
         self.checkpoint = checkpoint
         self.path_to_save = path_to_save
         self.log_file_path = log_file_path
+        self.training_gen = training_gen
+        self.eval_func = eval_func
+        self.validation_loader = validation_loader
+        self.validator = validator
+        # fit_generator replaces self.model by the model it trains, e.g. the parallel model on multiple GPUs
+        self.base_model = model
+        self.writer = writer
+        self.path_to_save_best = path_to_save_best
+        self.best_val_loss = float('inf')
+        self._model_to_save = None
+        self._validation_batches = None
         self.values = []
         self.timestamp = datetime.now().strftime('%m-%d_%H%M') + ".csv"
 
@@ -52,15 +78,37 @@ class LossCallback(Callback):
         to calculate WER from validation data
         and save model and logs at checkpoints
         """
-        wer = calc_wer(self.test_func, self.validation_gen)
-        print " - average WER: ", wer[1], "\n"
-
-        self.values.append([logs.get('loss'), logs.get('val_loss'), wer[1]])
+        if self.validator is not None:
+            # Validated in the background, results of earlier epochs are added when ready
+            self.values.append([logs.get('loss'), None, None, None])
+            if self.validator.submit(epoch, self.base_model):
+                print " - validating in background"
+            self.add_results(self.validator.poll())
+        else:
+            if self.eval_func is not None:
+                val_loss, wer = calc_loss_and_wer(self.eval_func, self.validation_batches())
+                logs['val_loss'] = val_loss
+                print " - val_loss: ", val_loss
+            else:
+                wer = calc_wer(self.test_func, self.validation_gen)
+            print " - average WER: ", wer[1]
+            self.values.append([logs.get('loss'), logs.get('val_loss'), wer[1], len(wer[0])])
+
+        if self.training_gen is not None and self.training_gen.sampler is not None:
+            print " - padding ratio: ", self.training_gen.padding_ratio(epoch)
+        print ""
+
+        if self.path_to_save_best and logs.get('val_loss') is not None and logs['val_loss'] < self.best_val_loss:
+            self.best_val_loss = logs['val_loss']
+            # Only the best model is kept, not one file per epoch
+            self.save_model(self.model, self.path_to_save_best, include_optimizer=True)
+            print " - val_loss improved, saving model: ", self.path_to_save_best
 
         if ((epoch+1) % self.checkpoint) == 0:
             if self.path_to_save:
-                model_to_save = Model(self.model.inputs, self.model.outputs)
-                model_to_save.save(self.path_to_save)
+                if self._model_to_save is None:
+                    self._model_to_save = Model(self.model.inputs, self.model.outputs)
+                self.save_model(self._model_to_save, self.path_to_save, epoch)
             self.save_log()
 
     def on_train_end(self, logs={}):
@@ -68,6 +116,9 @@ class LossCallback(Callback):
         Method used by fit_generator() at the end of training
         to calculate the test WER and output prediction samples
         """
+        if self.validator is not None:
+            self.add_results(self.validator.wait())
+
         try:
             test_wer = calc_wer(self.test_func, self.test_gen)
             print "\n - Training ended, test wer: ", test_wer[1], " -"
@@ -86,11 +137,56 @@ class LossCallback(Callback):
 
         self.save_log()
 
+        if self.writer is not None:
+            self.writer.wait()
+
+    def save_model(self, model, path, epoch=None, include_optimizer=False):
+        """
+        Saves model to path, in the background if there is a CheckpointWriter
+
+        :param model: Keras Model to save
+        :param path: path of the .h5 file
+        :param epoch: epoch number, added to the file name when the writer keeps more than one checkpoint
+        :param include_optimizer: whether to save the state of the optimizer as well
+        """
+        if self.writer is not None:
+            self.writer.save(model, path, epoch, include_optimizer=include_optimizer)
+        else:
+            model.save(path, include_optimizer=include_optimizer)
+
+    def validation_batches(self):
+        """
+        Generates the batches of one pass over the validation data
+
+        :return: generator of (inputs, outputs) tuples, see DataGenerator.__getitem__
+        """
+        if self.validation_loader is None:
+            for batch_index in xrange(len(self.validation_gen)):
+                yield self.validation_gen[batch_index]
+            return
+
+        # The loader generates batches ahead across epochs, so the same generator is used in each epoch
+        if self._validation_batches is None:
+            self._validation_batches = self.validation_loader.generator()
+        for _ in xrange(len(self.validation_loader)):
+            yield next(self._validation_batches)
+
+    def add_results(self, results):
+        """
+        Adds results of the background validator to the log
+
+        :param results: list of result dictionaries, see BackgroundValidator.poll
+        """
+        for result in results:
+            print " - epoch ", result['epoch'] + 1, " val_loss: ", result['val_loss'], ", average WER: ", \
+                result['wer'], "(all files)" if result['full'] else "(subset of " + str(result['n_files']) + " files)"
+            self.values[result['epoch']][1:] = [result['val_loss'], result['wer'], result['n_files']]
+
     def save_log(self):
         """
-        Method to save logs (loss, val_loss, wer) during training
+        Method to save logs (loss, val_loss, wer and number of files validated) during training
         """
-        stats = pandas.DataFrame(data=self.values, columns=['loss', 'val_loss', 'wer'])
+        stats = pandas.DataFrame(data=self.values, columns=['loss', 'val_loss', 'wer', 'val_files'])
         stats.to_csv(self.log_file_path + "_" + self.timestamp)
         print "Log file saved: ", self.log_file_path + "_" + self.timestamp
 
@@ -0,0 +1,119 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import signal
+from collections import deque
+from multiprocessing import Pool
+
+import numpy as np
+
+# DataGenerator of the worker process, set by the pool initializer
+_data_gen = None
+
+# Timeout (seconds) when waiting for a batch, without a timeout Python 2 does not handle KeyboardInterrupt
+_BATCH_TIMEOUT = 24 * 60 * 60
+
+
+class ParallelLoader(object):
+    """
+    Generates the batches of a DataGenerator in a pool of worker processes, ahead of the training step
+
+    The main process decides the batches of each epoch and calls on_epoch_end() of the DataGenerator,
+    the workers only load audio and extract features. Batches are returned in order, and at most
+    prefetch batches are generated ahead, also across epoch boundaries.
+
+    Args:
+        data_gen (DataGenerator): data generator to load batches from
+        workers (int, default=2): number of worker processes
+        prefetch (int, default=10): maximum number of batches generated ahead of the training step
+        shuffle (boolean, default=False): whether to shuffle the order of the batches each epoch
+        seed (int, default=0): seed for the order of the batches, epoch n is shuffled with seed + n
+
+    Note:
+        Use as generator for fit_generator() with workers=0 and steps_per_epoch=len(loader).
+        The worker processes are started when the loader is created, call close() to stop them.
+
+    """
+
+    def __init__(self, data_gen, workers=2, prefetch=10, shuffle=False, seed=0):
+        self.data_gen = data_gen
+        self.workers = workers
+        self.prefetch = max(1, prefetch)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.pool = Pool(workers, initializer=_init_worker, initargs=(data_gen,))
+
+    def __len__(self):
+        """Number of batches per epoch"""
+        return len(self.data_gen)
+
+    def __iter__(self):
+        return self.generator()
+
+    def generator(self):
+        """
+        Yields batches of the DataGenerator, epoch after epoch
+
+        :return: generator of (inputs, outputs) tuples, see DataGenerator.__getitem__
+        """
+        batches = self.batch_indexes()
+        pending = deque()
+
+        for indexes_in_batch in batches:
+            pending.append(self.pool.apply_async(_generate_batch, (indexes_in_batch,)))
+            if len(pending) == self.prefetch:
+                break
+
+        while pending:
+            batch = pending.popleft().get(_BATCH_TIMEOUT)
+            pending.append(self.pool.apply_async(_generate_batch, (next(batches),)))
+            yield batch
+
+    def batch_indexes(self):
+        """
+        Yields the indexes of the audio files in each batch, epoch after epoch
+
+        :return: generator of np.ndarrays with indexes (rows in df) of the audio files in each batch
+        """
+        while True:
+            if self.shuffle:
+                order = np.random.RandomState(self.seed + self.epoch).permutation(len(self.data_gen))
+            else:
+                order = np.arange(len(self.data_gen))
+
+            for batch_index in order:
+                yield np.copy(self.data_gen.get_indexes_in_batch(batch_index))
+
+            self.data_gen.on_epoch_end()
+            self.epoch += 1
+
+    def close(self):
+        """Stops the worker processes"""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
+def _init_worker(data_gen):
+    # Interrupts are handled by the main process, which stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    global _data_gen
+    _data_gen = data_gen
+
+
+def _generate_batch(indexes_in_batch):
+    return _data_gen.generate_batch(indexes_in_batch)
@@ -0,0 +1,93 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import json
+import os
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from io import BytesIO
+
+from soundfile import read
+
+
+class TranscriptionServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server transcribing audio with a DynamicBatcher, each request is handled in its own thread
+
+    Endpoints:
+        POST /transcribe: audio file (e.g. .wav or .flac) as request body, or a JSON body {"path": "<audio file>"}
+            with an audio file on the server. Responds with JSON: transcript, latency, queue_time and batch_size
+        GET /metrics: JSON with queue_depth, requests, batches, batch_fill, p50_latency and p99_latency
+
+    Args:
+        batcher (DynamicBatcher): batcher transcribing the audio
+        host (string, default='127.0.0.1'): address to listen on
+        port (int, default=8000): port to listen on, 0 picks a free port (see server_address)
+
+    """
+    daemon_threads = True
+
+    def __init__(self, batcher, host='127.0.0.1', port=8000):
+        self.batcher = batcher
+        HTTPServer.__init__(self, (host, port), _TranscriptionHandler)
+
+
+class _TranscriptionHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._respond(200, self.server.batcher.metrics())
+        else:
+            self._respond(404, {'error': 'Not found: ' + self.path})
+
+    def do_POST(self):
+        if self.path != '/transcribe':
+            self._respond(404, {'error': 'Not found: ' + self.path})
+            return
+
+        body = self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+        try:
+            if self.headers.getheader('Content-Type', '').startswith('application/json'):
+                path = json.loads(body)['path']
+                if not os.path.isfile(path):
+                    self._respond(404, {'error': 'No such file: ' + path})
+                    return
+                frames, sr = read(path)
+            else:
+                frames, sr = read(BytesIO(body))
+        except Exception as e:
+            self._respond(400, {'error': 'Could not read audio: ' + str(e)})
+            return
+
+        try:
+            result = self.server.batcher.transcribe(frames, sr)
+        except ValueError as e:
+            self._respond(400, {'error': ''.join(str(arg) for arg in e.args)})
+            return
+        except Exception as e:
+            self._respond(500, {'error': str(e)})
+            return
+
+        self._respond(200, result)
+
+    def _respond(self, status, content):
+        body = json.dumps(content)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Requests are not logged, the batcher keeps the metrics
+        pass
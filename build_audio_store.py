@@ -0,0 +1,58 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import argparse
+from datetime import datetime
+
+from soundfile import read
+
+from data import combine_all_wavs_and_trans_from_csvs
+from utils.audio_store import AudioStore
+
+
+def main(args):
+    print "\nReading data: "
+    _, df = combine_all_wavs_and_trans_from_csvs(args.audio_dir)
+
+    store = AudioStore(args.audio_store)
+
+    print "\nFilling audio store: ", store.store_dir
+    print "Starting time: ", datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    paths = [path for path in df['filename'] if path not in store]
+    print len(df) - len(paths), " of ", len(df), " files already in store"
+
+    # Decode each file once, as 16 bit PCM
+    for i, path in enumerate(paths):
+        frames, sr = read(path, dtype='int16')
+        store.put(path, frames, sr)
+
+        if (i + 1) % 1000 == 0:
+            print " - ", i + 1, " of ", len(paths), " files done"
+
+    print "Added ", len(paths), " files, ", len(store), " files in store"
+    print "Ending time: ", datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--audio_dir', type=str, default="data_dir/librivox-train-clean-360.csv",
+                        help='Path to .csv file(s) of audio to decode, separated by comma.')
+    parser.add_argument('--audio_store', type=str, default="data_dir/audio_store",
+                        help='Directory of the audio store.')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,84 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import argparse
+from datetime import datetime
+
+from soundfile import read
+
+from data import combine_all_wavs_and_trans_from_csvs
+from utils.feature_store import FeatureStore
+from utils.feature_utils import extract_features_batch
+
+
+def main(args):
+    # Preprocessing params
+    feature_type = args.feature_type
+    mfcc_features = args.mfccs
+    n_mels = args.mels
+    frequency = 16           # Sampling rate of data in khz (LibriSpeech is 16khz)
+
+    print "\nReading data: "
+    _, df = combine_all_wavs_and_trans_from_csvs(args.audio_dir)
+
+    store = FeatureStore(args.feature_store, feature_type=feature_type, frame_length=20 * frequency,
+                         hop_length=10 * frequency, mfcc_features=mfcc_features, n_mels=n_mels)
+
+    print "\nFilling feature store: ", store.store_dir
+    print "Starting time: ", datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    paths = [path for path in df['filename'] if path not in store]
+    print len(df) - len(paths), " of ", len(df), " files already in store"
+
+    # Extract features for batch_size files at once
+    for start in range(0, len(paths), args.batch_size):
+        batch_paths = paths[start:start + args.batch_size]
+        x_data_raw = []
+        for path in batch_paths:
+            frames, sr = read(path)
+            x_data_raw.append(frames)
+
+        x_data, x_length = extract_features_batch(x_data_raw, sr, feature_type, 20 * frequency, 10 * frequency,
+                                                  mfcc_features, n_mels)
+        for i, path in enumerate(batch_paths):
+            store.put(path, x_data[i, :x_length[i]])
+
+        if (start // args.batch_size + 1) % 100 == 0:
+            print " - ", start + len(batch_paths), " of ", len(paths), " files done"
+
+    print "Added ", len(paths), " files, ", len(store), " files in store"
+    print "Ending time: ", datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--audio_dir', type=str, default="data_dir/librivox-train-clean-360.csv",
+                        help='Path to .csv file(s) of audio to extract features from, separated by comma.')
+    parser.add_argument('--feature_store', type=str, default="data_dir/feature_store",
+                        help='Directory of the feature store.')
+    parser.add_argument('--batch_size', type=int, default=32,
+                        help='Number of files to extract features from at once.')
+
+    # Preprocessing params, must match the ones used for training
+    parser.add_argument('--feature_type', type=str, default='mfcc',
+                        help='Feature extraction method: mfcc or spectrogram.')
+    parser.add_argument('--mfccs', type=int, default=26,
+                        help='Number of mfcc features per frame to extract.')
+    parser.add_argument('--mels', type=int, default=40,
+                        help='Number of mels to use in feature extraction.')
+
+    args = parser.parse_args()
+
+    main(args)
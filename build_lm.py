@@ -0,0 +1,67 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import argparse
+import codecs
+import os
+from datetime import datetime
+
+from data import combine_all_wavs_and_trans_from_csvs
+from utils.language_model import NgramLanguageModel, UNK, SENTENCE_START, SENTENCE_END
+
+
+def main(args):
+    print "\nReading data: "
+    _, df = combine_all_wavs_and_trans_from_csvs(args.audio_dir, sortagrad=False)
+
+    print "\nBuilding ", args.order, "-gram language model"
+    print "Starting time: ", datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    lm = NgramLanguageModel.build(df['transcript'], order=args.order)
+
+    lm_dir = os.path.dirname(args.lm_path)
+    if lm_dir and not os.path.exists(lm_dir):
+        os.makedirs(lm_dir)
+    lm.save(args.lm_path)
+
+    print "Vocabulary: ", len(lm.vocab), " words"
+    for n in range(1, lm.order + 1):
+        print " - ", n, "-grams: ", len(lm.keys[n - 1])
+    print "Saved language model: ", args.lm_path
+
+    # Vocabulary file for lexicon-constrained decoding
+    if args.vocab_path:
+        with codecs.open(args.vocab_path, 'w', 'utf-8') as f:
+            f.write(u'\n'.join(word for word in lm.vocab if word not in (UNK, SENTENCE_START, SENTENCE_END)))
+        print "Saved vocabulary: ", args.vocab_path
+    print "Ending time: ", datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--audio_dir', type=str, default="data_dir/librivox-train-clean-360.csv",
+                        help='Path to .csv file(s) with the transcripts to build the language model from, '
+                             'separated by comma.')
+    parser.add_argument('--lm_path', type=str, default="lm/lm.npz",
+                        help='Path to save the language model (.npz file).')
+    parser.add_argument('--order', type=int, default=3,
+                        help='Longest n-gram of the language model.')
+    parser.add_argument('--vocab_path', type=str, default='',
+                        help='Path to save the vocabulary (one word per line), e.g. as lexicon for predict.py. '
+                             'If empty no vocabulary is saved.')
+
+    args = parser.parse_args()
+
+    main(args)
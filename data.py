@@ -1,12 +1,20 @@
 # File from https://github.com/robmsmt/KerasDeepSpeech
 # which is under GNU Affero General Public License v3.0
 
+import hashlib
 import os
+from collections import Counter, OrderedDict
+from multiprocessing import Pool
 
+import numpy as np
 import pandas as pd
+from soundfile import info
 
 from utils.char_map import char_map
-from utils.text_utils import text_to_int_sequence
+from utils.feature_utils import get_num_frames
+
+# Changing the format of the manifest cache invalidates old caches
+MANIFEST_CACHE_VERSION = 1
 
 
 #######################################################
@@ -25,126 +33,293 @@ def clean(word):
     return new
 
 
-def combine_all_wavs_and_trans_from_csvs(csvslist, sortagrad=True, createwordlist=False, delBigTranscripts=True):
+def combine_all_wavs_and_trans_from_csvs(csvslist, sortagrad=True, createwordlist=False, delBigTranscripts=True,
+                                         frame_length=None, hop_length=None, use_cache=True):
     '''Assume that data is in csv already exists with data in form
         path, size, transcript
         this is best approach for loading in moz deepspeech processed files.
+        If frame_length and hop_length are given, an n_frames column with the number of feature frames
+        of each file is added, read from the audio file headers without decoding the audio.
+        If the csv files have a num_samples column (see add_audio_info), files are sorted by num_samples
+        instead of filesize, and n_frames is computed from it without reading the headers.
+        If use_cache, the parsed csv files and their statistics are cached in a binary file (see
+        get_manifest_cache_path), which is used instead of the csv files as long as they are unchanged.
+        The number of samples read from the audio file headers is added to the cache the first time it is
+        needed, so later starts do not open the audio files.
     '''
 
-    df_all = pd.DataFrame()
-
+    csvs = []
     for csv in csvslist.split(','):
         print("Reading csv:",csv)
-
         if os.path.isfile(csv):
-            try:
-                df_new = pd.read_csv(csv, sep=',', encoding='ascii')
-            except:
-                print("NOT - ASCII, use UTF-8")
-                df_new = pd.read_csv(csv, sep=',', encoding='utf-8')
-                df_new.transcript.replace({r'[^\x00-\x7F]+': ''}, regex=True, inplace=True)
+            csvs.append(csv)
 
-            df_all = df_all.append(df_new)
+    cache_path = get_manifest_cache_path(csvs, delBigTranscripts) if use_cache and csvs else None
+    cached = load_manifest_cache(cache_path) if cache_path else None
 
-    print("Finished reading in data")
-
-    if delBigTranscripts:
-        print("removing any sentences that are too big- tweetsize")
-        df_final = df_all[df_all['transcript'].map(len) <= 280]
+    if cached is None:
+        df_final, dataproperties = read_manifest(csvs, delBigTranscripts)
+        header_samples = None
+        # Saved below together with the header lengths if they are needed, so the cache is written once
+        if cache_path and not (frame_length and hop_length and 'num_samples' not in df_final):
+            save_manifest_cache(cache_path, df_final, dataproperties)
     else:
-        df_final = df_all
+        print("Read from cache:", cache_path)
+        df_final, dataproperties, header_samples = cached
+
+    print("Total number of files:", dataproperties['num_files'])
+    print("Total number of files (after reduction):", len(df_final))
+    print("max_intseq_length:", dataproperties['max_intseq_length'])
+    print("numclasses:", dataproperties['num_classes'])
+    print("max_trans_charlength:", dataproperties['max_trans_charlength'])
+    print("Words:", dataproperties['num_words'])
+    print("Vocab:", len(dataproperties['all_vocab']))
 
     # can output the word list here if required
     if createwordlist:
         df_final['transcript'].to_csv("./lm/df_all_word_list.csv", sep=',', header=False, index=False)  # reorder + out
 
-    listcomb = df_all['transcript'].tolist()
-    print("Total number of files:", len(listcomb))
+    if frame_length and hop_length:
+        df_final = df_final.copy()
+        if 'num_samples' in df_final:
+            df_final['n_frames'] = get_num_frames(df_final['num_samples'].values, frame_length, hop_length)
+        else:
+            if header_samples is None:
+                header_samples, _ = get_audio_info(df_final['filename'])
+                if cache_path:
+                    save_manifest_cache(cache_path, df_final, dataproperties, header_samples)
+            df_final['n_frames'] = get_num_frames(header_samples, frame_length, hop_length)
 
+    if sortagrad:
+        # Number of samples is the exact duration, filesize of compressed audio only a rough proxy
+        sort_by = 'num_samples' if 'num_samples' in df_final else 'filesize'
+        df_final = df_final.sort_values(by=sort_by, ascending=True)
+    else:
+        df_final = df_final.sample(frac=1).reset_index(drop=True)
+
+    #Added index reset
+    #df_final = df_final.reset_index(drop=True)
+
+    return dataproperties, df_final
 
-    listcomb = df_final['transcript'].tolist()
-    print("Total number of files (after reduction):", len(listcomb))
 
-    comb = []
+def read_manifest(csvs, delBigTranscripts=True):
+    '''Reads and concatenates the csv files, and computes the statistics of the transcripts.
+        Returns the dataframe and the data properties (see get_transcript_stats).
+    '''
+    df_list = []
+    for csv in csvs:
+        try:
+            df_new = pd.read_csv(csv, sep=',', encoding='ascii')
+        except:
+            print("NOT - ASCII, use UTF-8")
+            df_new = pd.read_csv(csv, sep=',', encoding='utf-8')
+            df_new.transcript.replace({r'[^\x00-\x7F]+': ''}, regex=True, inplace=True)
 
-    for t in listcomb:
-        #s = t.decode('utf-8').encode('ascii', errors='ignore')
-        comb.append(' '.join(t.split()))
+        df_list.append(df_new)
+
+    df_all = pd.concat(df_list) if df_list else pd.DataFrame(columns=['filename', 'filesize', 'transcript'])
+
+    print("Finished reading in data")
+
+    if delBigTranscripts:
+        print("removing any sentences that are too big- tweetsize")
+        df_final = df_all[df_all['transcript'].map(len) <= 280]
+    else:
+        df_final = df_all
 
     # print("Train/Test/Valid:",len(train_list_wavs), len(test_list_wavs), len(valid_list_wavs))
     # 6300 TIMIT
     # (4620, 840, 840) TIMIT
 
-    ## SIZE CHECKS
-    max_intseq_length = get_max_intseq(comb)
-    num_classes = get_number_of_char_classes()
-
-    print("max_intseq_length:", max_intseq_length)
-    print("numclasses:", num_classes)
-
-    # VOCAB CHECKS
-    all_words, max_trans_charlength = get_words(comb)
-    print("max_trans_charlength:", max_trans_charlength)
+    ## SIZE AND VOCAB CHECKS
+    word_counts, max_trans_charlength, max_intseq_length = get_transcript_stats(df_final['transcript'])
     # ('max_trans_charlength:', 80)
 
     ## TODO could readd the mfcc checks for safety
     # ('max_mfcc_len:', 778, 'at comb index:', 541)
 
-    all_vocab = set(all_words)
-    print("Words:", len(all_words))
-    print("Vocab:", len(all_vocab))
-
     dataproperties = {
         'target': "librispeech",
-        'num_classes': num_classes,
-        'all_words': all_words,
-        'all_vocab': all_vocab,
+        'num_classes': get_number_of_char_classes(),
+        'num_files': len(df_all),
+        'num_words': sum(word_counts.values()),
+        'word_counts': word_counts,
+        'all_vocab': set(word_counts),
         'max_trans_charlength': max_trans_charlength,
         'max_intseq_length': max_intseq_length
     }
 
-    if sortagrad:
-        df_final = df_final.sort_values(by='filesize', ascending=True)
-    else:
-        df_final = df_final.sample(frac=1).reset_index(drop=True)
-
-    #remove mem
-    del df_all
-    del listcomb
-
-    #Added index reset
-    #df_final = df_final.reset_index(drop=True)
-
-    return dataproperties, df_final
+    return df_final, dataproperties
 
 
 ##DATA CHECKS RUN ALL OF THESE
 
-def get_words(comb):
+def get_transcript_stats(transcripts):
+    '''Statistics of the transcripts, in one pass without converting them to int sequences.
+        Returns the count of each (cleaned) word, the max length of the transcripts with whitespace collapsed,
+        and the max length of those that can be converted to int sequences (see text_to_int_sequence).
+    '''
+    valid_chars = set(ch for ch in char_map if len(ch) == 1)
+    valid_chars.add(' ')
+
     max_trans_charlength = 0
-    all_words = []
+    max_intseq_length = 0
+    raw_counts = Counter()
+
+    for t in transcripts:
+        words = t.split()
+        sent = ' '.join(words)
+        raw_counts.update(words)
 
-    for count, sent in enumerate(comb):
-        # count length
         if len(sent) > max_trans_charlength:
             max_trans_charlength = len(sent)
-        # build vocab
-        for w in sent.split():
-            all_words.append(clean(w))
 
-    return all_words, max_trans_charlength
+        if not set(sent) <= valid_chars:
+            print("error at:", sent)
+        elif len(sent) > max_intseq_length:
+            max_intseq_length = len(sent)
 
+    # Clean each distinct word once
+    word_counts = Counter()
+    for word, count in raw_counts.iteritems():
+        word_counts[clean(word)] += count
 
-def get_max_intseq(comb):
-    max_intseq_length = 0
-    for x in comb:
+    return word_counts, max_trans_charlength, max_intseq_length
+
+
+def get_manifest_cache_path(csvs, delBigTranscripts=True):
+    '''Path of the cache of the csv files, in a .cache directory next to the first csv file.
+        The file name is a hash of the paths, modification times and sizes of the csv files, so a cache
+        is only found while the csv files are unchanged.
+    '''
+    key = [MANIFEST_CACHE_VERSION, delBigTranscripts]
+    for csv in csvs:
+        stat = os.stat(csv)
+        key.append((os.path.abspath(csv), stat.st_mtime, stat.st_size))
+
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(csvs[0])), '.cache')
+    return os.path.join(cache_dir, 'manifest_' + hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.npz')
+
+
+def save_manifest_cache(cache_path, df, dataproperties, header_samples=None):
+    '''Writes the dataframe column by column and its statistics to a .npz file.
+        Text columns are stored as newline separated utf-8 bytes.
+        header_samples is the optional number of samples of each file in df, read from the audio file headers.
+    '''
+    arrays = {'index': df.index.values,
+              'columns': np.array([c.encode('utf-8') for c in df.columns])}
+
+    for i, column in enumerate(df.columns):
+        values = df[column].values
+        if values.dtype == object:
+            arrays['text_%d' % i] = _encode_lines(values)
+        else:
+            arrays['values_%d' % i] = values
+
+    words = list(dataproperties['word_counts'])
+    arrays['words'] = _encode_lines(words)
+    arrays['word_counts'] = np.array([dataproperties['word_counts'][w] for w in words], dtype=np.int64)
+    arrays['stats'] = np.array([dataproperties['num_files'], dataproperties['max_trans_charlength'],
+                                dataproperties['max_intseq_length']], dtype=np.int64)
+    if header_samples is not None:
+        arrays['header_samples'] = np.asarray(header_samples, dtype=np.int64)
+
+    try:
+        if not os.path.exists(os.path.dirname(cache_path)):
+            os.makedirs(os.path.dirname(cache_path))
+
+        # Write to a temporary file first, so other processes never read a partly written cache
+        tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.rename(tmp_path, cache_path)
+    except (IOError, OSError) as e:
+        print("Could not write cache:", e)
+
+
+def load_manifest_cache(cache_path):
+    '''Reads a dataframe, its statistics and the number of samples from the audio file headers (None if not
+        cached yet) written by save_manifest_cache, or None if there is no cache
+    '''
+    if not os.path.isfile(cache_path):
+        return None
+
+    with np.load(cache_path) as arrays:
+        columns = [c.decode('utf-8') for c in arrays['columns']]
+        data = OrderedDict()
+        for i, column in enumerate(columns):
+            if 'text_%d' % i in arrays:
+                data[column] = _decode_lines(arrays['text_%d' % i], len(arrays['index']))
+            else:
+                data[column] = arrays['values_%d' % i]
+
+        df = pd.DataFrame(data, index=arrays['index'], columns=columns)
+
+        counts = arrays['word_counts'].tolist()
+        word_counts = Counter(dict(zip(_decode_lines(arrays['words'], len(counts)), counts)))
+        num_files, max_trans_charlength, max_intseq_length = arrays['stats'].tolist()
+        header_samples = arrays['header_samples'] if 'header_samples' in arrays else None
+
+    dataproperties = {
+        'target': "librispeech",
+        'num_classes': get_number_of_char_classes(),
+        'num_files': num_files,
+        'num_words': sum(word_counts.values()),
+        'word_counts': word_counts,
+        'all_vocab': set(word_counts),
+        'max_trans_charlength': max_trans_charlength,
+        'max_intseq_length': max_intseq_length
+    }
+
+    return df, dataproperties, header_samples
+
+
+def _encode_lines(values):
+    return np.frombuffer(u'\n'.join(values).encode('utf-8'), dtype=np.uint8)
+
+
+def _decode_lines(array, n_lines):
+    if n_lines == 0:
+        return []
+    return array.tobytes().decode('utf-8').split(u'\n')
+
+
+def get_audio_info(filenames, workers=8):
+    '''Number of samples and sampling rate of each audio file, read from the file headers in a pool of
+        worker processes without decoding the audio.
+    '''
+    filenames = list(filenames)
+    if workers > 1 and len(filenames) > workers:
+        pool = Pool(workers)
         try:
-            y = text_to_int_sequence(x)
-            if len(y) > max_intseq_length:
-                max_intseq_length = len(y)
-        except:
-            print("error at:", x)
-    return max_intseq_length
+            headers = pool.map(_read_header, filenames, chunksize=max(1, len(filenames) // (workers * 16)))
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        headers = [_read_header(f) for f in filenames]
+
+    headers = np.array(headers, dtype=np.int64).reshape(-1, 2)
+    return headers[:, 0], headers[:, 1]
+
+
+def add_audio_info(df, workers=8):
+    '''Adds num_samples, sample_rate and duration (seconds) columns with the length of each audio file
+        in df, read from the file headers (see get_audio_info).
+    '''
+    num_samples, sample_rate = get_audio_info(df['filename'], workers=workers)
+
+    df = df.copy()
+    df['num_samples'] = num_samples
+    df['sample_rate'] = sample_rate
+    df['duration'] = num_samples / sample_rate.astype(np.float64)
+    return df
+
+
+def _read_header(filename):
+    header = info(filename)
+    return header.frames, header.samplerate
 
 
 def get_number_of_char_classes():
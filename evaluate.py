@@ -0,0 +1,151 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import argparse
+from datetime import datetime
+
+import keras.backend as K
+
+from data import combine_all_wavs_and_trans_from_csvs
+from utils.evaluation import evaluate
+from utils.inference_utils import inference_input_dim, load_inference_model
+from utils.train_utils import get_decoder
+from utils.worker_utils import start_workers, stop_workers
+
+
+def main(args):
+    pool = None
+    try:
+        if not args.model_load:
+            raise ValueError()
+
+        frequency = 16           # Sampling rate of data in khz (LibriSpeech is 16khz)
+        frame_length = 20 * frequency
+        hop_length = 10 * frequency
+
+        print "\nReading test data: "
+        _, df = combine_all_wavs_and_trans_from_csvs(args.audio_dir)
+
+        # Model feature type, read from the model file without loading the model
+        feature_shape = inference_input_dim(args.model_load)
+        if not args.feature_type:
+            if feature_shape == 26:
+                feature_type = 'mfcc'
+            else:
+                feature_type = 'spectrogram'
+        else:
+            feature_type = args.feature_type
+
+        print "Feature type: ", feature_type
+
+        decoder = get_decoder(args.decoder, beam_width=args.beam_width, top_k=args.top_k,
+                              blank_threshold=args.blank_threshold, lm_path=args.lm, lm_weight=args.lm_weight,
+                              word_bonus=args.word_bonus, lexicon_path=args.lexicon)
+        print "Decoder: ", args.decoder
+
+        # Start the pool before loading the model (see worker_utils.start_workers)
+        pool = start_workers(args.workers, {'feature_type': feature_type, 'frame_length': frame_length,
+                                            'hop_length': hop_length, 'mfcc_features': args.mfccs,
+                                            'n_mels': args.mels}, decoder, args.audio_store)
+
+        # Load trained model for prediction only, without the CTC loss and optimizer.
+        # When loading a parallel model saved *while* running on GPU, use load_multi
+        test_func, _ = load_inference_model(args.model_load, load_multi=args.load_multi)
+        print "\nLoaded existing model: ", args.model_load
+
+        print "\n - Evaluating ", len(df), " files in ", args.audio_dir
+        start = datetime.now()
+        results, summary = evaluate(test_func, df, feature_type=feature_type, batch_size=args.batch_size,
+                                    frame_length=frame_length, hop_length=hop_length, mfcc_features=args.mfccs,
+                                    n_mels=args.mels, decoder=decoder, workers=args.workers,
+                                    audio_store_dir=args.audio_store, pool=pool)
+        print "Evaluation time: ", datetime.now() - start
+
+        if args.results_path:
+            results.to_csv(args.results_path, index=False)
+            print "Saved results of each file: ", args.results_path
+
+        print "Files: ", summary['num_files']
+        print "WER: ", summary['wer']
+        print "CER: ", summary['cer']
+        print "Average WER of files: ", summary['mean_wer']
+
+    except (Exception, StandardError, GeneratorExit, SystemExit) as e:
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        message = template.format(type(e).__name__, e.args)
+        print "e.args: ", e.args
+        print message
+
+    finally:
+        stop_workers(pool)
+
+        # Clear memory
+        K.clear_session()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    # Evaluation params:
+    parser.add_argument('--audio_dir', type=str, default="data_dir/librivox-test-clean.csv",
+                        help='Path to .csv file(s) of audio to evaluate, separated by comma.')
+    parser.add_argument('--batch_size', type=int, default=32,
+                        help='Number of files in each batch of the network.')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Number of worker processes for feature extraction and decoding.')
+    parser.add_argument('--results_path', type=str, default='',
+                        help='Path to save a .csv file with the prediction, WER and CER of each file. '
+                             'If empty no results are saved.')
+    parser.add_argument('--audio_store', type=str, default='',
+                        help='Directory of audio store made with build_audio_store.py. If empty audio is decoded.')
+
+    # Decoder params:
+    parser.add_argument('--decoder', type=str, default='greedy',
+                        help='Decoder of the network predictions: greedy or beam (CTC prefix beam search).')
+    parser.add_argument('--beam_width', type=int, default=16,
+                        help='Number of prefixes kept by the beam search after each frame.')
+    parser.add_argument('--top_k', type=int, default=8,
+                        help='Number of most probable characters of each frame searched by the beam search.')
+    parser.add_argument('--blank_threshold', type=float, default=0.999,
+                        help='Frames with a higher blank probability are skipped by the beam search.')
+    parser.add_argument('--lm', type=str, default='',
+                        help='Path of language model made with build_lm.py, used by the beam search. '
+                             'If empty no language model is used.')
+    parser.add_argument('--lm_weight', type=float, default=0.5,
+                        help='Weight of the language model log probabilities in the beam search.')
+    parser.add_argument('--word_bonus', type=float, default=1.0,
+                        help='Score added for each word in the beam search with a language model.')
+    parser.add_argument('--lexicon', type=str, default='',
+                        help='Path of vocabulary file (one word per line), the beam search only produces '
+                             'these words. If empty any sequence of characters is allowed.')
+
+    # Only need to specify these if feature params are changed from default (different than 26 MFCC and 40 mels)
+    parser.add_argument('--feature_type', type=str,
+                        help='Feature extraction method: mfcc or spectrogram. '
+                             'If none is specified it tries to detect feature type from input_shape.')
+    parser.add_argument('--mfccs', type=int, default=26,
+                        help='Number of mfcc features per frame to extract.')
+    parser.add_argument('--mels', type=int, default=40,
+                        help='Number of mels to use in feature extraction.')
+
+    # Model load params:
+    parser.add_argument('--model_load', type=str,
+                        help='Path of existing model to load, saved during training or exported with '
+                             'export_model.py.')
+    parser.add_argument('--load_multi', action='store_true',
+                        help='Load multi gpu model saved during parallel GPU training.')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,61 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import argparse
+import os
+
+import keras.backend as K
+from keras.models import load_model
+
+import models
+from utils.inference_utils import export_inference_model
+
+
+def main(args):
+    # When loading custom objects, Keras needs to know where to find them.
+    # The CTC lambda is a dummy function
+    custom_objects = {'clipped_relu': models.clipped_relu,
+                      '<lambda>': lambda y_true, y_pred: y_pred}
+
+    # The optimizer state is not needed for the export
+    model = load_model(args.model_load, custom_objects=custom_objects, compile=False)
+
+    # When loading a parallel model saved *while* running on GPU, use load_multi
+    if args.load_multi:
+        model = model.layers[-2]
+    print "\nLoaded existing model: ", args.model_load
+
+    export_dir = os.path.dirname(args.export_path)
+    if export_dir and not os.path.exists(export_dir):
+        os.makedirs(export_dir)
+    export_inference_model(model, args.export_path)
+    print "Exported inference model: ", args.export_path
+
+    K.clear_session()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--model_load', type=str,
+                        help='Path of model saved during training.')
+    parser.add_argument('--load_multi', action='store_true',
+                        help='Load multi gpu model saved during parallel GPU training.')
+    parser.add_argument('--export_path', type=str, default="models/inference.pb",
+                        help='Path of the exported inference model. A .pb file is a frozen TensorFlow graph, '
+                             'other paths save a Keras .h5 file with only the weights of the inference model.')
+
+    args = parser.parse_args()
+
+    main(args)
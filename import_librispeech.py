@@ -36,6 +36,8 @@ from shutil import copyfile
 from tensorflow.contrib.learn.python.learn.datasets import base
 from tensorflow.python.platform import gfile
 
+from data import add_audio_info
+
 
 def _download_and_preprocess_data(data_dir):
     # Conditionally download data to data_dir
@@ -176,7 +178,10 @@ def _convert_audio_and_split_sentences(extracted_dir, data_set, dest_dir):
                     target_file_path = os.path.abspath(target_file)
                     files.append((target_file_path, filesize, transcript))
 
-    return pandas.DataFrame(data=files, columns=["filename", "filesize", "transcript"])
+    df = pandas.DataFrame(data=files, columns=["filename", "filesize", "transcript"])
+
+    # Length of each file from the FLAC headers, read in parallel
+    return add_audio_info(df)
 
 
 if __name__ == "__main__":
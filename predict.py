@@ -15,12 +15,13 @@ If not, see http://www.gnu.org/licenses/.
 import argparse
 
 import keras.backend as K
-from keras import models
+from soundfile import info
 
-import models
 from DataGenerator import DataGenerator
 from data import combine_all_wavs_and_trans_from_csvs
-from utils.train_utils import predict_on_batch, calc_wer
+from utils.chunked_inference import transcribe_file
+from utils.inference_utils import load_inference_model
+from utils.train_utils import predict_on_batch, calc_wer, get_decoder
 
 
 def main(args):
@@ -29,15 +30,20 @@ def main(args):
             raise ValueError()
         audio_dir = args.audio_dir
 
-        print "\nReading test data: "
-        _, df = combine_all_wavs_and_trans_from_csvs(audio_dir)
+        frequency = 16           # Sampling rate of data in khz (LibriSpeech is 16khz)
+        frame_length = 20 * frequency
+        hop_length = 10 * frequency
+
+        if not args.audio_file:
+            print "\nReading test data: "
+            _, df = combine_all_wavs_and_trans_from_csvs(audio_dir, frame_length=frame_length,
+                                                         hop_length=hop_length)
 
         batch_size = args.batch_size
         batch_index = args.batch_index
 
         mfcc_features = args.mfccs
         n_mels = args.mels
-        frequency = 16           # Sampling rate of data in khz (LibriSpeech is 16khz)
 
         # Training data_params:
         model_load = args.model_load
@@ -47,29 +53,10 @@ def main(args):
         # The data_generator doesn't actually load the audio files until they are requested through __get_item__()
         epoch_length = 0
 
-        # Load trained model
-        # When loading custom objects, Keras needs to know where to find them.
-        # The CTC lambda is a dummy function
-        custom_objects = {'clipped_relu': models.clipped_relu,
-                          '<lambda>': lambda y_true, y_pred: y_pred}
-
+        # Load trained model for prediction only, without the CTC loss and optimizer.
         # When loading a parallel model saved *while* running on GPU, use load_multi
-        if load_multi:
-            model = models.load_model(model_load, custom_objects=custom_objects)
-            model = model.layers[-2]
-            print "\nLoaded existing model: ", model_load
-
-        # Load single GPU/CPU model or model saved *after* finished training
-        else:
-            model = models.load_model(model_load, custom_objects=custom_objects)
-            print "\nLoaded existing model: ", model_load
-
-        # Dummy loss-function to compile model, actual CTC loss-function defined as a lambda layer in model
-        loss = {'ctc': lambda y_true, y_pred: y_pred}
-
-        model.compile(loss=loss, optimizer='Adam')
-
-        feature_shape = model.input_shape[0][2]
+        test_func, feature_shape = load_inference_model(model_load, load_multi=load_multi)
+        print "\nLoaded existing model: ", model_load
 
         # Model feature type
         if not args.feature_type:
@@ -82,11 +69,35 @@ def main(args):
 
         print "Feature type: ", feature_type
 
+        # Decoder of the network predictions
+        decoder = get_decoder(args.decoder, beam_width=args.beam_width, top_k=args.top_k,
+                              blank_threshold=args.blank_threshold, lm_path=args.lm, lm_weight=args.lm_weight,
+                              word_bonus=args.word_bonus, lexicon_path=args.lexicon)
+        if args.lm:
+            print "Loaded language model: ", args.lm
+        if args.lexicon:
+            print "Loaded lexicon: ", args.lexicon
+        print "Decoder: ", args.decoder
+
+        # Long audio mode, the network predicts overlapping windows of the recording in batches
+        if args.audio_file:
+            # The audio is read in blocks, it is not in memory as a whole
+            frames_per_second = frequency * 1000 // hop_length
+            transcript = transcribe_file(test_func, args.audio_file, feature_type=feature_type,
+                                         frame_length=frame_length, hop_length=hop_length,
+                                         mfcc_features=mfcc_features, n_mels=n_mels, decoder=decoder,
+                                         window_frames=int(args.window * frames_per_second),
+                                         overlap_frames=int(args.overlap * frames_per_second),
+                                         batch_size=batch_size)
+            print "\n - Prediction of ", args.audio_file, " (", info(args.audio_file).duration, " seconds)\n"
+            print "Predicted: ", transcript, "\n"
+            return
+
         # Data generation parameters
         data_params = {'feature_type': feature_type,
                        'batch_size': batch_size,
-                       'frame_length': 20 * frequency,
-                       'hop_length': 10 * frequency,
+                       'frame_length': frame_length,
+                       'hop_length': hop_length,
                        'mfcc_features': mfcc_features,
                        'n_mels': n_mels,
                        'epoch_length': epoch_length,
@@ -96,21 +107,12 @@ def main(args):
         # Data generators for training, validation and testing data
         data_generator = DataGenerator(df, **data_params)
 
-        # Print model summary
-        model.summary()
-
-        # Creates a test function that takes preprocessed sound input and outputs predictions
-        # Used to calculate WER while training the network
-        input_data = model.get_layer('the_input').input
-        y_pred = model.get_layer('ctc').input[0]
-        test_func = K.function([input_data], [y_pred])
-
         if args.calc_wer:
             print "\n - Calculation WER on ", audio_dir
-            wer = calc_wer(test_func, data_generator)
+            wer = calc_wer(test_func, data_generator, decoder)
             print "Average WER: ", wer[1]
 
-        predictions = predict_on_batch(data_generator, test_func, batch_index)
+        predictions = predict_on_batch(data_generator, test_func, batch_index, decoder)
         print "\n - Predictions from batch index: ", batch_index, "\nFrom: ", audio_dir, "\n"
         for i in predictions:
             print "Original: ", i[0]
@@ -134,12 +136,41 @@ if __name__ == '__main__':
     parser.add_argument('--audio_dir', type=str, default="data_dir/librivox-test-clean.csv",
                         help='Path to .csv file of audio to predict')
     parser.add_argument('--batch_size', type=int, default=64,
-                        help='Number of files to predict.')
+                        help='Number of files (or windows of audio_file) to predict at once.')
     parser.add_argument('--batch_index', type=int, default=10,
                         help='Index of batch in sorted .csv file to predict.')
     parser.add_argument('--calc_wer', action='store_true',
                         help='Calculate the word error rate on the data in audio_dir.')
 
+    # Long audio params:
+    parser.add_argument('--audio_file', type=str, default='',
+                        help='Path of a single (long) audio file to predict instead of audio_dir, predicted in '
+                             'overlapping windows in batches of batch_size windows.')
+    parser.add_argument('--window', type=float, default=10.0,
+                        help='Seconds of audio in each window predicted by the network.')
+    parser.add_argument('--overlap', type=float, default=1.0,
+                        help='Seconds of context on both sides of the part kept of each window.')
+
+    # Decoder params:
+    parser.add_argument('--decoder', type=str, default='greedy',
+                        help='Decoder of the network predictions: greedy or beam (CTC prefix beam search).')
+    parser.add_argument('--beam_width', type=int, default=16,
+                        help='Number of prefixes kept by the beam search after each frame.')
+    parser.add_argument('--top_k', type=int, default=8,
+                        help='Number of most probable characters of each frame searched by the beam search.')
+    parser.add_argument('--blank_threshold', type=float, default=0.999,
+                        help='Frames with a higher blank probability are skipped by the beam search.')
+    parser.add_argument('--lm', type=str, default='',
+                        help='Path of language model made with build_lm.py, used by the beam search. '
+                             'If empty no language model is used.')
+    parser.add_argument('--lm_weight', type=float, default=0.5,
+                        help='Weight of the language model log probabilities in the beam search.')
+    parser.add_argument('--word_bonus', type=float, default=1.0,
+                        help='Score added for each word in the beam search with a language model.')
+    parser.add_argument('--lexicon', type=str, default='',
+                        help='Path of vocabulary file (one word per line), the beam search only produces '
+                             'these words. If empty any sequence of characters is allowed.')
+
     # Only need to specify these if feature params are changed from default (different than 26 MFCC and 40 mels)
     parser.add_argument('--feature_type', type=str,
                         help='Feature extraction method: mfcc or spectrogram. '
@@ -151,7 +182,8 @@ if __name__ == '__main__':
 
     # Model load params:
     parser.add_argument('--model_load', type=str,
-                        help='Path of existing model to load.')
+                        help='Path of existing model to load, saved during training or exported with '
+                             'export_model.py.')
     parser.add_argument('--load_multi', action='store_true',
                         help='Load multi gpu model saved during parallel GPU training.')
 
@@ -0,0 +1,137 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import argparse
+
+import keras.backend as K
+
+from DynamicBatcher import DynamicBatcher
+from TranscriptionServer import TranscriptionServer
+from utils.inference_utils import load_inference_model
+from utils.train_utils import get_decoder
+
+
+def main(args):
+    batcher = None
+    server = None
+    try:
+        if not args.model_load:
+            raise ValueError()
+
+        frequency = 16           # Sampling rate of data in khz (LibriSpeech is 16khz)
+        frame_length = 20 * frequency
+        hop_length = 10 * frequency
+
+        # Load trained model for prediction only, without the CTC loss and optimizer.
+        # When loading a parallel model saved *while* running on GPU, use load_multi
+        test_func, feature_shape = load_inference_model(args.model_load, load_multi=args.load_multi)
+        print "\nLoaded existing model: ", args.model_load
+
+        # Model feature type
+        if not args.feature_type:
+            if feature_shape == 26:
+                feature_type = 'mfcc'
+            else:
+                feature_type = 'spectrogram'
+        else:
+            feature_type = args.feature_type
+
+        print "Feature type: ", feature_type
+
+        decoder = get_decoder(args.decoder, beam_width=args.beam_width, top_k=args.top_k,
+                              blank_threshold=args.blank_threshold, lm_path=args.lm, lm_weight=args.lm_weight,
+                              word_bonus=args.word_bonus, lexicon_path=args.lexicon)
+        print "Decoder: ", args.decoder
+
+        batcher = DynamicBatcher(test_func, decoder=decoder, feature_type=feature_type, frame_length=frame_length,
+                                 hop_length=hop_length, mfcc_features=args.mfccs, n_mels=args.mels,
+                                 sr=frequency * 1000, max_batch_size=args.max_batch_size, max_wait=args.max_wait)
+        server = TranscriptionServer(batcher, host=args.host, port=args.port)
+
+        print "\nServing on http://%s:%d" % server.server_address
+        print " - POST /transcribe: audio file as body, or JSON {\"path\": \"<audio file>\"}"
+        print " - GET /metrics"
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        print "\nStopping server"
+
+    except (Exception, StandardError, GeneratorExit, SystemExit) as e:
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        message = template.format(type(e).__name__, e.args)
+        print "e.args: ", e.args
+        print message
+
+    finally:
+        if server is not None:
+            server.server_close()
+        if batcher is not None:
+            batcher.close()
+
+        # Clear memory
+        K.clear_session()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    # Server params:
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='Address to listen on.')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='Port to listen on.')
+    parser.add_argument('--max_batch_size', type=int, default=16,
+                        help='Maximum number of requests transcribed in one batch.')
+    parser.add_argument('--max_wait', type=float, default=0.02,
+                        help='Seconds a request waits for more requests to batch with.')
+
+    # Decoder params:
+    parser.add_argument('--decoder', type=str, default='greedy',
+                        help='Decoder of the network predictions: greedy or beam (CTC prefix beam search).')
+    parser.add_argument('--beam_width', type=int, default=16,
+                        help='Number of prefixes kept by the beam search after each frame.')
+    parser.add_argument('--top_k', type=int, default=8,
+                        help='Number of most probable characters of each frame searched by the beam search.')
+    parser.add_argument('--blank_threshold', type=float, default=0.999,
+                        help='Frames with a higher blank probability are skipped by the beam search.')
+    parser.add_argument('--lm', type=str, default='',
+                        help='Path of language model made with build_lm.py, used by the beam search. '
+                             'If empty no language model is used.')
+    parser.add_argument('--lm_weight', type=float, default=0.5,
+                        help='Weight of the language model log probabilities in the beam search.')
+    parser.add_argument('--word_bonus', type=float, default=1.0,
+                        help='Score added for each word in the beam search with a language model.')
+    parser.add_argument('--lexicon', type=str, default='',
+                        help='Path of vocabulary file (one word per line), the beam search only produces '
+                             'these words. If empty any sequence of characters is allowed.')
+
+    # Only need to specify these if feature params are changed from default (different than 26 MFCC and 40 mels)
+    parser.add_argument('--feature_type', type=str,
+                        help='Feature extraction method: mfcc or spectrogram. '
+                             'If none is specified it tries to detect feature type from input_shape.')
+    parser.add_argument('--mfccs', type=int, default=26,
+                        help='Number of mfcc features per frame to extract.')
+    parser.add_argument('--mels', type=int, default=40,
+                        help='Number of mels to use in feature extraction.')
+
+    # Model load params:
+    parser.add_argument('--model_load', type=str,
+                        help='Path of existing model to load, saved during training or exported with '
+                             'export_model.py.')
+    parser.add_argument('--load_multi', action='store_true',
+                        help='Load multi gpu model saved during parallel GPU training.')
+
+    args = parser.parse_args()
+
+    main(args)
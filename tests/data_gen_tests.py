@@ -12,14 +12,25 @@ If not, see http://www.gnu.org/licenses/.
 
 """
 
+import os
+import shutil
+import tempfile
 import unittest
 
 import numpy as np
+from soundfile import read, write
 
+import data
 from DataGenerator import DataGenerator
-from data import combine_all_wavs_and_trans_from_csvs
+from ParallelLoader import ParallelLoader
+from data import combine_all_wavs_and_trans_from_csvs, add_audio_info, get_manifest_cache_path
+from utils.audio_store import AudioStore
 from utils.feature_utils import load_audio, convert_and_pad_transcripts, extract_mfcc_and_pad, \
-    extract_mel_spectrogram_and_pad
+    extract_mel_spectrogram_and_pad, extract_features, extract_features_batch, extract_features_long, get_num_frames, \
+    as_float_audio, StreamingFeatureExtractor, extract_features_file
+from utils.sampler import FrameBudgetSampler
+from utils.text_utils import encode_transcripts, gather_and_pad_labels, int_sequences_to_text, \
+    text_to_int_sequence
 
 
 class TestDataGen(unittest.TestCase):
@@ -48,6 +59,82 @@ class TestDataGen(unittest.TestCase):
 
         self.assertEqual(size, 256)
 
+    def test_n_frames(self):
+        _, df = combine_all_wavs_and_trans_from_csvs("data_dir/sample_librivox-test-clean.csv", frame_length=320,
+                                                     hop_length=160)
+        x_data_raw, _, sr = load_audio(df, indexes_in_batch=np.arange(len(df)))
+
+        for i, frames in enumerate(x_data_raw):
+            _, x_length = extract_mfcc_and_pad(frames, sr=sr, max_pad_length=10, frame_length=320, hop_length=160,
+                                               mfcc_features=26, n_mels=40)
+            self.assertEqual(df['n_frames'].iloc[i], x_length)
+
+        # Uneven frame and hop lengths
+        self.assertEqual(get_num_frames(len(x_data_raw[0]), 400, 160),
+                         extract_features(x_data_raw[0], sr, 'spectrogram', 400, 160, 26, 40).shape[0])
+
+    def test_audio_info(self):
+        df = add_audio_info(self.df, workers=2)
+        x_data_raw, _, sr = load_audio(df, indexes_in_batch=np.arange(len(df)))
+
+        self.assertListEqual(df['num_samples'].tolist(), [len(frames) for frames in x_data_raw])
+        self.assertListEqual(df['sample_rate'].tolist(), [sr] * len(df))
+        self.assertTrue(np.allclose(df['duration'].values, df['num_samples'].values / float(sr)))
+
+        # Sorted by duration, n_frames computed from num_samples
+        store_dir = tempfile.mkdtemp()
+        try:
+            csv = os.path.join(store_dir, 'sample.csv')
+            df.sample(frac=1, random_state=0).to_csv(csv, index=False)
+            _, df_sorted = combine_all_wavs_and_trans_from_csvs(csv, frame_length=320, hop_length=160)
+
+            self.assertTrue((np.diff(df_sorted['num_samples'].values) >= 0).all())
+            self.assertListEqual(df_sorted['n_frames'].tolist(),
+                                 get_num_frames(df_sorted['num_samples'].values, 320, 160).tolist())
+        finally:
+            shutil.rmtree(store_dir)
+
+    def test_manifest_cache(self):
+        store_dir = tempfile.mkdtemp()
+        try:
+            csv = os.path.join(store_dir, 'sample.csv')
+            shutil.copy("data_dir/sample_librivox-test-clean.csv", csv)
+
+            props, df = combine_all_wavs_and_trans_from_csvs(csv)
+            props_cached, df_cached = combine_all_wavs_and_trans_from_csvs(csv)
+            props_csv, df_csv = combine_all_wavs_and_trans_from_csvs(csv, use_cache=False)
+
+            self.assertTrue(os.path.isfile(get_manifest_cache_path([csv])))
+            self.assertTrue(df_cached.equals(df_csv))
+            self.assertListEqual(df_cached.index.tolist(), df_csv.index.tolist())
+            self.assertDictEqual(props_cached, props_csv)
+            self.assertEqual(props['num_words'], 276)
+            self.assertEqual(len(props['all_vocab']), 160)
+            self.assertEqual(props['max_intseq_length'], 187)
+
+            # A changed csv file is read again
+            cache_path = get_manifest_cache_path([csv])
+            df_csv[:5].to_csv(csv, index=False)
+            os.utime(csv, (0, 0))
+            _, df_changed = combine_all_wavs_and_trans_from_csvs(csv)
+
+            self.assertNotEqual(get_manifest_cache_path([csv]), cache_path)
+            self.assertEqual(len(df_changed), 5)
+
+            # The number of frames read from the audio headers is cached, a warm start does not read them
+            _, df_frames = combine_all_wavs_and_trans_from_csvs(csv, frame_length=320, hop_length=160)
+            get_audio_info = data.get_audio_info
+            data.get_audio_info = None
+            try:
+                _, df_frames_cached = combine_all_wavs_and_trans_from_csvs(csv, frame_length=320, hop_length=160)
+            finally:
+                data.get_audio_info = get_audio_info
+
+            self.assertTrue(df_frames_cached.equals(df_frames))
+            self.assertNotIn('num_samples', df_frames_cached)
+        finally:
+            shutil.rmtree(store_dir)
+
     def test_get_item(self):
         batch0, _ = self.dg.__getitem__(0)
         batch1, _ = self.dg.__getitem__(1)
@@ -66,6 +153,155 @@ class TestDataGen(unittest.TestCase):
         self.assertEqual(input_length.shape[0], 10)
         self.assertEqual(label_length.shape[0], 10)
 
+    def test_feature_store(self):
+        store_dir = tempfile.mkdtemp()
+        try:
+            dg = DataGenerator(self.df, batch_size=10, epoch_length=10, feature_store_dir=store_dir)
+            x_data_raw, _, sr = load_audio(self.df, indexes_in_batch=np.arange(5))
+            paths = self.df['filename'].values[:5]
+            x_data, input_length = self.dg.extract_features_and_pad(x_data_raw, sr)
+
+            # First pass extracts and fills the store, second pass reads without decoding audio
+            x_data_miss, input_length_miss = dg.extract_features_and_pad(x_data_raw, sr, paths)
+            x_data_raw, _, _ = load_audio(self.df, np.arange(5), feature_store=dg.feature_store)
+            x_data_hit, input_length_hit = dg.extract_features_and_pad(x_data_raw, sr, paths)
+
+            self.assertEqual(len(dg.feature_store), 5)
+            self.assertListEqual(x_data_raw, [None] * 5)
+            self.assertTupleEqual(x_data_hit.shape, x_data.shape)
+            self.assertListEqual(input_length_hit.tolist(), input_length.tolist())
+            self.assertTrue(np.allclose(x_data_hit, x_data, atol=1e-4))
+            self.assertTrue(np.array_equal(x_data_hit, x_data_miss))
+        finally:
+            shutil.rmtree(store_dir)
+
+    def test_audio_store(self):
+        store_dir = tempfile.mkdtemp()
+        try:
+            store = AudioStore(store_dir)
+            for path in self.df['filename'].values[:5]:
+                frames, sr = read(path, dtype='int16')
+                store.put(path, frames, sr)
+
+            x_data_raw, _, sr = load_audio(self.df, np.arange(5))
+            x_data_stored, _, sr_stored = load_audio(self.df, np.arange(5), audio_store=AudioStore(store_dir))
+
+            self.assertEqual(len(store), 5)
+            self.assertEqual(sr_stored, sr)
+            for frames, frames_stored in zip(x_data_raw, x_data_stored):
+                self.assertEqual(frames_stored.dtype, np.int16)
+                self.assertTrue(np.array_equal(as_float_audio(frames_stored), frames))
+
+            # Files not in the store are decoded
+            dg = DataGenerator(self.df, batch_size=10, epoch_length=10, shuffle=False, audio_store_dir=store_dir)
+            x_data, input_length = self.dg.extract_features_and_pad(x_data_raw, sr)
+            batch, _ = dg.__getitem__(0)
+            self.assertTrue(np.allclose(batch['the_input'][:5, :x_data.shape[1]], x_data, atol=1e-4))
+        finally:
+            shutil.rmtree(store_dir)
+
+    def test_parallel_loader(self):
+        dg = DataGenerator(self.df, batch_size=4, epoch_length=0, shuffle=False)
+        loader = ParallelLoader(dg, workers=2, prefetch=3)
+        try:
+            batches = loader.generator()
+            for epoch in range(2):
+                for batch_index in range(len(loader)):
+                    inputs, _ = next(batches)
+                    expected, _ = dg.__getitem__(batch_index)
+                    self.assertTrue(np.array_equal(inputs['the_input'], expected['the_input']))
+                    self.assertTrue(np.array_equal(inputs['the_labels'], expected['the_labels']))
+        finally:
+            loader.close()
+
+        # Shuffled order of batches is the same for the same seed, and differs between epochs
+        orders = []
+        for _ in range(2):
+            loader = ParallelLoader(dg, workers=1, shuffle=True, seed=1)
+            indexes = loader.batch_indexes()
+            orders.append([next(indexes)[0] for _ in range(2 * len(loader))])
+            loader.close()
+
+        self.assertListEqual(orders[0], orders[1])
+        self.assertNotEqual(orders[0][:len(loader)], orders[0][len(loader):])
+
+        # Indexes shuffled within each batch are the same for the same seed, and hold the same files as unshuffled
+        runs = []
+        for _ in range(2):
+            dg_shuffled = DataGenerator(self.df, batch_size=4, epoch_length=0, shuffle=True, seed=1)
+            loader = ParallelLoader(dg_shuffled, workers=1, shuffle=True, seed=1)
+            indexes = loader.batch_indexes()
+            runs.append([next(indexes).tolist() for _ in range(2 * len(loader))])
+            loader.close()
+
+        self.assertListEqual(runs[0], runs[1])
+        unshuffled = [sorted(dg.get_indexes_in_batch(i).tolist()) for i in range(len(dg))]
+        self.assertListEqual(sorted(sorted(b) for b in runs[0][:len(dg)]), sorted(unshuffled))
+
+    def test_bucket_sampler(self):
+        _, df = combine_all_wavs_and_trans_from_csvs("data_dir/sample_librivox-test-clean.csv", sortagrad=False,
+                                                     frame_length=320, hop_length=160)
+        dg = DataGenerator(df, batch_size=4, epoch_length=0, shuffle=False)
+        dg_bucket = DataGenerator(df, batch_size=4, epoch_length=0, shuffle=False, sampler='bucket')
+        dg_bucket.sampler.bucket_size = 1
+
+        self.assertEqual(len(dg_bucket), len(dg))
+
+        # Each file at most once per epoch
+        for epoch in range(2):
+            dg_bucket.sampler.on_epoch_end()
+            indexes = np.concatenate([dg_bucket.get_indexes_in_batch(i) for i in range(len(dg_bucket))])
+            self.assertEqual(len(indexes), len(dg_bucket) * 4)
+            self.assertEqual(len(set(indexes)), len(indexes))
+
+            inputs, _ = dg_bucket.__getitem__(0)
+            max_length = df['n_frames'].values[dg_bucket.get_indexes_in_batch(0)].max()
+            self.assertEqual(inputs['the_input'].shape[1], max_length)
+
+        self.assertLess(dg_bucket.padding_ratio(), dg.padding_ratio())
+
+    def test_max_frames_per_batch(self):
+        _, df = combine_all_wavs_and_trans_from_csvs("data_dir/sample_librivox-test-clean.csv", frame_length=320,
+                                                     hop_length=160)
+        dg = DataGenerator(df, epoch_length=0, max_frames_per_batch=3000)
+        n_frames = df['n_frames'].values
+
+        indexes = np.concatenate([dg.get_indexes_in_batch(i) for i in range(len(dg))])
+        self.assertListEqual(sorted(indexes), range(len(df)))
+
+        over_budget = 0
+        for i in range(len(dg)):
+            indexes_in_batch = dg.get_indexes_in_batch(i)
+            inputs, outputs = dg.__getitem__(i)
+            self.assertEqual(inputs['the_input'].shape[0], len(indexes_in_batch))
+            self.assertEqual(outputs['ctc'].shape[0], len(indexes_in_batch))
+            self.assertGreater(len(indexes_in_batch), 1)
+            if inputs['the_input'].shape[0] * inputs['the_input'].shape[1] > 3000:
+                over_budget += 1
+
+        # Only the batch with the longest file may be over budget
+        self.assertLessEqual(over_budget, 1)
+
+        # Same number of batches each epoch
+        n_batches = len(dg)
+        dg.on_epoch_end()
+        self.assertEqual(len(dg), n_batches)
+        self.assertGreater(n_batches, len(df) * n_frames.mean() / 3000)
+
+        # A batch is only over budget if two of its files are, also when the last file is left on its own
+        rng = np.random.RandomState(0)
+        for lengths, budget in [([100, 100, 100, 100, 150, 150, 150], 400), ([100, 100, 100, 300, 300, 400], 800)] + \
+                [(rng.randint(50, 330, size=rng.randint(2, 40)), 1000) for _ in range(50)]:
+            lengths = np.array(lengths)
+            sampler = FrameBudgetSampler(lengths, budget)
+            for epoch in range(2):
+                self.assertListEqual(sorted(np.concatenate(sampler.batches)), range(len(lengths)))
+                for batch in sampler.batches:
+                    self.assertGreater(len(batch), 1)
+                    if 2 * lengths[batch].max() <= budget:
+                        self.assertLessEqual(len(batch) * lengths[batch].max(), budget)
+                sampler.on_epoch_end()
+
     # Feature generation utils
     def test_load_audio(self):
         indexes = np.arange(5)
@@ -91,6 +327,80 @@ class TestDataGen(unittest.TestCase):
         self.assertTupleEqual(mel_spec.shape, (500, 40))
         self.assertEqual(x_length, 256)
 
+    def test_extract_features_batch(self):
+        x_data_raw, _, sr = load_audio(self.df, indexes_in_batch=np.arange(5))
+
+        for feature_type in ['mfcc', 'spectrogram']:
+            x_data, x_length = extract_features_batch(x_data_raw, sr, feature_type, frame_length=320, hop_length=160,
+                                                      mfcc_features=26, n_mels=40)
+            for i, frames in enumerate(x_data_raw):
+                expected = extract_features(frames, sr, feature_type, 320, 160, 26, 40)
+
+                self.assertEqual(x_length[i], expected.shape[0])
+                self.assertTrue(np.allclose(x_data[i, :x_length[i]], expected, rtol=1e-5, atol=1e-3))
+                self.assertFalse(x_data[i, x_length[i]:].any())
+
+    def test_extract_features_long(self):
+        x_data_raw, _, sr = load_audio(self.df, indexes_in_batch=np.arange(5))
+        frames = np.concatenate(x_data_raw)
+
+        for feature_type in ['mfcc', 'spectrogram']:
+            x_data, x_length = extract_features_batch([frames], sr, feature_type, frame_length=320, hop_length=160,
+                                                      mfcc_features=26, n_mels=40)
+            features = extract_features_long(frames, sr, feature_type, frame_length=320, hop_length=160,
+                                             mfcc_features=26, n_mels=40, block_frames=100)
+
+            self.assertEqual(features.shape[0], x_length[0])
+            self.assertTrue(np.array_equal(features, x_data[0]))
+
+    def test_extract_features_file(self):
+        x_data_raw, _, sr = load_audio(self.df, indexes_in_batch=np.arange(5))
+        frames = np.concatenate(x_data_raw)
+        # Quiet start, more than 80 dB below the loudest frame
+        frames[:5000] *= 1e-6
+
+        store_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(store_dir, 'long.flac')
+            write(path, frames, sr)
+            frames, _ = read(path)
+
+            for feature_type in ['mfcc', 'spectrogram']:
+                expected = extract_features_long(frames, sr, feature_type, frame_length=320, hop_length=160,
+                                                 mfcc_features=26, n_mels=40)
+                features, file_sr = extract_features_file(path, feature_type, frame_length=320, hop_length=160,
+                                                          mfcc_features=26, n_mels=40, block_samples=1000)
+
+                self.assertEqual(file_sr, sr)
+                self.assertEqual(features.shape, expected.shape)
+                self.assertTrue(np.allclose(features, expected, rtol=1e-5, atol=1e-3))
+        finally:
+            shutil.rmtree(store_dir)
+
+    def test_streaming_features(self):
+        x_data_raw, _, sr = load_audio(self.df, indexes_in_batch=[1])
+        frames = x_data_raw[0]
+        chunks = np.split(frames, np.cumsum(np.random.RandomState(0).randint(1, 2000, len(frames) // 500)))
+
+        spectrogram, _ = extract_mel_spectrogram_and_pad(frames, sr, get_num_frames(len(frames), 320, 160),
+                                                         320, 160, 40)
+        mfcc, _ = extract_mfcc_and_pad(frames, sr, len(spectrogram), 320, 160, 26, 40)
+        max_db = 10 * np.log10(np.maximum(spectrogram, 1e-10)).max()
+
+        for feature_type, expected, params in [('spectrogram', spectrogram, {}),
+                                               ('mfcc', mfcc, {'max_db': max_db}),
+                                               ('mfcc', mfcc, {})]:
+            extractor = StreamingFeatureExtractor(sr, feature_type, frame_length=320, hop_length=160,
+                                                  mfcc_features=26, n_mels=40, **params)
+            features = [extractor.accept(chunk) for chunk in chunks]
+            features.append(extractor.flush())
+            features = np.concatenate(features)
+
+            # With the running maximum, the same frames from the loudest frame on
+            start = 0 if params or feature_type == 'spectrogram' else np.argmax(spectrogram.max(axis=1))
+            self.assertEqual(features.shape, expected.shape)
+            self.assertTrue(np.allclose(features[start:], expected[start:], rtol=1e-5, atol=1e-3))
+
     def test_convert_transcripts(self):
         _, y_data_raw, sr = load_audio(self.df, indexes_in_batch=[0])
         transcript, y_length = convert_and_pad_transcripts(y_data_raw)
@@ -101,6 +411,27 @@ class TestDataGen(unittest.TestCase):
         self.assertListEqual(list, exp)
         self.assertEqual(y_length, 30)
 
+    def test_encode_transcripts(self):
+        transcripts = self.df['transcript'].tolist()
+        labels, offsets = encode_transcripts(transcripts)
+
+        self.assertEqual(labels.dtype, np.int8)
+        for i, t in enumerate(transcripts):
+            self.assertListEqual(labels[offsets[i]:offsets[i + 1]].tolist(), text_to_int_sequence(t))
+
+        # Gathered batch matches converting one transcript at a time, and converts back to the transcripts
+        indexes = np.array([3, 0, 7])
+        y_data, label_length = gather_and_pad_labels(labels, offsets, indexes)
+        for row, i in enumerate(indexes):
+            y_int = text_to_int_sequence(transcripts[i])
+            self.assertEqual(label_length[row], len(y_int))
+            self.assertListEqual(y_data[row, :len(y_int)].tolist(), y_int)
+            self.assertFalse(y_data[row, len(y_int):].any())
+
+        self.assertListEqual(int_sequences_to_text(y_data, label_length), [transcripts[i] for i in indexes])
+        self.assertListEqual(int_sequences_to_text([[8, 28, 9, 28]]), ["hi"])
+        self.assertRaises(ValueError, encode_transcripts, ["hello", "no digits 1"])
+
 
 if __name__ == '__main__':
     unittest.main()
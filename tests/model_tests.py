@@ -12,14 +12,40 @@ If not, see http://www.gnu.org/licenses/.
 
 """
 
+import json
+import os
+import shutil
+import tempfile
 import unittest
+import urllib2
+from itertools import groupby, product
+from threading import Thread
 
 import keras.backend as K
+import numpy as np
+from keras.models import load_model
 from keras.optimizers import Adam
+from soundfile import read, write
 
 import models
+from BackgroundValidator import BackgroundValidator
+from CheckpointWriter import CheckpointWriter
 from DataGenerator import DataGenerator
+from DynamicBatcher import DynamicBatcher
+from TranscriptionServer import TranscriptionServer
 from data import combine_all_wavs_and_trans_from_csvs
+from utils.beam_search import beam_decode
+from utils.chunked_inference import predict_chunked, transcribe_file, transcribe_long
+from utils.evaluation import evaluate
+from utils.feature_utils import extract_features_long
+from utils.inference_utils import export_inference_model, inference_input_dim, load_inference_model
+from utils.language_model import NgramLanguageModel, LanguageModelScorer
+from utils.lexicon import CharTrie, LexiconScorer
+from utils.text_utils import int_sequences_to_text, text_to_int_sequence
+from utils.train_utils import calc_loss_and_wer, calc_wer, get_eval_func, greedy_decode, predict_on_batch
+from utils.transcription import read_transcribed_paths, transcribe_files
+from utils.wer_utils import edit_distance, edit_operations, error_rates, levenshtein, wer
+from utils.worker_utils import start_workers, stop_workers
 
 
 class TestModelCompile(unittest.TestCase):
@@ -100,6 +126,408 @@ class TestModelCompile(unittest.TestCase):
         # Run training
         model.fit_generator(generator=data_generator, epochs=1, verbose=0)
 
+    def test_checkpoint_writer(self):
+        sample_data = "data_dir/sample_librivox-test-clean.csv"
+        _, df = combine_all_wavs_and_trans_from_csvs(sample_data)
+        data_generator = DataGenerator(df, batch_size=6, epoch_length=1, shuffle=False)
+        model = models.brnn(units=64, input_dim=26, output_dim=29, dropout=0.2, numb_of_dense=3)
+        model.compile(loss=self.loss, optimizer=self.optimizer)
+        model.fit_generator(generator=data_generator, epochs=1, verbose=0)
+
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir, 'model.h5')
+        writer = CheckpointWriter(keep=2)
+        try:
+            # Checkpoints of an earlier run
+            for filename in ['model_epoch7.h5', 'model_epoch8.h5']:
+                open(os.path.join(tmp_dir, filename), 'w').close()
+                os.utime(os.path.join(tmp_dir, filename), (0, 0))
+
+            for epoch in range(3):
+                writer.save(model, path, epoch, include_optimizer=True)
+            writer.close()
+
+            # The last two checkpoints written, and path links to the latest
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ['model.h5', 'model_epoch2.h5', 'model_epoch3.h5'])
+            loaded = [load_model(os.path.join(tmp_dir, filename),
+                                 custom_objects={'clipped_relu': models.clipped_relu, '<lambda>': self.loss['ctc']})
+                      for filename in ['model.h5', 'model_epoch3.h5']]
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        for loaded_model in loaded:
+            for saved, original in zip(loaded_model.get_weights(), model.get_weights()):
+                self.assertTrue(np.array_equal(saved, original))
+
+            # The optimizer state is restored
+            self.assertGreater(len(model.optimizer.get_weights()), 0)
+            self.assertEqual(len(loaded_model.optimizer.get_weights()), len(model.optimizer.get_weights()))
+            for saved, original in zip(loaded_model.optimizer.get_weights(), model.optimizer.get_weights()):
+                self.assertTrue(np.array_equal(saved, original))
+
+
+class TestDecoding(unittest.TestCase):
+    def tearDown(self):
+        K.clear_session()
+
+    def test_greedy_decode(self):
+        rng = np.random.RandomState(0)
+        y_pred = rng.rand(8, 50, 29)
+        y_pred[:, :, 28] += 0.5  # Mostly blanks, as in trained networks
+        input_length = rng.randint(0, 51, size=8)
+
+        decoded, decoded_length = greedy_decode(y_pred, input_length)
+
+        for i in range(8):
+            # Nested loops reference: argmax per frame, collapse repeats, remove blanks
+            best = [np.argmax(y_pred[i, j]) for j in range(input_length[i])]
+            expected = [k for k, _ in groupby(best) if k != 28]
+
+            self.assertEqual(decoded_length[i], len(expected))
+            self.assertListEqual(decoded[i, :decoded_length[i]].tolist(), expected)
+            self.assertTrue((decoded[i, decoded_length[i]:] == 28).all())
+
+    def test_beam_decode(self):
+        rng = np.random.RandomState(0)
+        y_pred = rng.dirichlet(np.ones(3), size=(4, 6))  # 4 sequences of 6 frames, classes a, b and blank
+
+        # Probability of each labelling, summed over all alignments
+        labellings = {}
+        for alignment in product(range(3), repeat=6):
+            labelling = tuple(k for k, _ in groupby(alignment) if k != 2)
+            p = np.prod(y_pred[:, range(6), list(alignment)], axis=1)
+            labellings[labelling] = labellings.get(labelling, 0) + p
+
+        # Without pruning the beam search is exact
+        decoded, decoded_length = beam_decode(y_pred, beam_width=1000, top_k=3, blank_threshold=1.0, blank=2)
+        for i in range(4):
+            best = max(labellings, key=lambda labelling: labellings[labelling][i])
+            self.assertListEqual(decoded[i, :decoded_length[i]].tolist(), list(best))
+
+        # On peaked predictions, with frames skipped, it finds the greedy path
+        y_pred = rng.dirichlet(np.ones(29) * 0.05, size=(8, 40))
+        y_pred[:, ::2] = np.eye(29)[28] * 0.9999 + 0.0001 / 29
+        input_length = rng.randint(0, 41, size=8)
+        decoded, decoded_length = beam_decode(y_pred, input_length)
+        greedy, greedy_length = greedy_decode(y_pred, input_length)
+        self.assertListEqual(decoded_length.tolist(), greedy_length.tolist())
+        self.assertTrue(np.array_equal(decoded, greedy))
+
+    def test_language_model(self):
+        transcripts = ["the cat sat", "the cat ran", "a dog sat"] * 10 + ["the dog ran"]
+        lm = NgramLanguageModel.build(transcripts, order=3)
+        the, cat, dog = lm.word_id("the"), lm.word_id("cat"), lm.word_id("dog")
+
+        self.assertEqual(lm.word_id("kat"), lm.word_id("<unk>"))
+        self.assertGreater(lm.log_prob((the,), cat), lm.log_prob((the,), dog))
+        self.assertGreater(lm.log_prob((the,), dog), lm.log_prob((the,), lm.word_id("kat")))
+
+        # Probabilities after seen and unseen histories sum to one, <s> is never predicted
+        for history in [(), (the,), (lm.word_id("<s>"), the), (the, cat), (dog, cat), (cat, cat),
+                        (lm.word_id("kat"),), (lm.word_id("kat"), the)]:
+            p = np.exp([lm.log_prob(history, i) for i in range(len(lm.vocab)) if lm.vocab[i] != "<s>"])
+            self.assertAlmostEqual(p.sum(), 1.0, places=5)
+
+        # The lookup cache keeps only the most recent lookups
+        small = NgramLanguageModel(lm.vocab, lm.keys, lm.log_probs, lm.backoffs, cache_size=4)
+        for _ in range(2):
+            for i in range(len(lm.vocab)):
+                self.assertEqual(small.log_prob((the,), i), lm.log_prob((the,), i))
+        self.assertEqual(len(small._cache), 4)
+
+        store_dir = tempfile.mkdtemp()
+        try:
+            lm.save(os.path.join(store_dir, "lm.npz"))
+            loaded = NgramLanguageModel.load(os.path.join(store_dir, "lm.npz"))
+            self.assertListEqual(loaded.vocab, lm.vocab)
+            self.assertEqual(loaded.log_prob((dog,), cat), lm.log_prob((dog,), cat))
+        finally:
+            shutil.rmtree(store_dir)
+
+        # Acoustically "the kat" is slightly more likely than "the cat", the language model corrects it
+        text = "the cat"
+        y_pred = np.full((1, 2 * len(text), 29), 1e-4)
+        for i, ch in enumerate(text):
+            y_pred[0, 2 * i, 0 if ch == " " else ord(ch) - ord("a") + 1] = 1.0
+            y_pred[0, 2 * i + 1, 28] = 1.0
+        y_pred[0, 8, 3], y_pred[0, 8, 11] = 0.45, 0.55
+
+        greedy, greedy_length = greedy_decode(y_pred)
+        decoded, decoded_length = beam_decode(y_pred, scorer=LanguageModelScorer(lm, lm_weight=1.0))
+        self.assertListEqual(int_sequences_to_text(greedy, greedy_length), ["the kat"])
+        self.assertListEqual(int_sequences_to_text(decoded, decoded_length), ["the cat"])
+
+    def test_lexicon(self):
+        trie = CharTrie(["the", "then", "cat", "cot"])
+        nodes = [0]
+        for c in text_to_int_sequence("then"):
+            nodes.append(trie.child(nodes[-1], c))
+
+        self.assertListEqual(trie.is_word[nodes].tolist(), [False, False, False, True, True])
+        self.assertEqual(trie.child(0, text_to_int_sequence("x")[0]), -1)
+        self.assertEqual(len(trie), 1 + 4 + 3 + 2)  # root, t-h-e-n, c-a-t, o-t
+        self.assertEqual(trie.next_chars(0), frozenset(text_to_int_sequence("tc")))
+        self.assertEqual(trie.next_chars(nodes[3]), frozenset(text_to_int_sequence("n ")))
+
+        # Acoustically "the kat" is more likely, the lexicon only allows words of the vocabulary
+        text = "the cat"
+        y_pred = np.full((1, 2 * len(text), 29), 1e-4)
+        for i, ch in enumerate(text):
+            y_pred[0, 2 * i, 0 if ch == " " else ord(ch) - ord("a") + 1] = 1.0
+            y_pred[0, 2 * i + 1, 28] = 1.0
+        y_pred[0, 8, 3], y_pred[0, 8, 11] = 0.3, 0.7
+
+        decoded, decoded_length = beam_decode(y_pred, scorer=LexiconScorer(trie))
+        self.assertListEqual(int_sequences_to_text(decoded, decoded_length), ["the cat"])
+
+        # The lexicon with a language model gives the same result
+        lm = NgramLanguageModel.build(["the cat", "the cot"], order=2)
+        decoded, decoded_length = beam_decode(y_pred, scorer=LexiconScorer(trie, LanguageModelScorer(lm)))
+        self.assertListEqual(int_sequences_to_text(decoded, decoded_length), ["the cat"])
+
+        # Incomplete words are not allowed at the end
+        decoded, decoded_length = beam_decode(y_pred[:, :10], scorer=LexiconScorer(trie))
+        self.assertListEqual(int_sequences_to_text(decoded, decoded_length), ["the "])
+
+    def test_edit_distance(self):
+        rng = np.random.RandomState(0)
+        references = [''.join(rng.choice(list('ab c'), rng.randint(0, 40))) for _ in range(300)]
+        hypotheses = [''.join(rng.choice(list('ab c'), rng.randint(0, 40))) for _ in range(300)]
+        references[:3] = ['', 'abc', '']
+        hypotheses[:3] = ['', '', 'abc']
+
+        edits = edit_operations(references, hypotheses)
+        for reference, hypothesis, (substitutions, insertions, deletions) in zip(references, hypotheses, edits):
+            distance = levenshtein(reference, hypothesis)
+            self.assertEqual(edit_distance(reference, hypothesis), distance)
+            self.assertEqual(substitutions + insertions + deletions, distance)
+            self.assertEqual(insertions - deletions, len(hypothesis) - len(reference))
+            self.assertGreaterEqual(min(substitutions, insertions, deletions), 0)
+
+        originals = ["out in the woods stood a nice little fir tree", "the cat", "a b c"]
+        results = ["out in the wood stood a nice little fur tree tree", "the", "  a   b  c "]
+        rates = error_rates(originals, results)
+        self.assertEqual(rates['word_edits'].tolist(), [[2, 1, 0], [0, 0, 1], [0, 0, 0]])
+        self.assertEqual(rates['char_errors'].tolist(), [7, 4, 0])
+        self.assertAlmostEqual(rates['wer'], 4 / 15.0)
+        self.assertEqual([round(r, 6) for r in rates['wers']], [round(wer(o, r), 6) for o, r in zip(originals, results)])
+
+    def test_calc_wer(self):
+        _, df = combine_all_wavs_and_trans_from_csvs("data_dir/sample_librivox-test-clean.csv")
+        data_generator = DataGenerator(df, batch_size=6, epoch_length=0, shuffle=False)
+        model = models.brnn(units=64, input_dim=26, output_dim=29, dropout=0.2, numb_of_dense=3)
+        test_func = K.function([model.get_layer('the_input').input], [model.get_layer('ctc').input[0]])
+
+        predictions = predict_on_batch(data_generator, test_func, 0)
+        wer = calc_wer(test_func, data_generator)
+
+        self.assertEqual(len(predictions), 6)
+        self.assertEqual(predictions[0][0], data_generator.df['transcript'].iloc[0])
+        # Every batch once
+        self.assertEqual(len(wer[0]), len(data_generator) * 6)
+
+    def test_calc_loss_and_wer(self):
+        _, df = combine_all_wavs_and_trans_from_csvs("data_dir/sample_librivox-test-clean.csv")
+        data_generator = DataGenerator(df, batch_size=6, epoch_length=0, shuffle=False)
+        model = models.brnn(units=64, input_dim=26, output_dim=29, dropout=0.2, numb_of_dense=3)
+        model.compile(loss={'ctc': lambda y_true, y_pred: y_pred}, optimizer='Adam')
+        test_func = K.function([model.get_layer('the_input').input], [model.get_layer('ctc').input[0]])
+
+        batches = [data_generator[i] for i in range(len(data_generator))]
+        loss, wer = calc_loss_and_wer(get_eval_func(model), batches)
+
+        # Same val_loss as fit_generator and same WER as calc_wer, from one forward pass per batch
+        self.assertAlmostEqual(loss, model.evaluate_generator(data_generator), places=3)
+        self.assertEqual(wer[0], calc_wer(test_func, data_generator)[0])
+
+    def test_background_validator(self):
+        _, df = combine_all_wavs_and_trans_from_csvs("data_dir/sample_librivox-test-clean.csv")
+        data_generator = DataGenerator(df, batch_size=6, epoch_length=0, shuffle=False)
+        validator = BackgroundValidator(data_generator, subset_batches=1, full_every=2)
+        try:
+            model = models.brnn(units=64, input_dim=26, output_dim=29, dropout=0.2, numb_of_dense=3)
+            batches = [data_generator[i] for i in range(len(data_generator))]
+            loss, wer = calc_loss_and_wer(get_eval_func(model), batches)
+
+            # Subset after the first epoch, all batches after the second
+            self.assertTrue(validator.submit(0, model))
+            self.assertTrue(validator.submit(1, model))
+            results = validator.wait()
+        finally:
+            validator.close()
+
+        self.assertEqual([r['epoch'] for r in results], [0, 1])
+        self.assertEqual(results[0]['n_files'], 6)
+        self.assertFalse(results[0]['full'])
+        self.assertTrue(results[1]['full'])
+        self.assertAlmostEqual(results[1]['val_loss'], loss, places=3)
+        self.assertAlmostEqual(results[1]['wer'], wer[1])
+
+    def test_export_inference_model(self):
+        model = models.brnn(units=64, input_dim=26, output_dim=29, dropout=0.2, numb_of_dense=3)
+        test_func = K.function([model.get_layer('the_input').input], [model.get_layer('ctc').input[0]])
+        x = np.random.RandomState(0).randn(3, 40, 26).astype('float32')
+        x[2, 25:] = 0
+        y_pred = test_func([x])[0]
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for filename in ['model.h5', 'model.pb']:
+                path = os.path.join(tmp_dir, filename)
+                export_inference_model(model, path)
+                self.assertEqual(inference_input_dim(path), 26)
+                inference_func, input_dim = load_inference_model(path)
+
+                self.assertEqual(input_dim, 26)
+                np.testing.assert_allclose(inference_func([x])[0], y_pred, atol=1e-6)
+
+            # Training models are read too
+            model.save(os.path.join(tmp_dir, 'training.h5'))
+            self.assertEqual(inference_input_dim(os.path.join(tmp_dir, 'training.h5')), 26)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_predict_chunked(self):
+        _, df = combine_all_wavs_and_trans_from_csvs("data_dir/sample_librivox-test-clean.csv", sortagrad=False)
+        frames = np.concatenate([read(filename)[0] for filename in df['filename'][:6]])
+        model = models.brnn(units=64, input_dim=26, output_dim=29, dropout=0.2, numb_of_dense=3)
+        test_func = K.function([model.get_layer('the_input').input], [model.get_layer('ctc').input[0]])
+
+        features = extract_features_long(frames, 16000, 'mfcc', 320, 160, 26, 40)
+        y_pred = test_func([features[np.newaxis]])[0][0]
+        decoded, decoded_length = greedy_decode(y_pred[np.newaxis, 2:], np.array([len(y_pred) - 2]))
+        expected = int_sequences_to_text(decoded, decoded_length)[0]
+
+        # Windows of 3 seconds with 0.5 seconds of context, the last window shorter
+        chunked = predict_chunked(test_func, features, window_frames=300, overlap_frames=50, batch_size=4)
+        self.assertGreater(len(features), 1000)
+        np.testing.assert_allclose(chunked, y_pred, atol=1e-5)
+        self.assertEqual(transcribe_long(test_func, frames, 16000, window_frames=300, overlap_frames=50), expected)
+
+        # Read from the file in blocks
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'long.flac')
+            write(path, frames, 16000)
+            self.assertEqual(transcribe_file(test_func, path, window_frames=300, overlap_frames=50,
+                                             block_samples=10000), expected)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_transcribe_files(self):
+        _, df = combine_all_wavs_and_trans_from_csvs("data_dir/sample_librivox-test-clean.csv", sortagrad=False)
+        model = models.brnn(units=64, input_dim=26, output_dim=29, dropout=0.2, numb_of_dense=3)
+        test_func = K.function([model.get_layer('the_input').input], [model.get_layer('ctc').input[0]])
+        expected, _ = evaluate(test_func, df, batch_size=1, workers=0)
+
+        paths = list(df['filename'])
+        paths.insert(3, 'data_dir/sample_data/missing.flac')
+        results = list(transcribe_files(test_func, paths, batch_size=3, workers=2, sort_window=7))
+
+        # With a pool started by the caller
+        pool = start_workers(2, {'feature_type': 'mfcc', 'frame_length': 320, 'hop_length': 160,
+                                 'mfcc_features': 26, 'n_mels': 40, 'sr': 16000})
+        try:
+            pool_results = list(transcribe_files(test_func, paths, batch_size=3, workers=2, pool=pool))
+            self.assertEqual([r.get('transcript') for r in pool_results], [r.get('transcript') for r in results])
+        finally:
+            stop_workers(pool)
+
+        # In the order of paths, with the same transcripts as each file alone
+        self.assertEqual([r['path'] for r in results], paths)
+        self.assertIn('error', results[3])
+        del results[3]
+        self.assertEqual([r['transcript'] for r in results], list(expected['prediction']))
+        self.assertTrue(all(r['duration'] > 0 and r['time'] > 0 for r in results))
+
+        # Resuming after a stop while writing the third line
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            output_path = os.path.join(tmp_dir, 'transcripts.jsonl')
+            with open(output_path, 'w') as f:
+                for result in results[:2]:
+                    f.write(json.dumps(result) + '\n')
+                f.write(json.dumps(results[2])[:10])
+
+            self.assertEqual(read_transcribed_paths(output_path), set(paths[:2]))
+            with open(output_path) as f:
+                self.assertEqual(len(f.read().splitlines()), 2)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_transcription_server(self):
+        _, df = combine_all_wavs_and_trans_from_csvs("data_dir/sample_librivox-test-clean.csv", sortagrad=False)
+        df = df[:6]
+        model = models.brnn(units=64, input_dim=26, output_dim=29, dropout=0.2, numb_of_dense=3)
+        test_func = K.function([model.get_layer('the_input').input], [model.get_layer('ctc').input[0]])
+        expected, _ = evaluate(test_func, df, batch_size=1, workers=0)
+
+        batcher = DynamicBatcher(test_func, max_batch_size=4, max_wait=0.5)
+        server = TranscriptionServer(batcher, port=0)
+        Thread(target=server.serve_forever).start()
+        url = 'http://%s:%d' % server.server_address
+
+        def post(i):
+            if i == 0:
+                with open(df['filename'].iloc[i], 'rb') as f:
+                    request = urllib2.Request(url + '/transcribe', f.read())
+            else:
+                request = urllib2.Request(url + '/transcribe', json.dumps({'path': df['filename'].iloc[i]}),
+                                          {'Content-Type': 'application/json'})
+            results[i] = json.loads(urllib2.urlopen(request).read())
+
+        try:
+            results = [None] * len(df)
+            threads = [Thread(target=post, args=(i,)) for i in range(len(df))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            metrics = json.loads(urllib2.urlopen(url + '/metrics').read())
+        finally:
+            server.shutdown()
+            server.server_close()
+            batcher.close()
+
+        # Same transcripts as transcribing each file alone, in batches of at most 4 requests
+        self.assertEqual([r['transcript'] for r in results], list(expected['prediction']))
+        self.assertTrue(all(1 <= r['batch_size'] <= 4 for r in results))
+        self.assertTrue(all(r['latency'] >= r['queue_time'] >= 0 for r in results))
+        self.assertEqual(metrics['requests'], len(df))
+        self.assertEqual(metrics['queue_depth'], 0)
+        self.assertLess(metrics['batches'], len(df))
+        self.assertLessEqual(metrics['p50_latency'], metrics['p99_latency'])
+
+    def test_evaluate(self):
+        _, df = combine_all_wavs_and_trans_from_csvs("data_dir/sample_librivox-test-clean.csv", sortagrad=False)
+        model = models.brnn(units=64, input_dim=26, output_dim=29, dropout=0.2, numb_of_dense=3)
+        test_func = K.function([model.get_layer('the_input').input], [model.get_layer('ctc').input[0]])
+
+        results, summary = evaluate(test_func, df, batch_size=6, workers=2)
+        serial_results, serial_summary = evaluate(test_func, df, batch_size=6, workers=0)
+
+        # With a pool started by the caller, which stays usable
+        pool = start_workers(2, {'feature_type': 'mfcc', 'frame_length': 320, 'hop_length': 160,
+                                 'mfcc_features': 26, 'n_mels': 40})
+        try:
+            for _ in range(2):
+                pool_results, _ = evaluate(test_func, df, batch_size=6, workers=2, pool=pool)
+                self.assertEqual(list(pool_results['prediction']), list(serial_results['prediction']))
+        finally:
+            stop_workers(pool)
+
+        # Every file once, in the order of df, also with a last shard smaller than batch_size
+        self.assertEqual(len(results), len(df))
+        self.assertEqual(list(results['filename']), list(df['filename']))
+        self.assertEqual(list(results['transcript']), list(df['transcript']))
+        self.assertEqual(list(results['prediction']), list(serial_results['prediction']))
+        self.assertEqual(summary, serial_summary)
+
+        self.assertEqual(summary['num_files'], len(df))
+        self.assertEqual(list(results['n_words']), [len(t.split()) for t in df['transcript']])
+        self.assertAlmostEqual(summary['wer'], results['word_errors'].sum() / float(results['n_words'].sum()))
+        self.assertGreaterEqual(summary['cer'], 0.0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -17,15 +17,19 @@ from datetime import datetime
 
 import keras.backend as K
 import tensorflow as tf
-from keras import models
-from keras.callbacks import ReduceLROnPlateau, ModelCheckpoint, EarlyStopping
+from keras.callbacks import ReduceLROnPlateau, EarlyStopping
+from keras.models import load_model
 from keras.optimizers import Adam
 from keras.utils import multi_gpu_model
 
 import models
+from BackgroundValidator import BackgroundValidator
+from CheckpointWriter import CheckpointWriter
 from DataGenerator import DataGenerator
 from LossCallback import LossCallback
+from ParallelLoader import ParallelLoader
 from data import combine_all_wavs_and_trans_from_csvs
+from utils.train_utils import get_eval_func
 
 
 def main(args):
@@ -34,13 +38,18 @@ def main(args):
     path_validation = "data_dir/librivox-dev-clean.csv"
     path_test = "data_dir/librivox-test-clean.csv"
 
+    frequency = 16                          # Sampling rate of data in khz (LibriSpeech is 16khz)
+    frame_length = 20 * frequency           # 20 ms frames
+    hop_length = 10 * frequency             # 10 ms hops
+
     # Create dataframes
     print "\nReading training data:"
-    _, input_dataframe = combine_all_wavs_and_trans_from_csvs(path)
+    _, input_dataframe = combine_all_wavs_and_trans_from_csvs(path, frame_length=frame_length, hop_length=hop_length)
     print "\nReading validation data: "
-    _, validation_df = combine_all_wavs_and_trans_from_csvs(path_validation)
+    _, validation_df = combine_all_wavs_and_trans_from_csvs(path_validation, frame_length=frame_length,
+                                                            hop_length=hop_length)
     print "\nReading test data: "
-    _, test_df = combine_all_wavs_and_trans_from_csvs(path_test)
+    _, test_df = combine_all_wavs_and_trans_from_csvs(path_test, frame_length=frame_length, hop_length=hop_length)
 
     # Training params:
     batch_size = args.batch_size
@@ -52,10 +61,18 @@ def main(args):
     # Multi GPU or single GPU / CPU training
     num_gpu = args.num_gpu
 
+    # Data loading params
+    workers = args.workers
+    prefetch = args.prefetch
+    sampler = args.sampler or None
+    max_frames_per_batch = args.max_frames_per_batch
+
     # Preprocessing params
     feature_type = args.feature_type
     mfcc_features = args.mfccs
     n_mels = args.mels
+    feature_store = args.feature_store
+    audio_store = args.audio_store
 
     # Model params
     model_type = args.model_type
@@ -74,19 +91,23 @@ def main(args):
     shuffle = args.shuffle_indexes
     reduce_lr = args.reduce_lr              # Reduce learning rate on val_loss plateau
     early_stopping = args.early_stopping    # Stop training early if val_loss stops improving
+    background_validation = args.background_validation
 
-    frequency = 16                          # Sampling rate of data in khz (LibriSpeech is 16khz)
     cudnnlstm = False
 
     # Data generation parameters
     data_params = {'feature_type': feature_type,
                    'batch_size': batch_size,
-                   'frame_length': 20 * frequency,
-                   'hop_length': 10 * frequency,
+                   'frame_length': frame_length,
+                   'hop_length': hop_length,
                    'mfcc_features': mfcc_features,
                    'n_mels': n_mels,
                    'epoch_length': input_epoch_length,
-                   'shuffle': shuffle
+                   'shuffle': shuffle,
+                   'feature_store_dir': feature_store,
+                   'audio_store_dir': audio_store,
+                   'sampler': sampler,
+                   'max_frames_per_batch': max_frames_per_batch
                    }
 
     # Data generators for training, validation and testing data
@@ -94,6 +115,29 @@ def main(args):
     validation_generator = DataGenerator(validation_df, **data_params)
     test_generator = DataGenerator(test_df, **data_params)
 
+    # With more than one worker, batches are generated ahead in a pool of worker processes.
+    # The pools are started before the model is created.
+    if workers > 1:
+        training_loader = ParallelLoader(training_generator, workers=workers, prefetch=prefetch, shuffle=shuffle)
+        validation_loader = ParallelLoader(validation_generator, workers=workers, prefetch=prefetch)
+    else:
+        training_loader = None
+        validation_loader = None
+
+    # Validates snapshots of the weights in a worker process while training continues.
+    # val_loss is then not known at the end of each epoch, for the callbacks using it
+    if background_validation:
+        if reduce_lr or early_stopping or save_best:
+            raise ValueError('Background validation can not be combined with callbacks using val_loss '
+                             '(reduce_lr, early_stopping, save_best_val)')
+        validator = BackgroundValidator(validation_generator, subset_batches=args.val_subset,
+                                        full_every=args.val_full_every)
+    else:
+        validator = None
+
+    # Writes checkpoints in a background thread, training only waits for a copy of the weights
+    writer = CheckpointWriter(keep=args.keep_checkpoints)
+
     # Model input shape
     if feature_type == 'mfcc':
         input_dim = mfcc_features
@@ -110,11 +154,13 @@ def main(args):
 
     # Print training data at the beginning of training
     calc_epoch_length = training_generator.__len__()
+    # With max_frames_per_batch the number of files varies between batches
+    n_training_files = sum(len(training_generator.get_indexes_in_batch(i)) for i in range(calc_epoch_length))
     print "\n\nModel and training parameters: "
     print "Starting time: ", datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     print " - epochs: ", epochs, "\n - batch size: ", batch_size, \
         "\n - input epoch length: ", input_epoch_length, "\n - network epoch length: ", calc_epoch_length, \
-        "\n - training on ", calc_epoch_length * batch_size, " files", "\n - learning rate: ", learning_rate, \
+        "\n - training on ", n_training_files, " files", "\n - learning rate: ", learning_rate, \
         "\n - hidden units: ", units, "\n - mfcc features: ", mfcc_features, "\n - dropout: ", dropout, "\n"
 
     try:
@@ -128,13 +174,13 @@ def main(args):
 
                 # When loading a parallel model saved *while* running on multiple GPUs, use load_multi
                 if load_multi:
-                    model = models.load_model(model_load, custom_objects=custom_objects)
+                    model = load_model(model_load, custom_objects=custom_objects)
                     model = model.layers[-2]
                     print "Loaded existing model at: ", model_load
 
                 # Load single GPU/CPU model or model saved *after* finished training
                 else:
-                    model = models.load_model(model_load, custom_objects=custom_objects)
+                    model = load_model(model_load, custom_objects=custom_objects)
                     print "Loaded existing model at: ", model_load
 
         else:
@@ -147,18 +193,31 @@ def main(args):
         # Loss callback parameters
         loss_callback_params = {'validation_gen': validation_generator,
                                 'test_gen': test_generator,
+                                'training_gen': training_generator,
                                 'checkpoint': checkpoint,
                                 'path_to_save': model_save,
-                                'log_file_path': log_file
+                                'log_file_path': log_file,
+                                'validation_loader': validation_loader,
+                                'validator': validator,
+                                'writer': writer,
+                                'path_to_save_best': model_save + '_best' if save_best else None
                                 }
 
         # Model training parameters
-        model_train_params = {'generator': training_generator,
-                              'epochs': epochs,
-                              'verbose': 2,
-                              'validation_data': validation_generator,
-                              'workers': 1,
-                              'shuffle': shuffle}
+        # val_loss is computed by the loss callback, in the same pass over the validation data as the WER
+        if training_loader is not None:
+            model_train_params = {'generator': training_loader.generator(),
+                                  'steps_per_epoch': len(training_loader),
+                                  'epochs': epochs,
+                                  'verbose': 2,
+                                  'workers': 0}
+        else:
+            model_train_params = {'generator': training_generator,
+                                  'epochs': epochs,
+                                  'verbose': 2,
+                                  'workers': 1,
+                                  'max_queue_size': prefetch,
+                                  'shuffle': shuffle}
 
         # Optional callbacks for added functionality
         # Reduces learning rate when val_loss stagnates.
@@ -174,12 +233,6 @@ def main(args):
             es_cb = EarlyStopping(min_delta=0, patience=5, verbose=0, mode='auto')
             callbacks.append(es_cb)
 
-        # Saves the model if val_loss is improved at "model_save" + "_best"
-        if save_best:
-            save_best = model_save + str('_best')
-            mcp_cb = ModelCheckpoint(save_best, verbose=1, save_best_only=True, period=1)
-            callbacks.append(mcp_cb)
-
         # Train with parallel model on 2 or more GPUs, must be even number
         if num_gpu > 1:
             if num_gpu % 2 == 0:
@@ -196,9 +249,11 @@ def main(args):
                 y_pred = model.get_layer('ctc').input[0]
                 test_func = K.function([input_data], [y_pred])
 
-                # The loss callback function that calculates WER while training
-                loss_cb = LossCallback(test_func=test_func, model=model, **loss_callback_params)
-                callbacks.append(loss_cb)
+                # The loss callback function that calculates val_loss and WER while training,
+                # before the callbacks using val_loss
+                loss_cb = LossCallback(test_func=test_func, model=model, eval_func=get_eval_func(model),
+                                       **loss_callback_params)
+                callbacks.insert(0, loss_cb)
 
                 # Run training
                 parallel_model.fit_generator(callbacks=callbacks, **model_train_params)
@@ -220,9 +275,11 @@ def main(args):
             y_pred = model.get_layer('ctc').input[0]
             test_func = K.function([input_data], [y_pred])
 
-            # The loss callback function that calculates WER while training
-            loss_cb = LossCallback(test_func=test_func, model=model, **loss_callback_params)
-            callbacks.append(loss_cb)
+            # The loss callback function that calculates val_loss and WER while training,
+            # before the callbacks using val_loss
+            loss_cb = LossCallback(test_func=test_func, model=model, eval_func=get_eval_func(model),
+                                   **loss_callback_params)
+            callbacks.insert(0, loss_cb)
 
             # Run training
             model.fit_generator(callbacks=callbacks, **model_train_params)
@@ -231,7 +288,9 @@ def main(args):
             raise ValueError('Not a valid number of GPUs: ', num_gpu)
 
         if args.model_save:
-            model.save(model_save)
+            # Through the writer, so the file is replaced in one rename and not written through a link
+            writer.save(model, model_save, include_optimizer=True)
+            writer.wait()
             print "Model saved: ", model_save
 
     except (Exception, ArithmeticError) as e:
@@ -240,6 +299,14 @@ def main(args):
         print message
 
     finally:
+        # Stop data loading worker processes
+        if training_loader is not None:
+            training_loader.close()
+            validation_loader.close()
+        if validator is not None:
+            validator.close()
+        writer.close()
+
         # Clear memory
         K.clear_session()
     print "Ending time: ", datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -265,6 +332,18 @@ if __name__ == '__main__':
                         help='No. of gpu for training. (0,1) sets up normal training, for CPU or one GPU. '
                              'MultiGPU training must be an even number larger than 1.')
 
+    # Data loading params
+    parser.add_argument('--workers', type=int, default=1,
+                        help='No. of processes generating batches. More than 1 generates batches in parallel.')
+    parser.add_argument('--prefetch', type=int, default=10,
+                        help='Max no. of batches generated ahead of training.')
+    parser.add_argument('--sampler', type=str, default='',
+                        help='Batch sampler: bucket groups files of similar length into batches. '
+                             'If empty, batches are consecutive files in the .csv file.')
+    parser.add_argument('--max_frames_per_batch', type=int, default=0,
+                        help='Fill each batch with files up to this no. of padded frames, instead of batch_size files. '
+                             '0 uses batch_size.')
+
     # Preprocessing params
     parser.add_argument('--feature_type', type=str, default='mfcc',
                         help='Feature extraction method: mfcc or spectrogram.')
@@ -272,6 +351,11 @@ if __name__ == '__main__':
                         help='Number of mfcc features per frame to extract.')
     parser.add_argument('--mels', type=int, default=40,
                         help='Number of mels to use in feature extraction.')
+    parser.add_argument('--feature_store', type=str, default='',
+                        help='Directory of persistent feature store. If empty features are extracted every epoch.')
+    parser.add_argument('--audio_store', type=str, default='',
+                        help='Directory of decoded audio store (see build_audio_store.py). If empty audio files '
+                             'are decoded every epoch.')
 
     # Model params
     parser.add_argument('--model_type', type=str, default='brnn',
@@ -288,6 +372,9 @@ if __name__ == '__main__':
                         help='Path, where to save model.')
     parser.add_argument('--checkpoint', type=int, default=10,
                         help='No. of epochs before save during training.')
+    parser.add_argument('--keep_checkpoints', type=int, default=1,
+                        help='No. of checkpoints to keep. More than 1 saves each checkpoint with the epoch in the '
+                             'file name, model_save links to the latest.')
     parser.add_argument('--model_load', type=str, default='',
                         help='Path of existing model to load. If empty creates new model.')
     parser.add_argument('--load_multi', action='store_true',
@@ -302,6 +389,13 @@ if __name__ == '__main__':
                         help='Reduce the learning rate if model stops improving val_loss.')
     parser.add_argument('--early_stopping', action='store_true',
                         help='Stop the training early if val_loss stops improving.')
+    parser.add_argument('--background_validation', action='store_true',
+                        help='Validate snapshots of the model in a background process while training continues.')
+    parser.add_argument('--val_subset', type=int, default=0,
+                        help='No. of random validation batches validated every epoch with background validation.')
+    parser.add_argument('--val_full_every', type=int, default=1,
+                        help='Validate all validation batches every this many epochs with background validation. '
+                             '0 only validates the subset.')
 
     args = parser.parse_args()
 
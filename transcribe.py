@@ -0,0 +1,175 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import argparse
+import json
+from datetime import datetime
+
+import keras.backend as K
+
+from utils.inference_utils import inference_input_dim, load_inference_model
+from utils.train_utils import get_decoder
+from utils.transcription import list_audio_files, read_transcribed_paths, transcribe_files
+from utils.worker_utils import start_workers, stop_workers
+
+
+def main(args):
+    pool = None
+    try:
+        if not args.model_load:
+            raise ValueError()
+
+        frequency = 16           # Sampling rate of data in khz (LibriSpeech is 16khz)
+        frame_length = 20 * frequency
+        hop_length = 10 * frequency
+
+        paths, num_samples = list_audio_files(args.input)
+        print "\nFound ", len(paths), " audio files in ", args.input
+
+        # Resumes an earlier run, the files already in the output are skipped
+        done = read_transcribed_paths(args.output)
+        if done:
+            todo = [i for i, path in enumerate(paths) if path not in done]
+            print "Skipping ", len(paths) - len(todo), " files already in ", args.output
+            paths = [paths[i] for i in todo]
+            if num_samples is not None:
+                num_samples = [num_samples[i] for i in todo]
+
+        # Model feature type, read from the model file without loading the model
+        feature_shape = inference_input_dim(args.model_load)
+        if not args.feature_type:
+            if feature_shape == 26:
+                feature_type = 'mfcc'
+            else:
+                feature_type = 'spectrogram'
+        else:
+            feature_type = args.feature_type
+
+        print "Feature type: ", feature_type
+
+        decoder = get_decoder(args.decoder, beam_width=args.beam_width, top_k=args.top_k,
+                              blank_threshold=args.blank_threshold, lm_path=args.lm, lm_weight=args.lm_weight,
+                              word_bonus=args.word_bonus, lexicon_path=args.lexicon)
+        print "Decoder: ", args.decoder
+
+        # Start the pool before loading the model (see worker_utils.start_workers)
+        pool = start_workers(args.workers, {'feature_type': feature_type, 'frame_length': frame_length,
+                                            'hop_length': hop_length, 'mfcc_features': args.mfccs,
+                                            'n_mels': args.mels, 'sr': frequency * 1000}, decoder)
+
+        # Load trained model for prediction only, without the CTC loss and optimizer.
+        # When loading a parallel model saved *while* running on GPU, use load_multi
+        test_func, _ = load_inference_model(args.model_load, load_multi=args.load_multi)
+        print "\nLoaded existing model: ", args.model_load
+
+        print "\n - Transcribing ", len(paths), " files to ", args.output
+        start = datetime.now()
+        results = transcribe_files(test_func, paths, num_samples=num_samples, feature_type=feature_type,
+                                   batch_size=args.batch_size, frame_length=frame_length, hop_length=hop_length,
+                                   mfcc_features=args.mfccs, n_mels=args.mels, sr=frequency * 1000,
+                                   decoder=decoder, workers=args.workers, sort_window=args.sort_window,
+                                   pool=pool)
+
+        n_files = 0
+        n_errors = 0
+        duration = 0.0
+        with open(args.output, 'a') as f:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+                f.flush()
+
+                n_files += 1
+                if 'error' in result:
+                    n_errors += 1
+                else:
+                    duration += result['duration']
+                if n_files % 1000 == 0:
+                    print " - Transcribed ", n_files, " files"
+
+        elapsed = (datetime.now() - start).total_seconds()
+        print "Transcription time: ", datetime.now() - start
+        print "Files: ", n_files, ", not readable: ", n_errors
+        print "Hours of audio: ", duration / 3600
+        if duration:
+            print "Real time factor: ", elapsed / duration
+
+    except (Exception, StandardError, GeneratorExit, SystemExit) as e:
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        message = template.format(type(e).__name__, e.args)
+        print "e.args: ", e.args
+        print message
+
+    finally:
+        stop_workers(pool)
+
+        # Clear memory
+        K.clear_session()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    # Transcription params:
+    parser.add_argument('--input', type=str, default="data_dir/sample_data",
+                        help='Directory (searched for .wav and .flac files), glob pattern, .csv file with a '
+                             'filename column or text file with one path per line.')
+    parser.add_argument('--output', type=str, default="transcripts.jsonl",
+                        help='Path of .jsonl file, one line with path, transcript, duration and time per file. '
+                             'If it exists, the files in it are skipped and new results are appended.')
+    parser.add_argument('--batch_size', type=int, default=32,
+                        help='Number of files in each batch of the network.')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Number of worker processes for audio decoding, feature extraction and decoding.')
+    parser.add_argument('--sort_window', type=int, default=4096,
+                        help='Number of files sorted by length together, to batch files of similar length.')
+
+    # Decoder params:
+    parser.add_argument('--decoder', type=str, default='greedy',
+                        help='Decoder of the network predictions: greedy or beam (CTC prefix beam search).')
+    parser.add_argument('--beam_width', type=int, default=16,
+                        help='Number of prefixes kept by the beam search after each frame.')
+    parser.add_argument('--top_k', type=int, default=8,
+                        help='Number of most probable characters of each frame searched by the beam search.')
+    parser.add_argument('--blank_threshold', type=float, default=0.999,
+                        help='Frames with a higher blank probability are skipped by the beam search.')
+    parser.add_argument('--lm', type=str, default='',
+                        help='Path of language model made with build_lm.py, used by the beam search. '
+                             'If empty no language model is used.')
+    parser.add_argument('--lm_weight', type=float, default=0.5,
+                        help='Weight of the language model log probabilities in the beam search.')
+    parser.add_argument('--word_bonus', type=float, default=1.0,
+                        help='Score added for each word in the beam search with a language model.')
+    parser.add_argument('--lexicon', type=str, default='',
+                        help='Path of vocabulary file (one word per line), the beam search only produces '
+                             'these words. If empty any sequence of characters is allowed.')
+
+    # Only need to specify these if feature params are changed from default (different than 26 MFCC and 40 mels)
+    parser.add_argument('--feature_type', type=str,
+                        help='Feature extraction method: mfcc or spectrogram. '
+                             'If none is specified it tries to detect feature type from input_shape.')
+    parser.add_argument('--mfccs', type=int, default=26,
+                        help='Number of mfcc features per frame to extract.')
+    parser.add_argument('--mels', type=int, default=40,
+                        help='Number of mels to use in feature extraction.')
+
+    # Model load params:
+    parser.add_argument('--model_load', type=str,
+                        help='Path of existing model to load, saved during training or exported with '
+                             'export_model.py.')
+    parser.add_argument('--load_multi', action='store_true',
+                        help='Load multi gpu model saved during parallel GPU training.')
+
+    args = parser.parse_args()
+
+    main(args)
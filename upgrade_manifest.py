@@ -0,0 +1,52 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import argparse
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from data import add_audio_info
+
+
+def main(args):
+    for csv in args.audio_dir.split(','):
+        print "\nUpgrading: ", csv
+        print "Starting time: ", datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        df = pd.read_csv(csv, sep=',')
+        df = add_audio_info(df, workers=args.workers)
+
+        # Write to a temporary file first, so an interrupted upgrade leaves the .csv file intact
+        tmp_path = csv + '.tmp'
+        df.to_csv(tmp_path, index=False)
+        os.rename(tmp_path, csv)
+
+        print "Added num_samples, sample_rate and duration of ", len(df), " files, ", \
+            "%.1f" % (df['duration'].sum() / 3600), " hours"
+        print "Ending time: ", datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--audio_dir', type=str, default="data_dir/librivox-train-clean-360.csv",
+                        help='Path to .csv file(s) to add the length of each audio file to, separated by comma.')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Number of processes reading audio file headers.')
+
+    args = parser.parse_args()
+
+    main(args)
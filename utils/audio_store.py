@@ -0,0 +1,70 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import numpy as np
+
+from memmap_store import MemmapStore
+
+
+class AudioStore(MemmapStore):
+    """
+    Persistent on-disk store of decoded audio, so audio files (e.g. FLAC) are only decoded once
+
+    All audio is kept as 16 bit PCM in a single memory-mapped int16 arena file, with an append-only index file
+    mapping (path, mtime) to (offset, number of samples, sampling rate) in the arena (see MemmapStore). Audio read
+    from the store is a view into the memory map, no copy is made. A changed mtime of an audio file makes the old
+    entry a miss.
+
+    Args:
+        store_dir (str): directory of the store
+
+    Note:
+        Only mono audio is supported. Samples are returned as int16, scale by 1 / 32768 to get the same
+        audio time series as soundfile.read (see as_float_audio in utils.feature_utils).
+
+        Appends are guarded by a file lock on the index, so several processes may fill the same store.
+
+    """
+
+    def __init__(self, store_dir):
+        MemmapStore.__init__(self, store_dir, 'audio.i16', np.int16, n_extra=1)
+
+    def get(self, path):
+        """
+        Reads the audio of one audio file from the store
+
+        :param path: path to audio file
+        :return: frames: np.ndarray[shape=(n_samples,), dtype=int16] view into the arena, or None if not in store
+                 sr: sampling rate of frames, or None if not in store
+        """
+        entry = self.get_entry(path)
+        if entry is None:
+            return None, None
+
+        frames, (sr,) = entry
+        return frames, sr
+
+    def put(self, path, frames, sr):
+        """
+        Appends the audio of one audio file to the store
+
+        :param path: path to audio file
+        :param frames: np.ndarray[shape=(n_samples,), dtype=int16] audio time series as 16 bit PCM
+        :param sr: sampling rate of frames
+        """
+        frames = np.asarray(frames)
+        if frames.ndim != 1 or frames.dtype != np.int16:
+            raise ValueError('Audio must be mono int16 PCM, got: ', (frames.shape, frames.dtype))
+
+        self.append(path, frames, (sr,))
@@ -0,0 +1,178 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import math
+
+import numpy as np
+
+NEG_INF = float('-inf')
+
+
+def beam_decode(y_pred, input_length=None, beam_width=16, top_k=8, blank_threshold=0.999, blank=28, scorer=None):
+    """
+    CTC prefix beam search of a whole batch, in log space
+
+    The log probabilities, the top_k classes of each frame and the frames to skip are computed for the whole
+    batch at once, the search itself runs per sequence.
+
+    :param y_pred: np.ndarray[shape=(batch, frames, classes)] network output (softmax)
+    :param input_length: optional number of frames of each sequence, frames after these are not decoded
+    :param beam_width: number of prefixes kept after each frame
+    :param top_k: number of most probable classes of each frame that extend the prefixes
+    :param blank_threshold: frames where the blank probability is above this only end the prefixes in blank,
+                            without extending them. 1.0 extends the prefixes at every frame
+    :param blank: index of the CTC blank
+    :param scorer: optional scorer adding a score to the prefixes, e.g. a LanguageModelScorer for shallow fusion
+                   with a language model (see prefix_beam_search)
+    :return: decoded: np.ndarray[shape=(batch, max_decoded_length)] with decoded sequences, padded with blank
+             decoded_length: np.ndarray[shape=(batch,)] length of each decoded sequence
+    """
+    batch, frames, classes = y_pred.shape
+    if input_length is None:
+        input_length = np.full(batch, frames)
+    input_length = np.minimum(np.reshape(input_length, -1), frames)
+
+    log_probs = np.log(np.maximum(y_pred, 1e-30)).astype(np.float64)
+    skip = y_pred[:, :, blank] > blank_threshold
+
+    top_k = min(top_k, classes)
+    candidates = np.argpartition(-y_pred, top_k - 1, axis=2)[:, :, :top_k]
+
+    sequences = [prefix_beam_search(log_probs[i, :input_length[i]], candidates[i, :input_length[i]],
+                                    skip[i, :input_length[i]], beam_width, blank, scorer)
+                 for i in range(batch)]
+
+    decoded_length = np.array([len(s) for s in sequences], dtype=np.int64)
+    decoded = np.full((batch, decoded_length.max() if batch else 0), blank, dtype=np.int64)
+    for i, sequence in enumerate(sequences):
+        decoded[i, :len(sequence)] = sequence
+
+    return decoded, decoded_length
+
+
+def prefix_beam_search(log_probs, candidates, skip, beam_width=16, blank=28, scorer=None):
+    """
+    CTC prefix beam search of one sequence
+
+    Each prefix keeps the log probability of all alignments ending in blank and ending in its last class,
+    so a repeated class is only added to a prefix when a blank separates the two.
+
+    A scorer adds a log score to each prefix on top of the CTC probability, used to rank the prefixes.
+    It has the methods initial_state(), returning the state of the empty prefix, extend(state, c), returning
+    the state and score added when class c is appended to a prefix (or None if c may not be appended),
+    and finish(state), returning the score added at the end of the sequence. A scorer that rejects most
+    classes can also have allowed(state), returning the set of classes that may be appended, so the other
+    candidates are skipped before the prefix is extended.
+
+    :param log_probs: np.ndarray[shape=(frames, classes)] log probabilities
+    :param candidates: np.ndarray[shape=(frames, k)] classes that extend the prefixes at each frame
+    :param skip: np.ndarray[shape=(frames,)] frames that only end the prefixes in blank
+    :param beam_width: number of prefixes kept after each frame
+    :param blank: index of the CTC blank
+    :param scorer: optional scorer adding a score to the prefixes
+    :return: most probable prefix, as tuple of classes
+    """
+    # prefix -> (log probability ending in blank, log probability ending in the last class of the prefix)
+    beams = {(): (0.0, NEG_INF)}
+
+    # prefix -> (scorer state, total score of the scorer), None for prefixes rejected by the scorer
+    scores = {(): (scorer.initial_state(), 0.0)} if scorer is not None else None
+
+    # prefix -> classes the scorer allows to append, computed when the prefix is first extended
+    allowed = {} if scorer is not None and hasattr(scorer, 'allowed') else None
+
+    def beam_score(beam):
+        prefix, (p_b, p_nb) = beam
+        if scores is None:
+            return _log_add(p_b, p_nb)
+        return _log_add(p_b, p_nb) + scores[prefix][1]
+
+    for t in range(log_probs.shape[0]):
+        frame = log_probs[t].tolist()
+
+        if skip[t]:
+            # Almost certainly blank: all alignments now end in blank
+            beams = dict((prefix, (_log_add(p_b, p_nb) + frame[blank], NEG_INF))
+                         for prefix, (p_b, p_nb) in beams.items())
+            continue
+
+        frame_candidates = [c for c in candidates[t].tolist() if c != blank]
+
+        next_beams = {}
+        for prefix, (p_b, p_nb) in beams.items():
+            p_total = _log_add(p_b, p_nb)
+            last = prefix[-1] if prefix else None
+
+            # Blank, or the last class repeated, keep the prefix
+            _extend(next_beams, prefix, p_total + frame[blank], NEG_INF)
+            if last is not None:
+                _extend(next_beams, prefix, NEG_INF, p_nb + frame[last])
+
+            prefix_candidates = frame_candidates
+            if allowed is not None:
+                if prefix not in allowed:
+                    allowed[prefix] = scorer.allowed(scores[prefix][0])
+                prefix_candidates = [c for c in frame_candidates if c in allowed[prefix]]
+
+            for c in prefix_candidates:
+                extended = prefix + (c,)
+                if scores is not None:
+                    if extended not in scores:
+                        scores[extended] = _score_extension(scorer, scores[prefix], c)
+                    if scores[extended] is None:
+                        continue
+
+                # A repeated class only starts a new character after a blank
+                p = p_b if c == last else p_total
+                _extend(next_beams, extended, NEG_INF, p + frame[c])
+
+        beams = dict(sorted(next_beams.items(), key=beam_score, reverse=True)[:beam_width])
+        if scores is not None:
+            scores = dict((prefix, scores[prefix]) for prefix in beams)
+        if allowed is not None:
+            allowed = dict((prefix, allowed[prefix]) for prefix in beams if prefix in allowed)
+
+    if scores is None:
+        return max(beams.items(), key=beam_score)[0]
+
+    return max(beams.items(), key=lambda beam: beam_score(beam) + scorer.finish(scores[beam[0]][0]))[0]
+
+
+def _score_extension(scorer, prefix_score, c):
+    """Scorer state and total score of a prefix extended with class c, or None if rejected by the scorer"""
+    state, score = prefix_score
+    extended = scorer.extend(state, c)
+    if extended is None:
+        return None
+    return extended[0], score + extended[1]
+
+
+def _extend(beams, prefix, p_b, p_nb):
+    """Adds the probabilities of new alignments to prefix in beams"""
+    if prefix in beams:
+        old_b, old_nb = beams[prefix]
+        beams[prefix] = (_log_add(old_b, p_b), _log_add(old_nb, p_nb))
+    else:
+        beams[prefix] = (p_b, p_nb)
+
+
+def _log_add(a, b):
+    """log(exp(a) + exp(b))"""
+    if a == NEG_INF:
+        return b
+    if b == NEG_INF:
+        return a
+    if a > b:
+        return a + math.log1p(math.exp(b - a))
+    return b + math.log1p(math.exp(a - b))
@@ -0,0 +1,136 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import numpy as np
+
+from feature_utils import extract_features_file, extract_features_long
+from text_utils import int_sequences_to_text
+from train_utils import greedy_decode
+
+
+def predict_chunked(test_func, features, window_frames=1000, overlap_frames=100, batch_size=8):
+    """
+    Network predictions of a long feature sequence, predicted in overlapping windows
+
+    The windows are predicted in batches of batch_size windows. Of each window only the middle part is kept,
+    overlap_frames frames from both of its ends are left to the neighbouring windows (except at the ends of
+    the sequence), so every kept frame has at least overlap_frames frames of context on both sides.
+    The memory used by the network is bounded by batch_size windows, whatever the length of the sequence.
+
+    :param test_func: function that takes preprocessed audio input and outputs network predictions,
+                      with one output frame per input frame
+    :param features: np.ndarray[shape=(n_frames, n_features)]: features of the sequence
+    :param window_frames: number of frames in each window
+    :param overlap_frames: number of frames each window overlaps the kept part of its neighbours on both sides
+    :param batch_size: number of windows predicted at once
+    :return: y_pred: np.ndarray[shape=(n_frames, n_classes)]: network predictions of the sequence
+    """
+    step = window_frames - 2 * overlap_frames
+    if step <= 0:
+        raise ValueError('Not a valid overlap, must be less than half the window: ', overlap_frames)
+
+    n_frames = len(features)
+    if n_frames <= window_frames:
+        return test_func([features[np.newaxis]])[0][0]
+
+    # Window i starts at i * step and keeps [i * step + overlap, (i + 1) * step + overlap),
+    # the first window keeps its start and the last window, the first reaching the end, keeps its end
+    n_windows = -(-(n_frames - window_frames) // step) + 1
+    starts = [i * step for i in range(n_windows)]
+
+    y_pred = None
+    for i in range(0, len(starts), batch_size):
+        batch_starts = starts[i:i + batch_size]
+
+        # The last window may be shorter, zero-padded frames are masked by the network
+        x_data = np.zeros([len(batch_starts), window_frames, features.shape[1]], dtype=np.float32)
+        for j, start in enumerate(batch_starts):
+            window = features[start:start + window_frames]
+            x_data[j, :len(window)] = window
+
+        y_windows = test_func([x_data])[0]
+        if y_windows.shape[1] != window_frames:
+            raise ValueError('Not a valid model for chunked inference, output frames per window: ',
+                             y_windows.shape[1])
+        if y_pred is None:
+            y_pred = np.empty([n_frames, y_windows.shape[2]], dtype=y_windows.dtype)
+
+        for j, start in enumerate(batch_starts):
+            keep_start = 0 if start == 0 else start + overlap_frames
+            keep_end = n_frames if start == starts[-1] else start + overlap_frames + step
+            y_pred[keep_start:keep_end] = y_windows[j, keep_start - start:keep_end - start]
+
+    return y_pred
+
+
+def transcribe_long(test_func, frames, sr, feature_type='mfcc', frame_length=320, hop_length=160, mfcc_features=26,
+                    n_mels=40, decoder=None, window_frames=1000, overlap_frames=100, batch_size=8):
+    """
+    Transcribes a long audio time series, with the network predicting overlapping windows (see predict_chunked)
+
+    :param test_func: function that takes preprocessed audio input and outputs network predictions
+    :param frames: audio time series
+    :param sr: sampling rate of audio time series
+    :param feature_type: mfcc or spectrogram
+    :param frame_length: length of the frames to be extracted
+    :param hop_length: length of hops (for overlap)
+    :param mfcc_features: number of mfcc features to extract
+    :param n_mels: number of mels
+    :param decoder: function decoding network output, see max_decode. Default is greedy_decode
+    :param window_frames: number of frames in each window
+    :param overlap_frames: number of frames of context on both sides of the kept part of each window
+    :param batch_size: number of windows predicted at once
+    :return: transcript
+    """
+    features = extract_features_long(frames, sr, feature_type, frame_length, hop_length, mfcc_features, n_mels)
+    y_pred = predict_chunked(test_func, features, window_frames=window_frames, overlap_frames=overlap_frames,
+                             batch_size=batch_size)
+    return _decode(y_pred, decoder)
+
+
+def transcribe_file(test_func, path, feature_type='mfcc', frame_length=320, hop_length=160, mfcc_features=26,
+                    n_mels=40, decoder=None, window_frames=1000, overlap_frames=100, batch_size=8,
+                    block_samples=2 ** 20):
+    """
+    Transcribes a long audio file like transcribe_long, with the audio read in blocks of block_samples samples
+    (see extract_features_file), so neither the audio nor the network input is in memory as a whole.
+    Only the features and network predictions of the whole file are kept, for decoding.
+
+    :param test_func: function that takes preprocessed audio input and outputs network predictions
+    :param path: path to mono audio file
+    :param feature_type: mfcc or spectrogram
+    :param frame_length: length of the frames to be extracted
+    :param hop_length: length of hops (for overlap)
+    :param mfcc_features: number of mfcc features to extract
+    :param n_mels: number of mels
+    :param decoder: function decoding network output, see max_decode. Default is greedy_decode
+    :param window_frames: number of frames in each window
+    :param overlap_frames: number of frames of context on both sides of the kept part of each window
+    :param batch_size: number of windows predicted at once
+    :param block_samples: number of samples read at once
+    :return: transcript
+    """
+    features, _ = extract_features_file(path, feature_type, frame_length, hop_length, mfcc_features, n_mels,
+                                        block_samples=block_samples)
+    y_pred = predict_chunked(test_func, features, window_frames=window_frames, overlap_frames=overlap_frames,
+                             batch_size=batch_size)
+    return _decode(y_pred, decoder)
+
+
+def _decode(y_pred, decoder):
+    """Transcript of the network predictions of one sequence"""
+    # -2 because ctc discards the first two outputs of the rnn network
+    decoder = decoder if decoder is not None else greedy_decode
+    decoded, decoded_length = decoder(y_pred[np.newaxis, 2:], np.array([len(y_pred) - 2]))
+    return int_sequences_to_text(decoded, decoded_length)[0]
@@ -0,0 +1,155 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from soundfile import read
+
+from feature_utils import extract_features_batch
+from text_utils import int_sequences_to_text
+from wer_utils import error_rates
+from worker_utils import start_workers, stop_workers, submitter, worker
+
+
+def evaluate(test_func, df, feature_type='mfcc', batch_size=32, frame_length=320, hop_length=160, mfcc_features=26,
+             n_mels=40, decoder=None, workers=4, audio_store_dir=None, pool=None):
+    """
+    Transcribes every audio file in df exactly once and computes the word and character error rates
+
+    The files are sorted by length and split into shards of batch_size files. Audio decoding and feature
+    extraction of the next shards, and decoding and scoring of the previous shards, run in a pool of worker
+    processes while the network runs on the current shard in this process.
+
+    :param test_func: Keras function that takes preprocessed audio input and outputs network predictions
+    :param df: dataframe containing filename and transcript, optionally num_samples
+    :param feature_type: mfcc or spectrogram
+    :param batch_size: number of files in each shard
+    :param frame_length: length of the frames to be extracted
+    :param hop_length: length of hops (for overlap)
+    :param mfcc_features: number of mfcc features to extract
+    :param n_mels: number of mels
+    :param decoder: function decoding network output, see max_decode. Must be picklable if workers > 1
+    :param workers: number of worker processes, 0 or 1 does all work in this process
+    :param audio_store_dir: optional directory of an AudioStore, audio in the store is not decoded
+    :param pool: optional pool of workers processes started with worker_utils.start_workers, with the same
+                 settings, used instead of starting a pool here. Start it before loading the model (see
+                 worker_utils.start_workers). The pool is not stopped
+    :return: results: pd.DataFrame with one row per file in the order of df: filename, transcript, prediction,
+                      substitutions, insertions, deletions (of words), word_errors, n_words, wer,
+                      char_errors, n_chars, cer
+             summary: dict with wer and cer (errors / words or characters of all files), mean_wer (average WER
+                      of the files, as calc_wer) and num_files
+    """
+    filenames = df['filename'].values
+    transcripts = df['transcript'].values
+    lengths = df['num_samples'].values if 'num_samples' in df else df['filesize'].values
+
+    order = np.argsort(lengths, kind='mergesort')
+    shards = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+    feature_params = {'feature_type': feature_type, 'frame_length': frame_length, 'hop_length': hop_length,
+                      'mfcc_features': mfcc_features, 'n_mels': n_mels}
+    own_pool = pool is None
+    if own_pool:
+        pool = start_workers(workers, feature_params, decoder, audio_store_dir)
+    submit = submitter(pool)
+
+    # Shards prepared ahead of the network, and shards waiting to be decoded
+    max_pending = max(2, 2 * workers)
+    features = deque()
+    decoding = deque()
+    scores = [None] * len(shards)
+
+    try:
+        for i in range(min(max_pending, len(shards))):
+            features.append(submit(_extract_shard, (filenames[shards[i]],)))
+
+        for i, shard in enumerate(shards):
+            x_data, input_length = features.popleft().get()
+            if i + max_pending < len(shards):
+                features.append(submit(_extract_shard, (filenames[shards[i + max_pending]],)))
+
+            y_pred = test_func([x_data])[0]
+            decoding.append((i, submit(_decode_shard, (y_pred, input_length, transcripts[shard]))))
+
+            # Bounds the network outputs held in memory when decoding is slower than the network
+            while len(decoding) > max_pending:
+                j, result = decoding.popleft()
+                scores[j] = result.get()
+
+        for j, result in decoding:
+            scores[j] = result.get()
+    finally:
+        if own_pool:
+            stop_workers(pool)
+
+    # Scores of the files in the order of df
+    results = pd.DataFrame([row for shard_scores in scores for row in shard_scores],
+                           columns=['prediction', 'substitutions', 'insertions', 'deletions', 'n_words',
+                                    'char_errors', 'n_chars'])
+    results.index = np.concatenate(shards) if shards else []
+    results = results.sort_index()
+
+    results.insert(0, 'filename', filenames)
+    results.insert(1, 'transcript', transcripts)
+    results['word_errors'] = results['substitutions'] + results['insertions'] + results['deletions']
+    results['wer'] = results['word_errors'] / np.maximum(results['n_words'], 1).astype(np.float64)
+    results['cer'] = results['char_errors'] / np.maximum(results['n_chars'], 1).astype(np.float64)
+    results = results[['filename', 'transcript', 'prediction', 'substitutions', 'insertions', 'deletions',
+                       'word_errors', 'n_words', 'wer', 'char_errors', 'n_chars', 'cer']]
+
+    summary = {'wer': results['word_errors'].sum() / float(max(results['n_words'].sum(), 1)),
+               'cer': results['char_errors'].sum() / float(max(results['n_chars'].sum(), 1)),
+               'mean_wer': np.minimum(results['wer'], 1.0).mean() if len(results) else 0.0,
+               'num_files': len(results)}
+
+    return results, summary
+
+
+def _extract_shard(paths):
+    """Padded features and input length (as seen by the CTC) of the audio files in paths"""
+    audio_store = worker['audio_store']
+    x_data_raw = []
+    for path in paths:
+        frames = None
+        if audio_store is not None:
+            frames, sr = audio_store.get(path)
+        if frames is None:
+            frames, sr = read(path)
+        x_data_raw.append(frames)
+
+    params = worker['feature_params']
+    x_data, x_length = extract_features_batch(x_data_raw, sr, params['feature_type'], params['frame_length'],
+                                              params['hop_length'], params['mfcc_features'], params['n_mels'])
+
+    # -2 because ctc discards the first two outputs of the rnn network
+    return x_data, x_length - 2
+
+
+def _decode_shard(y_pred, input_length, transcripts):
+    """Prediction, word substitutions, insertions and deletions, number of words, character errors and number of
+    characters of each file"""
+    decoded, decoded_length = worker['decoder'](y_pred[:, 2:], input_length)
+    predictions = int_sequences_to_text(decoded, decoded_length)
+    rates = error_rates(transcripts, predictions)
+
+    scores = []
+    for i, prediction in enumerate(predictions):
+        substitutions, insertions, deletions = rates['word_edits'][i].tolist()
+        scores.append((prediction, substitutions, insertions, deletions, int(rates['n_words'][i]),
+                       int(rates['char_errors'][i]), int(rates['n_chars'][i])))
+
+    return scores
@@ -0,0 +1,80 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import os
+
+import numpy as np
+
+from memmap_store import MemmapStore
+
+
+class FeatureStore(MemmapStore):
+    """
+    Persistent on-disk store of extracted features (MFCC or mel spectrogram)
+
+    All features for one set of feature parameters are kept in a single memory-mapped float32 file,
+    with an append-only index file mapping (path, mtime) to (offset, number of frames) in the data file
+    (see MemmapStore). Changing feature_type, frame_length, hop_length, mfcc_features or n_mels selects a
+    different sub-directory, and a changed mtime of an audio file makes the old entry a miss.
+
+    Args:
+        store_dir (str): root directory of the store
+        feature_type (str, default='mfcc'): mfcc or spectrogram
+        frame_length (int): size of each frame (samples per frame)
+        hop_length (int): how far to move center of each frame when splitting audio time series
+        mfcc_features (int, default=26): how many mfcc-features to extract for each frame
+        n_mels (int, default=40): number of mels
+
+    Note:
+        Appends are guarded by a file lock on the index, so several processes may fill the same store.
+
+    """
+
+    def __init__(self, store_dir, feature_type='mfcc', frame_length=320, hop_length=160, mfcc_features=26,
+                 n_mels=40):
+        self.feature_type = feature_type
+
+        if feature_type == 'mfcc':
+            self.n_features = mfcc_features
+        elif feature_type == 'spectrogram':
+            self.n_features = n_mels
+        else:
+            raise ValueError('Not a valid feature type: ', feature_type)
+
+        params = '%s_fl%d_hl%d_mfcc%d_mels%d' % (feature_type, frame_length, hop_length, mfcc_features, n_mels)
+        MemmapStore.__init__(self, os.path.join(store_dir, params), 'features.f32', np.float32,
+                             row_shape=(self.n_features,))
+
+    def get(self, path):
+        """
+        Reads the features of one audio file from the store
+
+        :param path: path to audio file
+        :return: np.ndarray[shape=(n_frames, n_features), dtype=float32] or None if not in store
+        """
+        entry = self.get_entry(path)
+        return entry[0] if entry is not None else None
+
+    def put(self, path, features):
+        """
+        Appends the features of one audio file to the store
+
+        :param path: path to audio file
+        :param features: np.ndarray[shape=(n_frames, n_features)]
+        """
+        features = np.asarray(features)
+        if features.ndim != 2 or features.shape[1] != self.n_features:
+            raise ValueError('Features must have shape (n_frames, %d), got: ' % self.n_features, features.shape)
+
+        self.append(path, features)
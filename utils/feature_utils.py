@@ -13,19 +13,31 @@ If not, see http://www.gnu.org/licenses/.
 """
 
 import numpy as np
-from keras.preprocessing.sequence import pad_sequences
+from librosa import filters
 from librosa.feature import mfcc, melspectrogram
-from soundfile import read
+from numpy.lib.stride_tricks import as_strided
+from scipy import fftpack
+from scipy.signal import get_window
+from soundfile import blocks, info, read
 
-from utils.text_utils import text_to_int_sequence
+from utils.text_utils import encode_transcripts, gather_and_pad_labels
 
+# Largest block of windowed frames (in bytes) transformed in one FFT call by extract_features_batch
+MAX_MEM_BLOCK = 2**26
 
-def load_audio(df, indexes_in_batch):
+# Window, mel filterbank and DCT matrices used by extract_features_batch, keyed by their parameters
+_basis_cache = {}
+
+
+def load_audio(df, indexes_in_batch, feature_store=None, audio_store=None):
     """
     loads the the corresponding frames (audio time series) from dataframe containing filename, filesize, transcript
     :param df: dataframe containing filename, filesize, transcript
     :param indexes_in_batch: list containing the indexes of the audio filenames in the dataframe that is to be loaded
-    :return: x_data_raw: list containing loaded audio time series
+    :param feature_store: optional FeatureStore, audio files already in the store are not decoded
+    :param audio_store: optional AudioStore, audio files in the store are read as int16 views of the store
+                        instead of being decoded, see as_float_audio
+    :return: x_data_raw: list containing loaded audio time series (None for files found in feature_store)
              y_data_raw: list containing transcripts corresponding to loaded audio
              sr: sampling rate of frames
     """
@@ -38,8 +50,15 @@ def load_audio(df, indexes_in_batch):
 
         # Read sound data
         path = df.iloc[i]['filename']
-        frames, sr = read(path)
-        x_data_raw.append(frames)
+        if feature_store is not None and path in feature_store:
+            x_data_raw.append(None)
+        else:
+            frames = None
+            if audio_store is not None:
+                frames, sr = audio_store.get(path)
+            if frames is None:
+                frames, sr = read(path)
+            x_data_raw.append(frames)
 
         # Read transcript data
         y_txt = df.iloc[i]['transcript']
@@ -48,6 +67,227 @@ def load_audio(df, indexes_in_batch):
     return x_data_raw, y_data_raw, sr
 
 
+def as_float_audio(frames):
+    """
+    Audio time series as floats, 16 bit PCM (int16, e.g. from an AudioStore) is scaled to [-1, 1)
+    like soundfile.read does when decoding
+    :param frames: audio time series
+    :return: audio time series as floats (frames itself if already floats)
+    """
+    if frames.dtype == np.int16:
+        return frames * np.float32(1.0 / 32768)
+    return frames
+
+
+def get_num_frames(num_samples, frame_length, hop_length):
+    """
+    Number of feature frames librosa produces for an audio time series, without extracting features.
+    librosa centers the frames by padding frame_length // 2 samples on both sides of the audio time series.
+    :param num_samples: number of samples in audio time series (int or numpy array of ints)
+    :param frame_length: length of the frames to be extracted
+    :param hop_length: length of hops (for overlap)
+    :return: number of frames (int or numpy array of ints)
+    """
+    return 1 + (num_samples + 2 * (frame_length // 2) - frame_length) // hop_length
+
+
+def extract_features(frames, sr, feature_type, frame_length, hop_length, mfcc_features, n_mels):
+    """
+    Generates unpadded MFCC or mel spectrogram features, one row per frame
+    :param frames: audio time series
+    :param sr: sampling rate of audio time series
+    :param feature_type: mfcc or spectrogram
+    :param frame_length: length of the frames to be extracted
+    :param hop_length: length of hops (for overlap)
+    :param mfcc_features: number of mfcc features to extract
+    :param n_mels: number of mels
+    :return: features: np.ndarray[shape=(n_frames, n_features), dtype=float32]
+    """
+    frames = as_float_audio(frames)
+    if feature_type == 'mfcc':
+        features = mfcc(frames, sr, n_fft=frame_length, hop_length=hop_length, n_mfcc=mfcc_features, n_mels=n_mels)
+    elif feature_type == 'spectrogram':
+        features = melspectrogram(frames, sr, n_fft=frame_length, hop_length=hop_length, n_mels=n_mels)
+    else:
+        raise ValueError('Not a valid feature type: ', feature_type)
+
+    return features.T.astype(np.float32)
+
+
+def extract_features_batch(x_data_raw, sr, feature_type, frame_length, hop_length, mfcc_features, n_mels):
+    """
+    Generates zero-padded MFCC or mel spectrogram features for a whole batch of audio time series at once.
+    All audio in the batch is framed with stride tricks and transformed with one real FFT, the mel filterbank
+    and the DCT are applied as matrix products in float32.
+    Gives the same features as extract_features (librosa) for each audio time series.
+    :param x_data_raw: list with audio time series
+    :param sr: sampling rate of audio time series
+    :param feature_type: mfcc or spectrogram
+    :param frame_length: length of the frames to be extracted
+    :param hop_length: length of hops (for overlap)
+    :param mfcc_features: number of mfcc features to extract
+    :param n_mels: number of mels
+    :return: x_data: np.ndarray[shape=(batch, max_length, n_features), dtype=float32]: padded features
+             x_length: np.ndarray[shape=(batch,)]: unpadded length of each feature-sequence
+    """
+    if feature_type not in ('mfcc', 'spectrogram'):
+        raise ValueError('Not a valid feature type: ', feature_type)
+
+    window, mel_basis, dct_basis = _get_basis(sr, frame_length, n_mels, mfcc_features)
+
+    # Center the frames like librosa, by reflect-padding each audio time series
+    padding = frame_length // 2
+    x_length = get_num_frames(np.array([len(frames) for frames in x_data_raw]), frame_length, hop_length)
+    max_length = x_length.max()
+
+    signals = np.zeros([len(x_data_raw), max(len(frames) for frames in x_data_raw) + 2 * padding],
+                       dtype=np.float32)
+    for i, frames in enumerate(x_data_raw):
+        signals[i, :len(frames) + 2 * padding] = np.pad(as_float_audio(frames), padding, mode='reflect')
+
+    # (batch, frames, frame_length) view of the signals, no copy
+    itemsize = signals.itemsize
+    windows = as_strided(signals, shape=(signals.shape[0], max_length, frame_length),
+                         strides=(signals.strides[0], hop_length * itemsize, itemsize))
+
+    # Mel power spectrogram, transformed in blocks of utterances to bound memory
+    spectrogram = np.empty([len(x_data_raw), max_length, n_mels], dtype=np.float32)
+    block = max(1, MAX_MEM_BLOCK // (max_length * frame_length * 8))
+    for start in range(0, len(x_data_raw), block):
+        power = _power_spectrum(windows[start:start + block] * window)
+        spectrogram[start:start + block] = np.dot(power.reshape(-1, power.shape[-1]), mel_basis) \
+            .reshape(power.shape[:2] + (n_mels,))
+
+    # Frames past the end of each audio time series
+    padded = np.arange(max_length) >= x_length[:, np.newaxis]
+
+    if feature_type == 'mfcc':
+        # Log power (dB), clipped to 80 dB below the maximum of each audio time series as in librosa.power_to_db
+        log_spec = 10.0 * np.log10(np.maximum(spectrogram, 1e-10))
+        top = np.where(padded[:, :, np.newaxis], -np.inf, log_spec).max(axis=(1, 2)) - 80.0
+        log_spec = np.maximum(log_spec, top[:, np.newaxis, np.newaxis])
+        x_data = np.dot(log_spec.reshape(-1, n_mels), dct_basis).reshape(log_spec.shape[:2] + (-1,))
+    else:
+        x_data = spectrogram
+
+    x_data[padded] = 0
+
+    return x_data, x_length
+
+
+def extract_features_long(frames, sr, feature_type, frame_length, hop_length, mfcc_features, n_mels,
+                          block_frames=8192):
+    """
+    Generates MFCC or mel spectrogram features of one long audio time series, transformed in blocks of
+    block_frames frames so the framed audio and its spectrum never exist for the whole time series at once.
+    Gives the same features as extract_features_batch for the time series alone.
+    :param frames: audio time series
+    :param sr: sampling rate of audio time series
+    :param feature_type: mfcc or spectrogram
+    :param frame_length: length of the frames to be extracted
+    :param hop_length: length of hops (for overlap)
+    :param mfcc_features: number of mfcc features to extract
+    :param n_mels: number of mels
+    :param block_frames: number of frames transformed at once
+    :return: features: np.ndarray[shape=(n_frames, n_features), dtype=float32]
+    """
+    if feature_type not in ('mfcc', 'spectrogram'):
+        raise ValueError('Not a valid feature type: ', feature_type)
+
+    window, mel_basis, dct_basis = _get_basis(sr, frame_length, n_mels, mfcc_features)
+
+    # Center the frames like librosa, by reflect-padding the audio time series
+    padding = frame_length // 2
+    n_frames = get_num_frames(len(frames), frame_length, hop_length)
+    signal = np.pad(as_float_audio(frames).astype(np.float32, copy=False), padding, mode='reflect')
+
+    # (frames, frame_length) view of the signal, no copy
+    itemsize = signal.itemsize
+    windows = as_strided(signal, shape=(n_frames, frame_length), strides=(hop_length * itemsize, itemsize))
+
+    spectrogram = np.empty([n_frames, n_mels], dtype=np.float32)
+    for start in range(0, n_frames, block_frames):
+        spectrogram[start:start + block_frames] = np.dot(
+            _power_spectrum(windows[start:start + block_frames] * window), mel_basis)
+
+    if feature_type == 'spectrogram':
+        return spectrogram
+
+    # Log power (dB), clipped to 80 dB below the maximum of the whole time series as in librosa.power_to_db
+    log_spec = 10.0 * np.log10(np.maximum(spectrogram, 1e-10))
+    np.maximum(log_spec, log_spec.max() - 80.0, out=log_spec)
+    return np.dot(log_spec, dct_basis)
+
+
+def extract_features_file(path, feature_type, frame_length, hop_length, mfcc_features, n_mels,
+                          block_samples=2 ** 20):
+    """
+    Generates MFCC or mel spectrogram features of a long audio file, read in blocks of block_samples samples
+    (see StreamingFeatureExtractor), so the audio is never in memory as a whole. For MFCC the file is read twice,
+    first for the maximum log mel power of the whole file. Gives the same features as extract_features_long
+    for the audio time series of the file.
+    :param path: path to mono audio file
+    :param feature_type: mfcc or spectrogram
+    :param frame_length: length of the frames to be extracted
+    :param hop_length: length of hops (for overlap)
+    :param mfcc_features: number of mfcc features to extract
+    :param n_mels: number of mels
+    :param block_samples: number of samples read at once
+    :return: features: np.ndarray[shape=(n_frames, n_features), dtype=float32]
+             sr: sampling rate of the audio file
+    """
+    header = info(path)
+    if header.channels != 1:
+        raise ValueError('Not a valid mono audio file, channels: ', header.channels)
+    sr = header.samplerate
+
+    max_db = None
+    if feature_type == 'mfcc':
+        extractor = StreamingFeatureExtractor(sr, 'spectrogram', frame_length, hop_length, mfcc_features, n_mels)
+        max_power = max([spectrogram.max() for spectrogram in _stream_features(extractor, path, block_samples)
+                         if len(spectrogram)] or [0.0])
+        # Same rounding as the log power of the frames
+        max_db = (10.0 * np.log10(np.maximum(np.array([max_power], dtype=np.float32), 1e-10)))[0]
+
+    extractor = StreamingFeatureExtractor(sr, feature_type, frame_length, hop_length, mfcc_features, n_mels,
+                                          max_db=max_db)
+    return np.concatenate(list(_stream_features(extractor, path, block_samples))), sr
+
+
+def _stream_features(extractor, path, block_samples):
+    """Features of an audio file read in blocks, from a StreamingFeatureExtractor"""
+    for block in blocks(path, blocksize=block_samples, dtype='float32'):
+        yield extractor.accept(block)
+    yield extractor.flush()
+
+
+def _power_spectrum(frames):
+    """Power spectrum |rfft(frames)|**2 along the last axis, computed in float32"""
+    n = frames.shape[-1]
+    packed = fftpack.rfft(frames, axis=-1)  # [r0, r1, i1, r2, i2, ...]
+    pairs = (n - 1) // 2
+
+    power = np.empty(frames.shape[:-1] + (n // 2 + 1,), dtype=np.float32)
+    power[..., 0] = packed[..., 0] ** 2
+    power[..., 1:pairs + 1] = packed[..., 1:2 * pairs:2] ** 2 + packed[..., 2:2 * pairs + 1:2] ** 2
+    if n % 2 == 0:
+        power[..., -1] = packed[..., -1] ** 2
+
+    return power
+
+
+def _get_basis(sr, frame_length, n_mels, mfcc_features):
+    """Cached window, mel filterbank and DCT matrices, transposed for right-multiplication of frames"""
+    key = (sr, frame_length, n_mels, mfcc_features)
+    if key not in _basis_cache:
+        window = get_window('hann', frame_length, fftbins=True).astype(np.float32)
+        mel_basis = filters.mel(sr, frame_length, n_mels=n_mels).T.astype(np.float32)
+        dct_basis = filters.dct(mfcc_features or n_mels, n_mels).T.astype(np.float32)
+        _basis_cache[key] = window, mel_basis, dct_basis
+
+    return _basis_cache[key]
+
+
 def extract_mfcc_and_pad(frames, sr, max_pad_length, frame_length, hop_length, mfcc_features, n_mels):
     """
     Generates MFCC (mel frequency cepstral coefficients) and zero-pads with max_pad_length
@@ -62,11 +302,9 @@ def extract_mfcc_and_pad(frames, sr, max_pad_length, frame_length, hop_length, m
              x_length: unpadded length MFCC-sequence
     """
 
-    mfcc_frames = mfcc(frames, sr, n_fft=frame_length, hop_length=hop_length, n_mfcc=mfcc_features, n_mels=n_mels)
-    x_length = mfcc_frames.shape[1]
-    mfcc_padded = pad_sequences(mfcc_frames, maxlen=max_pad_length, dtype='float', padding='post',
-                                truncating='post')
-    mfcc_padded = mfcc_padded.T
+    mfcc_frames = extract_features(frames, sr, 'mfcc', frame_length, hop_length, mfcc_features, n_mels)
+    x_length = mfcc_frames.shape[0]
+    mfcc_padded = pad_features(mfcc_frames, max_pad_length)
 
     return mfcc_padded, x_length
 
@@ -83,15 +321,27 @@ def extract_mel_spectrogram_and_pad(frames, sr, max_pad_length, frame_length, ho
     :return: spectrogram_padded: padded melspectrogram-sequence
              x_length: unpadded length melspectrogram-sequence
     """
-    spectrogram = melspectrogram(frames, sr, n_fft=frame_length, hop_length=hop_length, n_mels=n_mels)
-    x_length = spectrogram.shape[1]
-    spectrogram_padded = pad_sequences(spectrogram, maxlen=max_pad_length, dtype='float', padding='post',
-                                       truncating='post')
-    spectrogram_padded = spectrogram_padded.T
+    spectrogram = extract_features(frames, sr, 'spectrogram', frame_length, hop_length, None, n_mels)
+    x_length = spectrogram.shape[0]
+    spectrogram_padded = pad_features(spectrogram, max_pad_length)
 
     return spectrogram_padded, x_length
 
 
+def pad_features(features, max_pad_length):
+    """
+    Zero-pads (or truncates) a feature-sequence to max_pad_length frames
+    :param features: np.ndarray[shape=(n_frames, n_features)]
+    :param max_pad_length: length (no. of frames) to pad to
+    :return: features_padded: np.ndarray[shape=(max_pad_length, n_features), dtype=float32]
+    """
+    features_padded = np.zeros([max_pad_length, features.shape[1]], dtype=np.float32)
+    length = min(features.shape[0], max_pad_length)
+    features_padded[:length] = features[:length]
+
+    return features_padded
+
+
 def convert_and_pad_transcripts(y_data_raw):
     """
     Converts and pads transcripts from text to int sequences
@@ -99,23 +349,131 @@ def convert_and_pad_transcripts(y_data_raw):
     :return: y_data: numpy array with transcripts converted to a sequence of ints and zero-padded
              label_length: numpy array with length of each sequence before padding
     """
-    # Finds longest sequence in y for padding
-    max_y_length = len(max(y_data_raw, key=len))
+    labels, offsets = encode_transcripts(y_data_raw)
+
+    return gather_and_pad_labels(labels, offsets, np.arange(len(y_data_raw)))
+
+
+class StreamingFeatureExtractor(object):
+    """
+    Extracts MFCC or mel spectrogram features of audio arriving in chunks, e.g. live or piped audio
+
+    Each call to accept() takes a chunk of any number of samples and returns the frames completed by it. Only
+    the samples of the frames not yet complete (less than frame_length plus the chunk) are kept between calls,
+    so the work per chunk only depends on the number of new samples. Frames are centered like librosa: the
+    start of the stream is reflect-padded once frame_length // 2 + 1 samples have arrived, and the end is
+    reflect-padded by flush().
+
+    The frames are the same as extract_mel_spectrogram_and_pad (feature_type='spectrogram') or
+    extract_mfcc_and_pad (feature_type='mfcc') give for the whole stream, computed like extract_features_batch.
+
+    Args:
+        sr (int): sampling rate of the audio
+        feature_type (string, default='mfcc'): mfcc or spectrogram
+        frame_length (int, default=320): length of the frames to be extracted
+        hop_length (int, default=160): length of hops (for overlap)
+        mfcc_features (int, default=26): number of mfcc features to extract
+        n_mels (int, default=40): number of mels
+        max_db (float, default=None): maximum log mel power (dB) of the stream, if known. MFCC are computed from
+            the log mel power clipped to 80 dB below the maximum of the whole audio time series (as in
+            librosa.power_to_db), which is not known before the stream ends. By default the maximum of the
+            frames so far is used, frames before the loudest frame of the stream may then differ where the
+            log mel power is more than 80 dB below it
+
+    Note:
+        After flush() the extractor starts a new stream.
+
+    """
+
+    def __init__(self, sr, feature_type='mfcc', frame_length=320, hop_length=160, mfcc_features=26, n_mels=40,
+                 max_db=None):
+        if feature_type not in ('mfcc', 'spectrogram'):
+            raise ValueError('Not a valid feature type: ', feature_type)
+
+        self.sr = sr
+        self.feature_type = feature_type
+        self.frame_length = frame_length
+        self.hop_length = hop_length
+        self.n_features = mfcc_features if feature_type == 'mfcc' else n_mels
+        self.max_db = max_db
+        self.padding = frame_length // 2
+        self.window, self.mel_basis, self.dct_basis = _get_basis(sr, frame_length, n_mels, mfcc_features)
+        self.reset()
+
+    def reset(self):
+        """Starts a new stream, samples not yet in a frame are discarded"""
+        self.n_frames = 0
+        self.running_max_db = -np.inf
+
+        # Samples from the start of the first frame not yet returned (of the reflect-padded stream)
+        self._buffer = None
+        # Samples of the stream before its start can be padded, and the last samples for padding its end
+        self._head = np.zeros(0, dtype=np.float32)
+        self._tail = np.zeros(0, dtype=np.float32)
+
+    def accept(self, samples):
+        """
+        Adds a chunk of samples to the stream
+
+        :param samples: audio time series of any length, float or 16 bit PCM (int16)
+        :return: features: np.ndarray[shape=(n_new_frames, n_features), dtype=float32]: the frames completed
+        """
+        samples = as_float_audio(np.asarray(samples)).astype(np.float32)
+        self._tail = np.concatenate([self._tail, samples])[-(self.padding + 1):]
+
+        if self._buffer is None:
+            self._head = np.concatenate([self._head, samples])
+            if len(self._head) <= self.padding:
+                return np.zeros([0, self.n_features], dtype=np.float32)
+
+            # Reflect-padded start, as np.pad(mode='reflect')
+            self._buffer = np.concatenate([self._head[self.padding:0:-1], self._head])
+            self._head = np.zeros(0, dtype=np.float32)
+        else:
+            self._buffer = np.concatenate([self._buffer, samples])
+
+        return self._extract_frames()
+
+    def flush(self):
+        """
+        Ends the stream
+
+        :return: features: np.ndarray[shape=(n_new_frames, n_features), dtype=float32]: the last frames,
+                 with the end of the stream reflect-padded
+        """
+        if self._buffer is None:
+            # Streams too short to pad their start separately
+            if len(self._head) == 0:
+                return np.zeros([0, self.n_features], dtype=np.float32)
+            self._buffer = np.pad(self._head, self.padding, mode='reflect')
+        else:
+            self._buffer = np.concatenate([self._buffer, self._tail[-2::-1][:self.padding]])
 
-    y_data = np.empty([0, max_y_length])
-    len_y_seq = []
+        features = self._extract_frames()
+        self.reset()
+        return features
 
-    # Converts to int and pads to be equal max_y_length
-    for i in range(0, len(y_data_raw)):
-        y_int = text_to_int_sequence(y_data_raw[i])
-        len_y_seq.append(len(y_int))
+    def _extract_frames(self):
+        """Features of the complete frames in the buffer, which are removed from it"""
+        n_frames = max(0, 1 + (len(self._buffer) - self.frame_length) // self.hop_length)
+        if n_frames == 0:
+            return np.zeros([0, self.n_features], dtype=np.float32)
 
-        for j in range(len(y_int), max_y_length):
-            y_int.append(0)
+        # (frames, frame_length) view of the buffer, no copy
+        itemsize = self._buffer.itemsize
+        windows = as_strided(self._buffer, shape=(n_frames, self.frame_length),
+                             strides=(self.hop_length * itemsize, itemsize))
+        spectrogram = np.dot(_power_spectrum(windows * self.window), self.mel_basis)
 
-        y_data = np.insert(y_data, i, y_int, axis=0)
+        self._buffer = self._buffer[n_frames * self.hop_length:].copy()
+        self.n_frames += n_frames
 
-    # Convert transcript length list to numpy array
-    label_length = np.array(len_y_seq)
+        if self.feature_type == 'spectrogram':
+            return spectrogram
 
-    return y_data, label_length
+        # Log power (dB), clipped to 80 dB below the maximum as in librosa.power_to_db
+        log_spec = 10.0 * np.log10(np.maximum(spectrogram, 1e-10))
+        self.running_max_db = max(self.running_max_db, log_spec.max())
+        max_db = self.max_db if self.max_db is not None else self.running_max_db
+        np.maximum(log_spec, np.float32(max_db - 80.0), out=log_spec)
+        return np.dot(log_spec, self.dct_basis)
@@ -0,0 +1,156 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import json
+import os
+
+import h5py
+import keras.backend as K
+import tensorflow as tf
+from keras.models import Model, load_model, model_from_json
+from tensorflow.python.framework import graph_util
+
+from models import clipped_relu
+
+# Name of the output of frozen graphs
+OUTPUT_NAME = 'y_pred'
+
+
+def inference_model(model):
+    """
+    Model from the input features to the softmax predictions of a training model, without the CTC loss
+
+    :param model: Keras Model with the CTC loss as output (see models.py)
+    :return: Keras Model with the_input as input and the input of the CTC layer as output
+    """
+    return Model(model.get_layer('the_input').input, model.get_layer('ctc').input[0])
+
+
+def export_inference_model(model, path):
+    """
+    Saves the inference part of a model, without the CTC loss, label inputs and optimizer state
+
+    A path ending with .pb saves a frozen TensorFlow graph, with the weights as constants and dropout removed.
+    Any other path saves a Keras HDF5 file with the architecture and weights of the inference model.
+
+    :param model: Keras Model, with the CTC loss as output (see models.py) or already an inference model
+    :param path: path of the exported file
+    """
+    if 'ctc' in [layer.name for layer in model.layers]:
+        model = inference_model(model)
+
+    if path.endswith('.pb'):
+        graph_def = _freeze(model.to_json(), model.get_weights())
+        directory, filename = os.path.split(path)
+        tf.train.write_graph(graph_def, directory or '.', filename, as_text=False)
+    else:
+        model.save(path, include_optimizer=False)
+
+
+def load_inference_model(path, load_multi=False):
+    """
+    Loads a model for prediction only. Exported inference models (see export_inference_model) build only the
+    graph from features to predictions, training models are loaded without compiling them.
+
+    :param path: path of a frozen graph (.pb), an exported inference model or a model saved during training
+    :param load_multi: whether the model is a parallel model saved while training on multiple GPUs
+    :return: test_func: function taking [features] and returning [predictions], like K.function
+    :return: input_dim: number of features per frame
+    """
+    if path.endswith('.pb'):
+        return _load_frozen(path)
+
+    model = load_model(path, custom_objects={'clipped_relu': clipped_relu,
+                                             '<lambda>': lambda y_true, y_pred: y_pred},
+                       compile=False)
+    if load_multi:
+        model = model.layers[-2]
+    if 'ctc' in [layer.name for layer in model.layers]:
+        model = inference_model(model)
+
+    test_func = K.function([model.input], [model.output])
+    return test_func, model.input_shape[2]
+
+
+def inference_input_dim(path):
+    """
+    Number of features per frame of a saved model (see load_inference_model), read from the file without
+    building the model, so no TensorFlow session is created, e.g. to start worker processes before the model is
+    loaded (see worker_utils.start_workers).
+
+    :param path: path of a frozen graph (.pb), an exported inference model or a model saved during training
+    :return: input_dim: number of features per frame
+    """
+    if path.endswith('.pb'):
+        graph_def = tf.GraphDef()
+        with open(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        for node in graph_def.node:
+            if node.name == 'the_input':
+                return node.attr['shape'].shape.dim[2].size
+    else:
+        with h5py.File(path, 'r') as f:
+            config = json.loads(f.attrs['model_config'].decode('utf-8'))
+        input_dim = _find_input_dim(config)
+        if input_dim is not None:
+            return input_dim
+
+    raise ValueError('Not a valid model, no the_input layer: ', path)
+
+
+def _find_input_dim(config):
+    """Number of features of the_input layer in a (nested) Keras model config, or None if not found"""
+    if isinstance(config, dict):
+        if config.get('name') == 'the_input' and 'batch_input_shape' in config:
+            return config['batch_input_shape'][2]
+        config = list(config.values())
+    if isinstance(config, list):
+        for item in config:
+            input_dim = _find_input_dim(item)
+            if input_dim is not None:
+                return input_dim
+    return None
+
+
+def _freeze(architecture, weights):
+    """Builds the model in a new graph in test mode, and converts its weights to constants"""
+    graph = tf.Graph()
+    with graph.as_default(), tf.Session(graph=graph).as_default() as session:
+        K.set_learning_phase(0)
+        model = model_from_json(architecture, custom_objects={'clipped_relu': clipped_relu})
+        model.set_weights(weights)
+
+        # Named output, the input is the_input placeholder
+        tf.identity(model.output, name=OUTPUT_NAME)
+
+        return graph_util.convert_variables_to_constants(session, graph.as_graph_def(), [OUTPUT_NAME])
+
+
+def _load_frozen(path):
+    graph_def = tf.GraphDef()
+    with open(path, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+    session = tf.Session(graph=graph)
+
+    input_data = graph.get_tensor_by_name('the_input:0')
+    y_pred = graph.get_tensor_by_name(OUTPUT_NAME + ':0')
+
+    def test_func(inputs):
+        return [session.run(y_pred, feed_dict={input_data: inputs[0]})]
+
+    return test_func, input_data.get_shape().as_list()[2]
@@ -0,0 +1,311 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from char_map import index_map
+
+UNK = '<unk>'
+SENTENCE_START = '<s>'
+SENTENCE_END = '</s>'
+
+
+class NgramLanguageModel(object):
+    """
+    Word n-gram language model with absolute discounting and backoff, stored in sorted arrays
+
+    The n-grams of each order are stored as a sorted array of keys (the word ids packed into one int64),
+    with a log probability and a backoff weight for each n-gram. An n-gram not in the model backs off to the
+    shorter history: log P(w | h) = backoff(h) + log P(w | h without its first word). The backoff weight of a
+    history normalizes the probabilities following it to sum to one.
+    Words not in the vocabulary are mapped to <unk>, which gets the probability mass discounted from the unigrams.
+    All probabilities are natural logarithms.
+
+    Args:
+        vocab (list): words of the model, index is the word id. The first three are <unk>, <s> and </s>
+        keys (list): for each order, np.ndarray[dtype=int64] with the sorted packed word ids of the n-grams
+        log_probs (list): for each order, np.ndarray[dtype=float32] with the log probability of the n-grams
+        backoffs (list): for each order, np.ndarray[dtype=float32] with the backoff weight of the n-grams
+        cache_size (int, default=100000): number of most recently used lookups kept in the cache
+
+    Note:
+        Build a model from transcripts with NgramLanguageModel.build, save and load it with save and load.
+        Lookups are cached in a least recently used cache of cache_size entries, so the memory used stays
+        bounded when a model is used for a long time, e.g. by serve.py.
+
+    """
+
+    def __init__(self, vocab, keys, log_probs, backoffs, cache_size=100000):
+        self.vocab = list(vocab)
+        self.word_ids = dict((word, i) for i, word in enumerate(self.vocab))
+        self.order = len(keys)
+        self.keys = keys
+        self.log_probs = log_probs
+        self.backoffs = backoffs
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    @classmethod
+    def build(cls, transcripts, order=3):
+        """
+        Counts the n-grams of the transcripts and estimates their probabilities
+
+        :param transcripts: list of transcripts, words separated by spaces
+        :param order: longest n-gram
+        :return: NgramLanguageModel
+        """
+        # Word ids of all sentences after each other, each sentence between <s> and </s>
+        tokens = []
+        for t in transcripts:
+            tokens.append(SENTENCE_START)
+            tokens.extend(t.split())
+            tokens.append(SENTENCE_END)
+
+        codes, words = pd.factorize(pd.Series(tokens), sort=True)
+        specials = [UNK, SENTENCE_START, SENTENCE_END]
+        vocab = specials + [w for w in words if w not in specials]
+        vocab_ids = dict((w, i) for i, w in enumerate(vocab))
+        ids = np.array([vocab_ids[w] for w in words], dtype=np.int64)[codes]
+        _check_packing(len(vocab), order)
+
+        starts = ids == vocab_ids[SENTENCE_START]
+        keys, log_probs, backoffs = [], [], []
+
+        for n in range(1, order + 1):
+            # n-grams within sentences: only the first word of an n-gram may be <s>
+            ngrams = np.stack([ids[i:len(ids) - n + 1 + i] for i in range(n)], axis=1)
+            within = np.ones(len(ngrams), dtype=bool)
+            for i in range(1 if n > 1 else 0, n):
+                within &= ~starts[i:len(ids) - n + 1 + i]
+
+            n_keys, counts = np.unique(_pack(ngrams[within], len(vocab)), return_counts=True)
+            discount = _discount(counts)
+
+            if n == 1:
+                # <unk> gets the discounted mass of the unigrams. <s> is never predicted,
+                # it is only kept for its backoff weight
+                total = float(counts.sum())
+                n_keys = np.concatenate([[vocab_ids[UNK], vocab_ids[SENTENCE_START]], n_keys])
+                n_log_probs = np.concatenate([[np.log(discount * len(counts) / total), -99.0],
+                                              np.log((counts - discount) / total)])
+            else:
+                # Count of each history, and number of distinct words following it
+                history = n_keys // len(vocab)
+                history_keys, first, n_follow = np.unique(history, return_index=True, return_counts=True)
+                history_counts = np.add.reduceat(counts, first).astype(np.float64)
+                n_log_probs = np.log((counts - discount) / history_counts[np.searchsorted(history_keys, history)])
+
+                # Backoff weight of the histories: the discounted mass, divided by the mass the shorter history
+                # gives to the words not seen after the history, so the probabilities after it sum to one
+                lower = _backoff_log_probs(_unpack(n_keys, len(vocab), n)[:, 1:], len(vocab), keys, log_probs, backoffs)
+                unseen_mass = np.maximum(1.0 - np.add.reduceat(np.exp(lower), first), 1e-10)
+                backoffs[-1][np.searchsorted(keys[-1], history_keys)] = np.log(discount * n_follow / history_counts /
+                                                                              unseen_mass)
+
+            keys.append(n_keys)
+            log_probs.append(n_log_probs.astype(np.float32))
+            backoffs.append(np.zeros(len(n_keys), dtype=np.float32))
+
+        return cls(vocab, keys, log_probs, backoffs)
+
+    @classmethod
+    def load(cls, path, cache_size=100000):
+        """
+        Loads a model saved with save
+
+        :param path: path to .npz file
+        :param cache_size: number of most recently used lookups kept in the cache
+        :return: NgramLanguageModel
+        """
+        with np.load(path) as arrays:
+            vocab = arrays['vocab'].tobytes().decode('utf-8').split(u'\n')
+            order = int(arrays['order'])
+            keys = [arrays['keys_%d' % n] for n in range(1, order + 1)]
+            log_probs = [arrays['log_probs_%d' % n] for n in range(1, order + 1)]
+            backoffs = [arrays['backoffs_%d' % n] for n in range(1, order + 1)]
+
+        return cls(vocab, keys, log_probs, backoffs, cache_size=cache_size)
+
+    def save(self, path):
+        """
+        Saves the model to a .npz file
+
+        :param path: path to .npz file
+        """
+        arrays = {'vocab': np.frombuffer(u'\n'.join(self.vocab).encode('utf-8'), dtype=np.uint8),
+                  'order': np.array(self.order)}
+        for n in range(1, self.order + 1):
+            arrays['keys_%d' % n] = self.keys[n - 1]
+            arrays['log_probs_%d' % n] = self.log_probs[n - 1]
+            arrays['backoffs_%d' % n] = self.backoffs[n - 1]
+
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    def word_id(self, word):
+        """Id of word in the vocabulary, the id of <unk> if not in the vocabulary"""
+        return self.word_ids.get(word, 0)
+
+    def log_prob(self, history, word_id):
+        """
+        Log probability of a word following history
+
+        :param history: tuple of word ids of the preceding words, only the last order - 1 are used
+        :param word_id: id of the word
+        :return: natural log probability
+        """
+        history = history[len(history) - self.order + 1:] if self.order > 1 else ()
+        key = (history, word_id)
+        # Moves the lookup to the end of the cache, the least recently used lookups are at the start
+        log_prob = self._cache.pop(key, None)
+        if log_prob is None:
+            log_prob = self._log_prob(history, word_id)
+            while len(self._cache) >= self.cache_size > 0:
+                self._cache.popitem(last=False)
+        if self.cache_size > 0:
+            self._cache[key] = log_prob
+        return log_prob
+
+    def _log_prob(self, history, word_id):
+        backoff = 0.0
+        for start in range(len(history) + 1):
+            ngram = history[start:] + (word_id,)
+            i = self._find(ngram)
+            if i is not None:
+                return backoff + float(self.log_probs[len(ngram) - 1][i])
+
+            # Back off to the shorter history
+            i = self._find(history[start:])
+            if i is not None:
+                backoff += float(self.backoffs[len(history) - start - 1][i])
+
+        # Only reached for a word id outside the vocabulary
+        return backoff + float(self.log_probs[0][0])
+
+    def _find(self, ngram):
+        """Index of ngram in the sorted keys of its order, or None if not in the model"""
+        if not ngram:
+            return None
+        keys = self.keys[len(ngram) - 1]
+        key = 0
+        for word_id in ngram:
+            key = key * len(self.vocab) + word_id
+        i = np.searchsorted(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return i
+        return None
+
+
+class LanguageModelScorer(object):
+    """
+    Shallow fusion of an NgramLanguageModel into the CTC prefix beam search (see utils.beam_search)
+
+    When a space follows a word in a prefix, the prefix gets lm_weight * log P(word | previous words)
+    and a word_bonus. At the end of the sequence the last word and the end of the sentence are scored.
+    The state of a prefix is the ids of the previous words and the characters of the current word.
+
+    Args:
+        lm (NgramLanguageModel): language model
+        lm_weight (float, default=0.5): weight of the language model log probabilities
+        word_bonus (float, default=1.0): score added for each word, counters the language model's
+            preference for fewer words
+
+    """
+
+    def __init__(self, lm, lm_weight=0.5, word_bonus=1.0):
+        self.lm = lm
+        self.lm_weight = lm_weight
+        self.word_bonus = word_bonus
+        self.history_length = max(lm.order - 1, 0)
+
+    def initial_state(self):
+        # History of the first word of a sentence
+        history = (self.lm.word_id(SENTENCE_START),)[:self.history_length]
+        return history, ''
+
+    def extend(self, state, c):
+        history, word = state
+        if index_map[c] != ' ':
+            return (history, word + index_map[c]), 0.0
+        if not word:
+            # No word ended, e.g. two spaces after each other
+            return state, 0.0
+        return self._end_word(history, word)
+
+    def finish(self, state):
+        history, word = state
+        score = 0.0
+        if word:
+            (history, _), score = self._end_word(history, word)
+        return score + self.lm_weight * self.lm.log_prob(history, self.lm.word_id(SENTENCE_END))
+
+    def _end_word(self, history, word):
+        word_id = self.lm.word_id(word)
+        score = self.lm_weight * self.lm.log_prob(history, word_id) + self.word_bonus
+        history = (history + (word_id,))[len(history) + 1 - self.history_length:]
+        return (history, ''), score
+
+
+def _pack(ngrams, vocab_size):
+    """Packs the word ids of each n-gram (rows of ngrams) into one int64 key"""
+    keys = np.zeros(len(ngrams), dtype=np.int64)
+    for i in range(ngrams.shape[1]):
+        keys = keys * vocab_size + ngrams[:, i]
+    return keys
+
+
+def _unpack(keys, vocab_size, n):
+    """Word ids of the n-grams packed into keys, one n-gram per row"""
+    ngrams = np.zeros((len(keys), n), dtype=np.int64)
+    for i in range(n - 1, -1, -1):
+        keys, ngrams[:, i] = np.divmod(keys, vocab_size)
+    return ngrams
+
+
+def _backoff_log_probs(ngrams, vocab_size, keys, log_probs, backoffs):
+    """Log probabilities of the last word of the n-grams (rows of ngrams) given the words before it,
+    backing off like NgramLanguageModel.log_prob. The model of the orders up to ngrams.shape[1] must be built"""
+    n = ngrams.shape[1]
+    log_p, found = _lookup(keys[n - 1], log_probs[n - 1], _pack(ngrams, vocab_size), -99.0)
+    if n == 1 or found.all():
+        return log_p
+
+    missing = ~found
+    backoff, _ = _lookup(keys[n - 2], backoffs[n - 2], _pack(ngrams[missing, :-1], vocab_size), 0.0)
+    log_p[missing] = backoff + _backoff_log_probs(ngrams[missing, 1:], vocab_size, keys, log_probs, backoffs)
+    return log_p
+
+
+def _lookup(keys, values, query, default):
+    """Values of the query keys in the sorted keys, default for keys not found, and whether each was found"""
+    i = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+    found = keys[i] == query
+    return np.where(found, values[i], default).astype(np.float64), found
+
+
+def _check_packing(vocab_size, order):
+    if float(vocab_size) ** order >= 2 ** 63:
+        raise ValueError('Vocabulary too large to pack n-grams of this order into int64: ', (vocab_size, order))
+
+
+def _discount(counts):
+    """Absolute discount estimated from the number of n-grams seen once and twice"""
+    n1 = np.sum(counts == 1)
+    n2 = np.sum(counts == 2)
+    if n1 == 0 or n2 == 0:
+        return 0.5
+    return min(max(n1 / float(n1 + 2 * n2), 0.1), 0.9)
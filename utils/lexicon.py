@@ -0,0 +1,146 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import codecs
+
+import numpy as np
+
+from char_map import char_map
+from text_utils import encode_transcripts
+
+NEG_INF = float('-inf')
+
+# Index of space in char_map, ends a word
+SPACE = char_map['<SPACE>']
+
+
+class CharTrie(object):
+    """
+    Character trie of a vocabulary, with the characters as char_map indices
+
+    Node 0 is the root. children[node, c] is the node after character c, or -1 if no word continues with c,
+    and is_word[node] tells if the characters from the root to node are a word of the vocabulary.
+
+    Args:
+        words (list): words of the vocabulary, only characters in char_map (without space)
+
+    """
+
+    def __init__(self, words):
+        words = sorted(set(w.strip().lower() for w in words if w.strip()))
+        labels, offsets = encode_transcripts(words)
+        if (labels == SPACE).any():
+            raise ValueError('Not a valid vocabulary, words may not contain spaces')
+
+        # (node, character) -> child node
+        edges = {}
+        is_word = [False]
+        for i in range(len(words)):
+            node = 0
+            for c in labels[offsets[i]:offsets[i + 1]].tolist():
+                child = edges.get((node, c))
+                if child is None:
+                    child = len(is_word)
+                    edges[(node, c)] = child
+                    is_word.append(False)
+                node = child
+            is_word[node] = True
+
+        self.children = np.full((len(is_word), len(char_map)), -1, dtype=np.int32)
+        if edges:
+            parents, chars = zip(*edges.keys())
+            self.children[list(parents), list(chars)] = list(edges.values())
+        self.is_word = np.array(is_word, dtype=bool)
+        self.n_words = len(words)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Builds the trie of a vocabulary file
+
+        :param path: path to text file with one word per line
+        :return: CharTrie
+        """
+        with codecs.open(path, 'r', 'utf-8') as f:
+            return cls(f.read().split())
+
+    def __len__(self):
+        """Number of nodes"""
+        return len(self.is_word)
+
+    def child(self, node, c):
+        """Node after character c, or -1 if no word continues with c"""
+        return int(self.children[node, c])
+
+    def next_chars(self, node):
+        """Characters that continue a word after node, with space if node is a word"""
+        chars = np.flatnonzero(self.children[node] >= 0).tolist()
+        if self.is_word[node]:
+            chars.append(SPACE)
+        return frozenset(chars)
+
+
+class LexiconScorer(object):
+    """
+    Restricts the CTC prefix beam search (see utils.beam_search) to words of a vocabulary
+
+    A prefix is only extended with a character if the current word stays on a path of the trie, and with a space
+    only after a complete word. Sequences ending in an incomplete word get a score of -inf. The beam search only
+    tries the characters allowed after the current word (see allowed), the others are skipped before extending.
+    Another scorer, e.g. a LanguageModelScorer, can be combined with the lexicon.
+
+    Args:
+        trie (CharTrie): trie of the vocabulary
+        scorer (default=None): optional scorer applied to the prefixes allowed by the lexicon
+
+    """
+
+    def __init__(self, trie, scorer=None):
+        self.trie = trie
+        self.scorer = scorer
+
+    def initial_state(self):
+        return 0, self.scorer.initial_state() if self.scorer is not None else None
+
+    def extend(self, state, c):
+        node, scorer_state = state
+        if c == SPACE:
+            if not self.trie.is_word[node]:
+                return None
+            next_node = 0
+        else:
+            next_node = self.trie.child(node, c)
+            if next_node < 0:
+                return None
+
+        if self.scorer is None:
+            return (next_node, None), 0.0
+
+        extended = self.scorer.extend(scorer_state, c)
+        if extended is None:
+            return None
+        return (next_node, extended[0]), extended[1]
+
+    def allowed(self, state):
+        node, scorer_state = state
+        chars = self.trie.next_chars(node)
+        if self.scorer is not None and hasattr(self.scorer, 'allowed'):
+            return chars & self.scorer.allowed(scorer_state)
+        return chars
+
+    def finish(self, state):
+        node, scorer_state = state
+        if node != 0 and not self.trie.is_word[node]:
+            return NEG_INF
+        return self.scorer.finish(scorer_state) if self.scorer is not None else 0.0
@@ -0,0 +1,145 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import fcntl
+import os
+
+import numpy as np
+
+
+class MemmapStore(object):
+    """
+    Persistent on-disk store of one array per audio file, in a single memory-mapped arena file
+
+    The arrays are appended to the arena file, with an append-only index file mapping (path, mtime) to
+    (offset, number of rows, extra fields) in the arena. Arrays read from the store are views into the memory
+    map, no copy is made. A changed mtime of an audio file makes the old entry a miss.
+    Base class of FeatureStore and AudioStore, which define what is stored.
+
+    Args:
+        store_dir (str): directory of the store
+        data_filename (str): name of the arena file in store_dir
+        dtype (np.dtype): type of the stored values
+        row_shape (tuple, default=()): shape of each row of the arrays, () for one value per row
+        n_extra (int, default=0): number of integer fields stored with each array, e.g. a sampling rate
+
+    Note:
+        Appends are guarded by a file lock on the index, so several processes may fill the same store.
+
+    """
+
+    def __init__(self, store_dir, data_filename, dtype, row_shape=(), n_extra=0):
+        self.store_dir = store_dir
+        if not os.path.exists(self.store_dir):
+            os.makedirs(self.store_dir)
+
+        self.data_path = os.path.join(self.store_dir, data_filename)
+        self.index_path = os.path.join(self.store_dir, 'index.csv')
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.row_size = int(np.prod(self.row_shape))
+        self.n_extra = n_extra
+
+        # (path, mtime) -> (offset, n_rows, extra fields...), offset in number of values
+        self.index = {}
+        self._index_pos = 0
+        self._data = None
+        self._read_index()
+
+    def __getstate__(self):
+        # Memory maps are reopened lazily in the receiving process
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, path):
+        return self._key(path) in self.index
+
+    def get_entry(self, path):
+        """
+        Reads the array of one audio file from the store
+
+        :param path: path to audio file
+        :return: np.ndarray[shape=(n_rows,) + row_shape] view into the arena and tuple of extra fields,
+                 or None if not in store
+        """
+        key = self._key(path)
+        if key not in self.index:
+            # Entries may have been added by another process since the index was read
+            self._read_index()
+            if key not in self.index:
+                return None
+
+        entry = self.index[key]
+        offset, n_rows = entry[:2]
+        end = offset + n_rows * self.row_size
+
+        if self._data is None or self._data.shape[0] < end:
+            self._data = np.memmap(self.data_path, dtype=self.dtype, mode='r')
+
+        return self._data[offset:end].reshape((n_rows,) + self.row_shape), entry[2:]
+
+    def append(self, path, array, extra=()):
+        """
+        Appends the array of one audio file to the store
+
+        :param path: path to audio file
+        :param array: np.ndarray[shape=(n_rows,) + row_shape, dtype=dtype]
+        :param extra: tuple of n_extra integer fields
+        """
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        extra = tuple(int(field) for field in extra)
+        if array.shape[1:] != self.row_shape or len(extra) != self.n_extra:
+            raise ValueError('Not a valid entry of shape and extra fields: ', (array.shape, extra))
+
+        path_key, mtime = self._key(path)
+
+        with open(self.index_path, 'a') as index_file:
+            fcntl.flock(index_file, fcntl.LOCK_EX)
+            try:
+                with open(self.data_path, 'ab') as data_file:
+                    data_file.seek(0, os.SEEK_END)
+                    offset = data_file.tell() // self.dtype.itemsize
+                    array.tofile(data_file)
+
+                fields = (offset, array.shape[0]) + extra
+                index_file.write('%s,%r,%s\n' % (','.join('%d' % f for f in fields), mtime, path_key))
+                index_file.flush()
+            finally:
+                fcntl.flock(index_file, fcntl.LOCK_UN)
+
+        self.index[(path_key, mtime)] = (offset, array.shape[0]) + extra
+
+    def _key(self, path):
+        path = os.path.abspath(path)
+        return path, os.path.getmtime(path)
+
+    def _read_index(self):
+        """Reads entries appended to the index file since the last read"""
+        if not os.path.isfile(self.index_path):
+            return
+
+        n_fields = 2 + self.n_extra
+        with open(self.index_path, 'r') as index_file:
+            index_file.seek(self._index_pos)
+            for line in index_file:
+                if not line.endswith('\n'):
+                    # Entry is still being written
+                    break
+                fields = line.rstrip('\n').split(',', n_fields + 1)
+                self.index[(fields[-1], float(fields[-2]))] = tuple(int(f) for f in fields[:n_fields])
+                self._index_pos += len(line)
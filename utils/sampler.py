@@ -0,0 +1,185 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import numpy as np
+
+
+class BucketSampler(object):
+    """
+    Groups audio files of similar length into batches, to minimise padding
+
+    The audio files are sorted by length and split into buckets of bucket_size batches.
+    Each epoch the files are shuffled within their bucket before they are split into batches,
+    and the order of the batches is shuffled.
+
+    Args:
+        lengths (np.ndarray): length of each audio file (e.g. number of frames or filesize)
+        batch_size (int): number of audio files in each batch
+        bucket_size (int, default=16): number of batches in each bucket
+        seed (int, default=0): seed for shuffling, epoch n is shuffled with seed + n
+
+    Attributes:
+        padding_ratios (list): share of padding in the batches of each epoch so far, see padding_ratio()
+
+    Note:
+        As with consecutive batches, the files that do not fill a whole batch are left out of the epoch.
+        A different random selection of files is left out each epoch.
+
+    """
+
+    def __init__(self, lengths, batch_size, bucket_size=16, seed=0):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size
+        self.seed = seed
+        self.epoch = 0
+        self.padding_ratios = []
+        self.batches = self.make_batches()
+
+    def __len__(self):
+        """Number of batches per epoch"""
+        return len(self.batches)
+
+    def make_batches(self):
+        """
+        Splits the audio files into batches for the current epoch
+
+        :return: list of np.ndarrays with indexes of the audio files in each batch
+        """
+        rng = np.random.RandomState(self.seed + self.epoch)
+        n_batches = len(self.lengths) // self.batch_size
+
+        # Random selection of files filling n_batches, sorted by length with ties in random order
+        keep = rng.permutation(len(self.lengths))[:n_batches * self.batch_size]
+        order = keep[np.argsort(self.lengths[keep], kind='mergesort')]
+
+        # Shuffle within buckets
+        bucket = self.batch_size * self.bucket_size
+        for start in range(0, len(order), bucket):
+            rng.shuffle(order[start:start + bucket])
+
+        batches = order.reshape(n_batches, self.batch_size)
+        rng.shuffle(batches)
+
+        self.padding_ratios.append(padding_ratio(self.lengths, batches))
+        return list(batches)
+
+    def on_epoch_end(self):
+        """Makes new batches for the next epoch"""
+        self.epoch += 1
+        self.batches = self.make_batches()
+
+
+class FrameBudgetSampler(object):
+    """
+    Packs audio files into batches of varying size, each up to a budget of padded frames
+
+    The audio files are sorted by length and packed greedily, so that the number of files in a batch
+    times the longest file in the batch is at most max_frames_per_batch. Batches of short files
+    hold many files and batches of long files few. Each epoch files of equal length are shuffled
+    and the order of the batches is shuffled, the number of batches stays the same.
+
+    Args:
+        lengths (np.ndarray): number of frames of each audio file
+        max_frames_per_batch (int): budget of padded frames in each batch
+        seed (int, default=0): seed for shuffling, epoch n is shuffled with seed + n
+
+    Attributes:
+        padding_ratios (list): share of padding in the batches of each epoch so far, see padding_ratio()
+
+    Note:
+        The CTC loss in Keras does not support batches of one file, so each batch holds at least two files,
+        even if two files exceed max_frames_per_batch. Only if an odd number of files fits in pairs only,
+        one batch holds three files over the budget.
+
+    """
+
+    def __init__(self, lengths, max_frames_per_batch, seed=0):
+        self.lengths = np.asarray(lengths)
+        self.max_frames_per_batch = max_frames_per_batch
+        self.seed = seed
+        self.epoch = 0
+        self.padding_ratios = []
+        self.batches = self.make_batches()
+
+    def __len__(self):
+        """Number of batches per epoch"""
+        return len(self.batches)
+
+    def make_batches(self):
+        """
+        Packs the audio files into batches for the current epoch
+
+        :return: list of np.ndarrays with indexes of the audio files in each batch
+        """
+        rng = np.random.RandomState(self.seed + self.epoch)
+
+        # Sorted by length with ties in random order
+        order = rng.permutation(len(self.lengths))
+        order = order[np.argsort(self.lengths[order], kind='mergesort')]
+        sorted_lengths = self.lengths[order]
+
+        batches = []
+        start = 0
+        while start < len(order):
+            end = start + 1
+            # Sorted ascending, so the file at end is the longest if it is added
+            while end < len(order) and (end - start < 2 or
+                                        (end + 1 - start) * sorted_lengths[end] <= self.max_frames_per_batch):
+                end += 1
+            batches.append(order[start:end])
+            start = end
+
+        # The last file on its own gets the longest file of the batch before it, which in turn gets a file of
+        # the batch before it if only one is left. The files move to batches of longer files, so a batch only
+        # goes over the budget if two of its files do
+        i = len(batches) - 1
+        while i > 0 and len(batches[i]) == 1:
+            batches[i - 1], batches[i] = batches[i - 1][:-1], np.concatenate([batches[i - 1][-1:], batches[i]])
+            i -= 1
+
+        # Only if all batches before held two files, the first file is added to the batch after it
+        if len(batches) > 1 and len(batches[0]) == 1:
+            batches[:2] = [np.concatenate(batches[:2])]
+
+        rng.shuffle(batches)
+
+        self.padding_ratios.append(padding_ratio(self.lengths, batches))
+        return batches
+
+    def on_epoch_end(self):
+        """Makes new batches for the next epoch"""
+        self.epoch += 1
+        self.batches = self.make_batches()
+
+
+def padding_ratio(lengths, batches):
+    """
+    Share of padded batches that is zero-padding
+
+    :param lengths: length of each audio file
+    :param batches: list of np.ndarrays with indexes of the audio files in each batch
+    :return: zero-padded frames / all frames in the padded batches
+    """
+    lengths = np.asarray(lengths)
+    total = 0
+    padded = 0
+    for batch in batches:
+        batch_lengths = lengths[batch]
+        total += batch_lengths.sum()
+        padded += len(batch) * batch_lengths.max()
+
+    if padded == 0:
+        return 0.0
+    return 1.0 - total / float(padded)
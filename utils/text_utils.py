@@ -1,3 +1,5 @@
+import numpy as np
+
 from char_map import char_map, index_map
 
 # The following code is adapted from: github.com/baidu-research/ba-dls-deepspeech
@@ -31,3 +33,80 @@ def int_to_text_sequence(seq):
             ch = index_map[c]
         text_sequence.append(ch)
     return text_sequence
+
+
+# Lookup tables for converting whole batches at once: byte value -> int (-1 if not in char_map) and
+# int -> byte value (blank/pad char 28 -> none)
+_BLANK = 28
+_char_to_int = np.full(256, -1, dtype=np.int8)
+_int_to_char = np.zeros(_BLANK + 1, dtype=np.uint8)
+for _ch, _index in char_map.items():
+    _ch = ' ' if _ch == '<SPACE>' else _ch
+    _char_to_int[ord(_ch)] = _index
+    _int_to_char[_index] = ord(_ch)
+
+
+def encode_transcripts(transcripts):
+    """
+    Converts all transcripts to integer sequences at once, stored as one ragged array
+
+    :param transcripts: list of transcripts
+    :return: labels: np.ndarray[dtype=int8] with the integer sequences of all transcripts after each other
+             offsets: np.ndarray[shape=(len(transcripts) + 1,)]: transcript i is labels[offsets[i]:offsets[i + 1]]
+    """
+    try:
+        encoded = [t.encode('ascii') if isinstance(t, unicode) else t for t in transcripts]
+    except UnicodeEncodeError as e:
+        raise ValueError('Not a valid transcript, only ascii characters are supported: ', e.object)
+
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in encoded], out=offsets[1:])
+
+    labels = _char_to_int[np.frombuffer(''.join(encoded), dtype=np.uint8)]
+    if (labels < 0).any():
+        i = np.searchsorted(offsets, np.flatnonzero(labels < 0)[0], side='right') - 1
+        raise ValueError('Not a valid character in transcript: ', transcripts[i])
+
+    return labels, offsets
+
+
+def gather_and_pad_labels(labels, offsets, indexes):
+    """
+    Zero-padded integer sequences of the transcripts at indexes, from a ragged array made by encode_transcripts
+
+    :param labels: integer sequences of all transcripts after each other
+    :param offsets: transcript i is labels[offsets[i]:offsets[i + 1]]
+    :param indexes: indexes of the transcripts to gather
+    :return: y_data: np.ndarray[shape=(len(indexes), max_length), dtype=float32]: zero-padded integer sequences
+             label_length: np.ndarray[shape=(len(indexes),)]: length of each sequence before padding
+    """
+    indexes = np.asarray(indexes)
+    starts = offsets[indexes]
+    label_length = offsets[indexes + 1] - starts
+
+    positions = np.arange(label_length.max() if len(indexes) else 0)
+    mask = positions < label_length[:, np.newaxis]
+
+    y_data = np.zeros(mask.shape, dtype=np.float32)
+    y_data[mask] = labels[(starts[:, np.newaxis] + positions)[mask]]
+
+    return y_data, label_length
+
+
+def int_sequences_to_text(sequences, lengths=None):
+    """
+    Converts a batch of integer sequences to text at once, the inverse of text_to_int_sequence for a whole batch
+
+    :param sequences: np.ndarray[shape=(batch, max_length)] with integer sequences
+    :param lengths: optional length of each sequence, the rest is padding
+    :return: list of strings, with the ctc/pad char (28) left out
+    """
+    sequences = np.asarray(sequences).astype(np.int64)
+    if lengths is None:
+        mask = np.ones(sequences.shape, dtype=bool)
+    else:
+        mask = np.arange(sequences.shape[1]) < np.asarray(lengths)[:, np.newaxis]
+    mask &= sequences != _BLANK
+
+    chars = _int_to_char[np.where(mask, sequences, 0)]
+    return [row[row_mask].tostring() for row, row_mask in zip(chars, mask)]
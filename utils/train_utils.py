@@ -12,85 +12,204 @@ If not, see http://www.gnu.org/licenses/.
 
 """
 
-from itertools import groupby
+from functools import partial
 
+import keras.backend as K
 import numpy as np
 
-from text_utils import int_to_text_sequence
+from beam_search import beam_decode
+from language_model import NgramLanguageModel, LanguageModelScorer
+from lexicon import CharTrie, LexiconScorer
+from text_utils import int_sequences_to_text
 from wer_utils import wers
 
+# Index of the CTC blank in the network output
+BLANK = 28
 
-def predict_on_batch(data_gen, test_func, batch_index):
+
+def predict_on_batch(data_gen, test_func, batch_index, decoder=None):
     """
     Produce a sample of predictions at given batch index from data in data_gen
 
     :param data_gen: DataGenerator to produce input data
     :param test_func: Keras function that takes preprocessed audio input and outputs network predictions
     :param batch_index: which batch to use as input data
+    :param decoder: function decoding network output, see max_decode
     :return: List containing original transcripts and predictions
     """
     input_data, _ = data_gen.__getitem__(batch_index)
 
     x_data = input_data.get("the_input")
     y_data = input_data.get("the_labels")
+    originals = int_sequences_to_text(y_data, input_data.get("label_length"))
 
-    res = max_decode(test_func, x_data)
+    decoded, decoded_length = max_decode(test_func, x_data, input_data.get("input_length"), decoder)
+    predicted = int_sequences_to_text(decoded, decoded_length)
     predictions = []
 
     for i in range(y_data.shape[0]):
-        original = "".join(int_to_text_sequence(y_data[i]))
-        predicted = "".join(int_to_text_sequence(res[i]))
-        predictions.append([original,predicted])
+        predictions.append([originals[i], predicted[i]])
 
     return predictions
 
 
-def calc_wer(test_func, data_gen):
+def calc_wer(test_func, data_gen, decoder=None):
     """
     Calculate WER on all data from data_gen
 
     :param test_func: Keras function that takes preprocessed audio input and outputs network predictions
     :param data_gen: DataGenerator to produce input data
-    :return: array containing [list of WERs from each batch, average WER for all batches]
+    :param decoder: function decoding network output, see max_decode
+    :return: array containing [list of WERs of each audio file, average WER of all files]
     """
     out_true = []
     out_pred = []
-    for batch in xrange(0, data_gen.__len__(), data_gen.batch_size):
+    for batch in xrange(data_gen.__len__()):
         input_data, _ = data_gen.__getitem__(batch)
         x_data = input_data.get("the_input")
         y_data = input_data.get("the_labels")
 
-        for i in y_data:
-            out_true.append("".join(int_to_text_sequence(i)))
+        out_true.extend(int_sequences_to_text(y_data, input_data.get("label_length")))
 
-        decoded = max_decode(test_func, x_data)
-        for i in decoded:
-            out_pred.append("".join(int_to_text_sequence(i)))
+        decoded, decoded_length = max_decode(test_func, x_data, input_data.get("input_length"), decoder)
+        out_pred.extend(int_sequences_to_text(decoded, decoded_length))
 
     out = wers(out_true, out_pred)
 
     return out
 
 
-def max_decode(test_func, x_data):
+def get_eval_func(model):
+    """
+    Function giving the CTC loss and the network predictions of a batch in one forward pass
+
+    :param model: Keras Model with the CTC loss as output (see models.py)
+    :return: function taking the input dictionary of a batch (see DataGenerator.__getitem__) and returning
+             loss: np.ndarray[shape=(batch, 1)] CTC loss of each file
+             y_pred: np.ndarray[shape=(batch, frames, classes)] network predictions
+    """
+    func = K.function(model.inputs, [model.outputs[0], model.get_layer('ctc').input[0]])
+    input_names = list(model.input_names)
+
+    def eval_func(input_data):
+        # Lengths are fed with shape (batch, 1), as Keras does for 1D inputs
+        inputs = [input_data[name] for name in input_names]
+        return func([x[:, np.newaxis] if x.ndim == 1 else x for x in inputs])
+
+    return eval_func
+
+
+def calc_loss_and_wer(eval_func, batches, decoder=None):
+    """
+    Calculate the CTC loss and WER of batches, with one forward pass of the network per batch
+
+    :param eval_func: function giving the CTC loss and network predictions of a batch, see get_eval_func
+    :param batches: iterable of (inputs, outputs) batches, see DataGenerator.__getitem__
+    :param decoder: function decoding network output, see max_decode
+    :return: loss: average CTC loss of all files, as val_loss of fit_generator
+             wer: array containing [list of WERs of each audio file, average WER of all files]
+    """
+    if decoder is None:
+        decoder = greedy_decode
+
+    total_loss = 0.0
+    out_true = []
+    out_pred = []
+    for input_data, _ in batches:
+        loss, y_pred = eval_func(input_data)
+        total_loss += float(np.sum(loss))
+
+        out_true.extend(int_sequences_to_text(input_data.get("the_labels"), input_data.get("label_length")))
+
+        # The CTC discards the first two outputs of the network, input_length counts the outputs after these
+        decoded, decoded_length = decoder(y_pred[:, 2:], input_data.get("input_length"))
+        out_pred.extend(int_sequences_to_text(decoded, decoded_length))
+
+    return total_loss / len(out_true), wers(out_true, out_pred)
+
+
+def get_decoder(decoder='greedy', beam_width=16, top_k=8, blank_threshold=0.999, lm_path='', lm_weight=0.5,
+                word_bonus=1.0, lexicon_path=''):
+    """
+    Decoder of the network predictions, for max_decode
+
+    :param decoder: greedy or beam (CTC prefix beam search, see utils.beam_search)
+    :param beam_width: number of prefixes kept by the beam search after each frame
+    :param top_k: number of most probable classes of each frame searched by the beam search
+    :param blank_threshold: frames with a higher blank probability are skipped by the beam search
+    :param lm_path: optional path of a language model made with build_lm.py, used by the beam search
+    :param lm_weight: weight of the language model log probabilities
+    :param word_bonus: score added for each word with a language model
+    :param lexicon_path: optional path of a vocabulary file, the beam search only produces these words
+    :return: decoder function, None for the greedy decoder
+    """
+    if decoder == 'greedy':
+        if lm_path or lexicon_path:
+            raise ValueError('A language model or lexicon needs the beam decoder, not: ', decoder)
+        return None
+
+    if decoder != 'beam':
+        raise ValueError('Not a valid decoder: ', decoder)
+
+    # Shallow fusion with a word n-gram language model
+    scorer = None
+    if lm_path:
+        scorer = LanguageModelScorer(NgramLanguageModel.load(lm_path), lm_weight=lm_weight, word_bonus=word_bonus)
+
+    # Only words of the vocabulary in the lexicon
+    if lexicon_path:
+        scorer = LexiconScorer(CharTrie.from_file(lexicon_path), scorer)
+
+    return partial(beam_decode, beam_width=beam_width, top_k=top_k, blank_threshold=blank_threshold, scorer=scorer)
+
+
+def max_decode(test_func, x_data, input_length=None, decoder=None):
     """
     Calculate network probabilities with test_func and decode with max decode/greedy decode
 
     :param test_func: Keras function that takes preprocessed audio input and outputs network predictions
     :param x_data: preprocessed audio data
-    :return: decoded: max decoded network output
+    :param input_length: optional number of frames of each sequence seen by the CTC (see DataGenerator),
+                         frames after these are padding and not decoded
+    :param decoder: function decoding network output like greedy_decode (the default),
+                    e.g. utils.beam_search.beam_decode
+    :return: decoded: max decoded network output, see greedy_decode
+             decoded_length: length of each decoded sequence
     """
     y_pred = test_func([x_data])[0]
 
-    decoded = []
-    for i in range(0,y_pred.shape[0]):
+    if decoder is None:
+        decoder = greedy_decode
+
+    # The CTC discards the first two outputs of the network, input_length counts the outputs after these
+    return decoder(y_pred[:, 2:], input_length)
+
+
+def greedy_decode(y_pred, input_length=None, blank=BLANK):
+    """
+    Greedy CTC decoding of a whole batch at once: the most probable class of each frame,
+    with repeated classes collapsed and blanks removed
+
+    :param y_pred: np.ndarray[shape=(batch, frames, classes)] network output
+    :param input_length: optional number of frames of each sequence, frames after these are not decoded
+    :param blank: index of the CTC blank
+    :return: decoded: np.ndarray[shape=(batch, max_decoded_length)] with decoded sequences, padded with blank
+             decoded_length: np.ndarray[shape=(batch,)] length of each decoded sequence
+    """
+    best = np.argmax(y_pred, axis=2)
+    batch, frames = best.shape
+
+    # A frame is kept if it is not blank, differs from the frame before and is within the input length
+    keep = best != blank
+    keep[:, 1:] &= best[:, 1:] != best[:, :-1]
+    if input_length is not None:
+        keep &= np.arange(frames) < np.reshape(input_length, (-1, 1))
 
-        decoded_batch = []
-        for j in range(0,y_pred.shape[1]):
-            decoded_batch.append(np.argmax(y_pred[i][j]))
+    decoded_length = keep.sum(axis=1)
+    decoded = np.full((batch, decoded_length.max() if batch else 0), blank, dtype=best.dtype)
 
-        temp = [k for k, g in groupby(decoded_batch)]
-        temp[:] = [x for x in temp if x != [28]]
-        decoded.append(temp)
+    # Position of each kept frame in its decoded sequence
+    rows, _ = np.nonzero(keep)
+    decoded[rows, np.cumsum(keep, axis=1)[keep] - 1] = best[keep]
 
-    return decoded
+    return decoded, decoded_length
@@ -0,0 +1,256 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+import glob
+import json
+import os
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+import pandas as pd
+from soundfile import info, read
+
+from feature_utils import extract_features_batch
+from text_utils import int_sequences_to_text
+from worker_utils import start_workers, stop_workers, submitter, worker
+
+# Extensions of the audio files found in directories
+AUDIO_EXTENSIONS = ('.wav', '.flac')
+
+
+def list_audio_files(input_path):
+    """
+    Audio files of a directory (searched recursively), a glob pattern or a manifest
+
+    :param input_path: directory, glob pattern (e.g. 'data/*.flac'), .csv file with a filename column
+                       (optionally num_samples, see import_librispeech.py) or text file with one path per line
+    :return: paths: list of paths of audio files, sorted for directories and glob patterns
+             num_samples: list with the number of samples of each file if in the manifest, else None
+    """
+    if os.path.isdir(input_path):
+        paths = []
+        for root, _, filenames in os.walk(input_path):
+            paths.extend(os.path.join(root, filename) for filename in filenames
+                         if filename.lower().endswith(AUDIO_EXTENSIONS))
+        return sorted(paths), None
+
+    if glob.has_magic(input_path):
+        return sorted(glob.glob(input_path)), None
+
+    if not os.path.isfile(input_path):
+        raise ValueError('Not a valid directory, glob pattern or manifest: ', input_path)
+
+    if input_path.endswith('.csv'):
+        df = pd.read_csv(input_path)
+        num_samples = df['num_samples'].tolist() if 'num_samples' in df else None
+        return df['filename'].tolist(), num_samples
+
+    with open(input_path) as f:
+        return [line.strip() for line in f if line.strip()], None
+
+
+def read_transcribed_paths(output_path):
+    """
+    Paths of the files already in the output of an earlier run. A last line only partly written (when the
+    run was stopped) is removed from the file, so new results are appended after the last complete line.
+
+    :param output_path: path of .jsonl output file
+    :return: set of paths
+    """
+    if not os.path.isfile(output_path):
+        return set()
+
+    paths = set()
+    complete = 0
+    with open(output_path, 'rb') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            paths.add(json.loads(line)['path'])
+            complete += len(line)
+
+    if complete < os.path.getsize(output_path):
+        with open(output_path, 'r+b') as f:
+            f.truncate(complete)
+
+    return paths
+
+
+def transcribe_files(test_func, paths, num_samples=None, feature_type='mfcc', batch_size=32, frame_length=320,
+                     hop_length=160, mfcc_features=26, n_mels=40, sr=16000, decoder=None, workers=4,
+                     sort_window=4096, pool=None):
+    """
+    Transcribes audio files in batches of similar length, and yields the results in the order of paths
+
+    Each window of sort_window files is sorted by length (from num_samples or the audio file headers) and split
+    into batches of batch_size files. Audio decoding and feature extraction of the next batches, and decoding of
+    the previous batches, run in a pool of worker processes while the network runs on the current batch in this
+    process. Only the results of one window are held back to restore the order.
+
+    :param test_func: Keras function that takes preprocessed audio input and outputs network predictions
+    :param paths: list of paths of audio files
+    :param num_samples: optional list with the number of samples of each file, else read from the files
+    :param feature_type: mfcc or spectrogram
+    :param batch_size: number of files in each batch
+    :param frame_length: length of the frames to be extracted
+    :param hop_length: length of hops (for overlap)
+    :param mfcc_features: number of mfcc features to extract
+    :param n_mels: number of mels
+    :param sr: sampling rate of the audio the model is trained on, files with other sampling rates are not read
+    :param decoder: function decoding network output, see max_decode. Must be picklable if workers > 1
+    :param workers: number of worker processes, 0 or 1 does all work in this process
+    :param sort_window: number of files sorted by length together
+    :param pool: optional pool of workers processes started with worker_utils.start_workers, with the same
+                 settings, used instead of starting a pool here. Start it before loading the model (see
+                 worker_utils.start_workers). The pool is not stopped
+    :return: generator of one dictionary per file, in the order of paths: path, transcript, duration (seconds of
+             audio) and time (seconds of feature extraction, network and decoding of its batch, per file).
+             Files that can not be read give a dictionary with path and error
+    """
+    feature_params = {'feature_type': feature_type, 'frame_length': frame_length, 'hop_length': hop_length,
+                      'mfcc_features': mfcc_features, 'n_mels': n_mels, 'sr': sr}
+    own_pool = pool is None
+    if own_pool:
+        pool = start_workers(workers, feature_params, decoder)
+    submit = submitter(pool)
+
+    batches = _length_sorted_batches(paths, num_samples, batch_size, sort_window)
+
+    # Batches prepared ahead of the network, and batches waiting to be decoded
+    max_pending = max(2, 2 * workers)
+    features = deque()
+    decoding = deque()
+
+    # Results not yielded yet, by index in paths
+    results = {}
+    next_index = 0
+
+    try:
+        for indexes in batches:
+            features.append((indexes, submit(_extract_files, ([paths[i] for i in indexes],))))
+            if len(features) < max_pending:
+                continue
+
+            decoding.append(_run_network(test_func, submit, *features.popleft()))
+            while len(decoding) > max_pending:
+                _collect(decoding.popleft(), paths, results)
+
+            while next_index in results:
+                yield results.pop(next_index)
+                next_index += 1
+
+        while features:
+            decoding.append(_run_network(test_func, submit, *features.popleft()))
+        while decoding:
+            _collect(decoding.popleft(), paths, results)
+
+        while next_index in results:
+            yield results.pop(next_index)
+            next_index += 1
+    finally:
+        if own_pool:
+            stop_workers(pool)
+
+
+def _length_sorted_batches(paths, num_samples, batch_size, sort_window):
+    """Indexes of the files in each batch, files of each window of sort_window files sorted by length"""
+    for start in range(0, len(paths), sort_window):
+        window = range(start, min(start + sort_window, len(paths)))
+        if num_samples is not None:
+            lengths = np.array([num_samples[i] for i in window])
+        else:
+            lengths = np.array([_num_samples(paths[i]) for i in window])
+
+        order = np.array(window)[np.argsort(lengths, kind='mergesort')]
+        for i in range(0, len(order), batch_size):
+            yield order[i:i + batch_size].tolist()
+
+
+def _num_samples(path):
+    """Number of samples of an audio file read from its header, 0 if it can not be read"""
+    try:
+        return info(path).frames
+    except Exception:
+        return 0
+
+
+def _run_network(test_func, submit, indexes, extracted):
+    x_data, input_length, durations, errors, extract_time = extracted.get()
+
+    started = time.time()
+    y_pred = test_func([x_data])[0] if x_data is not None else None
+    network_time = time.time() - started
+
+    return indexes, durations, errors, extract_time + network_time, submit(_decode_files, (y_pred, input_length))
+
+
+def _collect(decoded, paths, results):
+    """Adds the results of a decoded batch to results"""
+    indexes, durations, errors, batch_time, transcripts = decoded
+    transcripts, decode_time = transcripts.get()
+    time_per_file = (batch_time + decode_time) / len(indexes)
+
+    transcripts = iter(transcripts)
+    for i, duration, error in zip(indexes, durations, errors):
+        if error is not None:
+            results[i] = OrderedDict([('path', paths[i]), ('error', error)])
+        else:
+            results[i] = OrderedDict([('path', paths[i]), ('transcript', next(transcripts)),
+                                      ('duration', duration), ('time', time_per_file)])
+
+
+def _extract_files(paths):
+    """Padded features and input length (as seen by the CTC) of the audio files in paths that can be read,
+    with the duration or read error of each file and the time taken"""
+    started = time.time()
+    params = worker['feature_params']
+    sr = params['sr']
+    x_data_raw = []
+    durations = []
+    errors = []
+    for path in paths:
+        try:
+            frames, file_sr = read(path)
+            if file_sr != sr:
+                raise ValueError('Not a valid sampling rate: ', file_sr)
+            if len(frames.shape) != 1 or len(frames) < params['frame_length']:
+                raise ValueError('Not a valid mono audio time series of shape: ', frames.shape)
+        except Exception as e:
+            durations.append(None)
+            errors.append(str(e))
+            continue
+
+        x_data_raw.append(frames)
+        durations.append(len(frames) / float(sr))
+        errors.append(None)
+
+    if not x_data_raw:
+        return None, None, durations, errors, time.time() - started
+
+    x_data, x_length = extract_features_batch(x_data_raw, sr, params['feature_type'], params['frame_length'],
+                                              params['hop_length'], params['mfcc_features'], params['n_mels'])
+
+    # -2 because ctc discards the first two outputs of the rnn network
+    return x_data, x_length - 2, durations, errors, time.time() - started
+
+
+def _decode_files(y_pred, input_length):
+    """Transcripts of the network predictions of a batch, and the time taken"""
+    if y_pred is None:
+        return [], 0.0
+
+    started = time.time()
+    decoded, decoded_length = worker['decoder'](y_pred[:, 2:], input_length)
+    return int_sequences_to_text(decoded, decoded_length), time.time() - started
@@ -2,6 +2,12 @@
 # at https://github.com/mozilla/DeepSpeech
 # mozilla/DeepSpeech is licensed under the Mozilla Public License 2.0
 
+import numpy as np
+import pandas as pd
+
+# Number of text pairs aligned at once by edit_operations
+EDIT_GROUP_SIZE = 256
+
 
 def wer(original, result):
     """
@@ -15,7 +21,7 @@ def wer(original, result):
     # Therefore we split the strings into words first:
     original = original.split()
     result = result.split()
-    wer = levenshtein(original, result) / float(len(original))
+    wer = edit_distance(original, result) / float(len(original))
 
     if wer > 1.0:
         return 1.0
@@ -30,15 +36,193 @@ def wers(originals, results):
     except:
         print(originals)
         raise("ERROR assert count>0 - looks like data is missing")
-    rates = []
-    mean = 0.0
     assert count == len(results)
-    for i in range(count):
-        rate = wer(originals[i], results[i])
-        mean = mean + rate
-        rates.append(rate)
+    original_words = [t.split() for t in originals]
+    word_edits = edit_operations(original_words, [t.split() for t in results])
+    n_words = np.array([len(w) for w in original_words], dtype=np.int64)
+    rates = np.minimum(word_edits.sum(axis=1) / np.maximum(n_words, 1).astype(np.float64), 1.0)
+
+    return rates.tolist(), rates.mean()
+
+
+def error_rates(originals, results):
+    """
+    Word and character error rates of whole lists of texts at once. Words are aligned with edit_operations,
+    characters with the bit-parallel edit_distance, with whitespace collapsed to single spaces.
+
+    :param originals: list of original texts
+    :param results: list of predicted texts
+    :return: dict with
+             'wer', 'cer': error rate of all texts, the errors of all texts / the words or characters of all originals
+             'wers', 'cers': np.ndarray with the error rate of each text
+             'word_edits': np.ndarray[shape=(n_texts, 3)] word substitutions, insertions and deletions of each text
+             'char_errors': np.ndarray with the character edit distance of each text
+             'n_words', 'n_chars': np.ndarray with the number of words or characters of each original
+    """
+    original_words = [t.split() for t in originals]
+    result_words = [t.split() for t in results]
+    word_edits = edit_operations(original_words, result_words)
+    char_errors = np.array([edit_distance(' '.join(o), ' '.join(r)) for o, r in zip(original_words, result_words)],
+                           dtype=np.int64)
+
+    n_words = np.array([len(w) for w in original_words], dtype=np.int64)
+    n_chars = np.array([len(' '.join(w)) for w in original_words], dtype=np.int64)
+
+    return {'wer': word_edits.sum() / float(max(n_words.sum(), 1)),
+            'cer': char_errors.sum() / float(max(n_chars.sum(), 1)),
+            'wers': word_edits.sum(axis=1) / np.maximum(n_words, 1).astype(np.float64),
+            'cers': char_errors / np.maximum(n_chars, 1).astype(np.float64),
+            'word_edits': word_edits,
+            'char_errors': char_errors,
+            'n_words': n_words,
+            'n_chars': n_chars}
+
+
+def edit_distance(a, b):
+    """
+    Levenshtein distance of two sequences with the bit-parallel algorithm of Myers (1999), as formulated by
+    Hyyro (2001). One column of the edit distance matrix is kept as the bits of Python integers, so each
+    token of the longer sequence is a few integer operations instead of a loop over the shorter sequence.
+
+    :param a: sequence (string or list of tokens)
+    :param b: sequence
+    :return: levenshtein(a, b)
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    if not a:
+        return len(b)
+
+    # Bit k of match[c] is set if a[k] == c
+    match = {}
+    for k, c in enumerate(a):
+        match[c] = match.get(c, 0) | (1 << k)
+
+    mask = (1 << len(a)) - 1
+    last = 1 << (len(a) - 1)
+
+    # Positive and negative vertical differences of the current column
+    pv, mv, distance = mask, 0, len(a)
+    for c in b:
+        eq = match.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & last:
+            distance += 1
+        elif mh & last:
+            distance -= 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+
+    return distance
+
+
+def edit_operations(references, hypotheses):
+    """
+    Substitutions, insertions and deletions of a minimal alignment (Levenshtein distance) of each pair of sequences.
+    The tokens (words, or characters of strings) are interned to integer ids, and pairs of similar length are
+    aligned EDIT_GROUP_SIZE at a time with NumPy, one anti-diagonal of the edit distance matrices per step.
+
+    :param references: list of sequences (strings or lists of tokens)
+    :param hypotheses: list of sequences, same length as references
+    :return: np.ndarray[shape=(n_pairs, 3)] substitutions, insertions and deletions,
+             their sum is levenshtein(reference, hypothesis)
+    """
+    if len(references) != len(hypotheses):
+        raise ValueError('Not the same number of references and hypotheses: ', (len(references), len(hypotheses)))
+
+    ref_length = np.array([len(r) for r in references], dtype=np.int64)
+    hyp_length = np.array([len(h) for h in hypotheses], dtype=np.int64)
+
+    # All tokens as integer ids, references first
+    tokens = [t for r in references for t in r] + [t for h in hypotheses for t in h]
+    ids = pd.factorize(pd.Series(tokens, dtype=object))[0] if tokens else np.zeros(0, dtype=np.int64)
+    ref_ids = np.split(ids[:ref_length.sum()], np.cumsum(ref_length)[:-1]) if len(references) else []
+    hyp_ids = np.split(ids[ref_length.sum():], np.cumsum(hyp_length)[:-1]) if len(hypotheses) else []
+
+    edits = np.zeros((len(references), 3), dtype=np.int64)
+    order = np.lexsort((hyp_length, ref_length))
+    for start in range(0, len(order), EDIT_GROUP_SIZE):
+        group = order[start:start + EDIT_GROUP_SIZE]
+        edits[group] = _align_group([ref_ids[i] for i in group], [hyp_ids[i] for i in group],
+                                    ref_length[group], hyp_length[group])
+
+    return edits
+
+
+def _align_group(refs, hyps, ref_length, hyp_length):
+    """
+    Edit operations of a group of pairs of id sequences, along the anti-diagonals of their edit distance matrices.
+    Cell (i, j) lies on anti-diagonal i + j and only depends on the two previous anti-diagonals, so each
+    anti-diagonal of all pairs is computed at once. The anti-diagonals are indexed by i.
+
+    Each cell keeps its cost and number of deletions, which give the other operations of its alignment:
+    insertions = deletions + j - i and substitutions = cost - insertions - deletions.
+    """
+    n, m = ref_length.max(), hyp_length.max()
+    batch = len(refs)
+
+    ref = np.full((batch, n), -1, dtype=np.int32)
+    hyp = np.full((batch, m + 1), -2, dtype=np.int32)
+    for b in range(batch):
+        ref[b, :ref_length[b]] = refs[b]
+        hyp[b, :hyp_length[b]] = hyps[b]
+
+    i = np.arange(1, n + 1)
+    unreachable = np.int32(np.iinfo(np.int32).max // 4)
+
+    # Cost and deletions of the cells on the previous two anti-diagonals, starting with anti-diagonals -1 and 0
+    cost_2 = np.full((batch, n + 1), unreachable, dtype=np.int32)
+    cost_1 = cost_2.copy()
+    cost_1[:, 0] = 0
+    del_1 = np.zeros((batch, n + 1), dtype=np.int32)
+    del_2 = del_1.copy()
+
+    costs = np.zeros(batch, dtype=np.int32)
+    deletions = np.zeros(batch, dtype=np.int32)
+    end = ref_length + hyp_length
+    done = np.nonzero(end == 0)[0]
+    costs[done] = 0
+
+    for d in range(1, n + m + 1):
+        # Match or substitution from (i - 1, j - 1), deletion from (i - 1, j), insertion from (i, j - 1)
+        mismatch = ref != hyp[:, np.clip(d - 1 - i, 0, m)]
+        substitute = cost_2[:, :-1] + mismatch
+        delete = cost_1[:, :-1] + 1
+        insert = cost_1[:, 1:] + 1
+
+        # Ties prefer substitution, then deletion
+        use_sub = (substitute <= delete) & (substitute <= insert)
+        use_del = ~use_sub & (delete <= insert)
+
+        cost = np.empty_like(cost_1)
+        cost[:, 0] = d
+        cost[:, 1:] = np.where(use_sub, substitute, np.where(use_del, delete, insert))
+
+        dels = np.empty_like(del_1)
+        dels[:, 0] = 0
+        dels[:, 1:] = np.where(use_sub, del_2[:, :-1], np.where(use_del, del_1[:, :-1] + 1, del_1[:, 1:]))
+
+        # Cells outside the matrices, j < 0 or j > m
+        if d > m:
+            cost[:, :d - m] = unreachable
+        if d < n:
+            cost[:, d + 1:] = unreachable
+
+        # Pairs whose last cell (ref_length, hyp_length) is on this anti-diagonal
+        done = np.nonzero(end == d)[0]
+        costs[done] = cost[done, ref_length[done]]
+        deletions[done] = dels[done, ref_length[done]]
+
+        cost_2, del_2 = cost_1, del_1
+        cost_1, del_1 = cost, dels
 
-    return rates, mean / float(count)
+    insertions = deletions + hyp_length - ref_length
+    return np.stack([costs - insertions - deletions, insertions, deletions], axis=1)
 
 
 # The following code is from: http://hetland.org/coding/python/levenshtein.py
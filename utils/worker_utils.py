@@ -0,0 +1,82 @@
+"""
+LICENSE
+
+This file is part of Speech recognition with CTC in Keras.
+The project is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+The project is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this project.
+If not, see http://www.gnu.org/licenses/.
+
+"""
+
+from multiprocessing import Pool
+
+from audio_store import AudioStore
+from train_utils import greedy_decode
+
+# Settings of the current (worker) process, see init_worker
+worker = {}
+
+
+def start_workers(workers, feature_params, decoder=None, audio_store_dir=None):
+    """
+    Starts a pool of worker processes for audio decoding, feature extraction and decoding of network output
+
+    TensorFlow does not support forking a process that already has a session, so start the pool before the
+    model is loaded.
+
+    :param workers: number of worker processes, with 0 or 1 this process is set up instead and no pool is started
+    :param feature_params: dictionary with feature_type, frame_length, hop_length, mfcc_features and n_mels
+                           (and sr where needed), see feature_utils.extract_features_batch
+    :param decoder: function decoding network output, see max_decode. Default is greedy_decode.
+                    Must be picklable if workers > 1
+    :param audio_store_dir: optional directory of an AudioStore, audio in the store is not decoded
+    :return: multiprocessing.Pool, or None without worker processes
+    """
+    settings = (feature_params, decoder, audio_store_dir)
+    if workers > 1:
+        return Pool(workers, init_worker, settings)
+
+    init_worker(*settings)
+    return None
+
+
+def stop_workers(pool):
+    """Stops a pool started with start_workers"""
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+
+
+def submitter(pool):
+    """
+    :param pool: pool started with start_workers, or None
+    :return: function submitting func with a tuple of args to the pool, or running it in this process without a
+             pool. Both return an object with get(), like multiprocessing's AsyncResult
+    """
+    return pool.apply_async if pool is not None else apply_here
+
+
+def init_worker(feature_params, decoder, audio_store_dir):
+    """Sets the settings of the current process, see start_workers"""
+    worker['feature_params'] = feature_params
+    worker['decoder'] = decoder if decoder is not None else greedy_decode
+    worker['audio_store'] = AudioStore(audio_store_dir) if audio_store_dir else None
+
+
+def apply_here(func, args):
+    """Runs func in this process, with the interface of multiprocessing's apply_async"""
+    return AppliedResult(func(*args))
+
+
+class AppliedResult(object):
+    """Result of a function run in this process, with the interface of multiprocessing's AsyncResult"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value